@@ -0,0 +1,237 @@
+"""
+Selection and division of raster bands. Bands selected by user are opened as exactextract raster sources
+keeping their numbers in the raster, so only selected bands are read. Bands can be divided into ranges calculated by separate subtasks, every batch
+of features is calculated once for each band range and results of band ranges are joined column-wise
+by the ID field.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+from exactextract.raster import GDALRasterSource
+from osgeo import gdal
+
+from .coverage_index import raster_bands
+from .partitioning import FeatureBatch
+from .result_cache import split_operation_columns
+
+
+@dataclass(frozen=True)
+class RasterBand:
+    """
+    Single band of the raster with the name exactextract gives it in column names.
+    """
+
+    raster_path: str
+    band: int
+    name: str
+
+
+@dataclass
+class BandRange:
+    """
+    Consecutive bands of rasters calculated together by one subtask.
+    """
+
+    bands: List[RasterBand]
+
+    def sources(self) -> List[GDALRasterSource]:
+        """
+        Opens bands of the range as exactextract raster sources. Bands keep names they have when whole
+        rasters are calculated, so columns of all ranges can be joined.
+
+        Returns:
+            List[GDALRasterSource]: raster source of every band.
+        """
+        datasets: Dict[str, gdal.Dataset] = {}
+        sources = []
+        for raster_band in self.bands:
+            dataset = datasets.get(raster_band.raster_path)
+            if dataset is None:
+                dataset = gdal.Open(raster_band.raster_path)
+                datasets[raster_band.raster_path] = dataset
+            sources.append(
+                GDALRasterSource(dataset, raster_band.band, name=raster_band.name)
+            )
+        return sources
+
+    def description(self) -> str:
+        """
+        Returns:
+            str: names of the first and the last band of the range.
+        """
+        return f"{self.bands[0].name} - {self.bands[-1].name}"
+
+
+@dataclass
+class BandRangeResult:
+    """
+    Result of a batch of features calculated for one band range.
+
+    Attributes:
+        band_range (int): index of the band range.
+        result: pandas DataFrame with statistics of bands of the range.
+    """
+
+    band_range: int
+    result: object
+
+
+def select_bands(
+    rasters: List[str], selected_bands: Optional[Dict[str, List[int]]] = None
+) -> Optional[List[RasterBand]]:
+    """
+    Lists calculated bands of all rasters with their numbers and names in the raster.
+
+    Args:
+        rasters (List[str]): paths to rasters.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters,
+            all bands of other rasters are calculated.
+
+    Returns:
+        Optional[List[RasterBand]]: calculated bands or None if some raster can't be opened by GDAL or has no bands.
+    """
+    selected_bands = selected_bands or {}
+    bands: List[RasterBand] = []
+    for raster_path in rasters:
+        dataset = gdal.Open(raster_path)
+        if dataset is None or dataset.RasterCount == 0:
+            return None
+        bands.extend(
+            RasterBand(raster_path, band, name)
+            for band, name in raster_bands(
+                raster_path, dataset.RasterCount, selected_bands.get(raster_path)
+            )
+        )
+    return bands
+
+
+def band_sources(
+    rasters: List[str], selected_bands: Optional[Dict[str, List[int]]] = None
+) -> List:
+    """
+    Args:
+        rasters (List[str]): paths to rasters.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters.
+
+    Returns:
+        List: exactextract raster sources of selected bands, or paths to rasters if all bands are calculated.
+    """
+    if not selected_bands:
+        return rasters
+    bands = select_bands(rasters, selected_bands)
+    if bands is None:
+        # exactextract reports rasters it can't open
+        return rasters
+    return BandRange(bands).sources()
+
+
+def split_band_ranges(
+    rasters: List[str],
+    bands_per_range: int,
+    selected_bands: Optional[Dict[str, List[int]]] = None,
+) -> Optional[List[BandRange]]:
+    """
+    Divides calculated bands of all rasters into ranges of consecutive bands. exactextract names columns
+    without band names when only one band is calculated, so every range gets at least two bands.
+
+    Args:
+        rasters (List[str]): paths to rasters.
+        bands_per_range (int): requested number of bands in one range.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters,
+            see `select_bands`.
+
+    Returns:
+        Optional[List[BandRange]]: band ranges or None if some raster can't be opened by GDAL or has no bands.
+    """
+    bands = select_bands(rasters, selected_bands)
+    if bands is None:
+        return None
+    bands_per_range = max(2, bands_per_range)
+    ranges = [
+        bands[i : i + bands_per_range] for i in range(0, len(bands), bands_per_range)
+    ]
+    if len(ranges) > 1 and len(ranges[-1]) == 1:
+        ranges[-2].extend(ranges.pop())
+    return [BandRange(range_bands) for range_bands in ranges]
+
+
+def split_batches_by_bands(
+    batches: List[FeatureBatch], band_ranges: List[BandRange]
+) -> List[FeatureBatch]:
+    """
+    Creates a batch for every batch of features and band range. Batches of the same features follow each
+    other, so subtasks read the same raster window at about the same time.
+
+    Args:
+        batches (List[FeatureBatch]): batches of features.
+        band_ranges (List[BandRange]): band ranges.
+
+    Returns:
+        List[FeatureBatch]: batches with band ranges and new ids, cost is divided by the number of bands.
+    """
+    bands_count = sum(len(band_range.bands) for band_range in band_ranges)
+    split_batches = []
+    for batch in batches:
+        for range_index, band_range in enumerate(band_ranges):
+            split_batches.append(
+                replace(
+                    batch,
+                    estimated_cost=batch.estimated_cost
+                    * len(band_range.bands)
+                    / bands_count,
+                    batch_id=len(split_batches),
+                    band_range=range_index,
+                )
+            )
+    return split_batches
+
+
+def join_band_ranges(
+    results: List[BandRangeResult],
+    index_column: str,
+    include_cols: List[str],
+    operations_count: int,
+):
+    """
+    Joins results of band ranges column-wise by the ID field. Columns are ordered the same way
+    exactextract orders them when all bands are calculated together - operations one after another,
+    every operation for all bands.
+
+    Args:
+        results (List[BandRangeResult]): results of batches of all band ranges.
+        index_column (str): the ID field, unique for every feature.
+        include_cols (List[str]): columns copied from the input layer.
+        operations_count (int): number of calculated operations.
+
+    Returns:
+        pandas DataFrame with statistics of all bands, a row for every feature.
+    """
+    import pandas as pd
+
+    range_results: Dict[int, List] = {}
+    for result in results:
+        range_results.setdefault(result.band_range, []).append(result.result)
+    frames = [pd.concat(range_results[key]) for key in sorted(range_results)]
+
+    joined = frames[0]
+    for frame in frames[1:]:
+        # features of canceled batches may be missing in some ranges
+        statistic_columns = [
+            column for column in frame.columns if column not in include_cols
+        ]
+        joined = joined.merge(
+            frame[[index_column] + statistic_columns], on=index_column, how="outer"
+        )
+
+    operation_columns = [
+        split_operation_columns(list(frame.columns), include_cols, operations_count)
+        for frame in frames
+    ]
+    if any(columns is None for columns in operation_columns):
+        return joined
+    ordered_columns = [column for column in include_cols if column in joined.columns]
+    for operation in range(operations_count):
+        for columns in operation_columns:
+            ordered_columns.extend(columns[operation])
+    return joined[ordered_columns]
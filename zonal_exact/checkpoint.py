@@ -0,0 +1,245 @@
+"""
+Checkpoints of long calculations. Result of every finished batch is saved as a shard in the run directory
+next to the output file together with a manifest, so an interrupted calculation can be resumed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Set
+
+from qgis.core import (
+    QgsCoordinateTransformContext,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from .layer_writer import OutputWriteError
+from .partitioning import FeatureBatch
+
+MANIFEST_FILE_NAME = "manifest.json"
+BATCHES_FILE_NAME = "batches.json"
+
+
+def run_directory(output_file_path: Path) -> Path:
+    """
+    Args:
+        output_file_path (Path): path to the output file of the calculation.
+
+    Returns:
+        Path: directory with checkpoints of the calculation writing to the output file.
+    """
+    output_file_path = Path(output_file_path)
+    return output_file_path.with_name(f"{output_file_path.stem}_zonal_run")
+
+
+def run_key(parameters: Dict) -> str:
+    """
+    Creates the key identifying the calculation. Calculations with the same key calculate the same statistics
+    for the same features, so checkpoints of one of them can be used by the other.
+
+    Args:
+        parameters (Dict): JSON serializable parameters of the calculation.
+
+    Returns:
+        str: hash of parameters.
+    """
+    return hashlib.sha1(
+        json.dumps(parameters, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class RunCheckpoint:
+    """
+    Run directory holding the manifest, the planned batches and shards with results of finished batches.
+    Tabular results are stored as pickled pandas DataFrames and geospatial results as GeoPackages.
+    """
+
+    def __init__(
+        self,
+        run_dir: Path,
+        key: str,
+        parameters: Dict,
+        batches: List[FeatureBatch],
+        completed: Set[int] = None,
+    ):
+        """
+        Attributes:
+            run_dir (Path): The run directory.
+            key (str): The key of the calculation, see `run_key`.
+            parameters (Dict): The parameters of the calculation written to the manifest.
+            batches (List[FeatureBatch]): All batches of the calculation.
+            completed (Set[int]): The ids of batches with saved results.
+        """
+        self.run_dir: Path = Path(run_dir)
+        self.key: str = key
+        self.parameters: Dict = parameters
+        self.batches: List[FeatureBatch] = batches
+        self.completed: Set[int] = completed or set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(
+        cls, run_dir: Path, parameters: Dict, batches: List[FeatureBatch]
+    ) -> "RunCheckpoint":
+        """
+        Opens checkpoints of the same calculation saved earlier in the run directory or starts new ones.
+        Resumed calculation uses batches stored in the run directory, so finished batches match the saved shards.
+
+        Args:
+            run_dir (Path): The run directory.
+            parameters (Dict): JSON serializable parameters of the calculation.
+            batches (List[FeatureBatch]): Newly planned batches, used if there's nothing to resume.
+
+        Returns:
+            RunCheckpoint: checkpoints of the calculation.
+        """
+        run_dir = Path(run_dir)
+        key = run_key(parameters)
+        manifest_path = run_dir / MANIFEST_FILE_NAME
+        if manifest_path.exists():
+            try:
+                manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+                if manifest.get("run_key") == key:
+                    stored_batches = json.loads(
+                        (run_dir / BATCHES_FILE_NAME).read_text(encoding="utf-8")
+                    )
+                    return cls(
+                        run_dir,
+                        key,
+                        parameters,
+                        [FeatureBatch(**batch) for batch in stored_batches],
+                        set(manifest.get("completed", [])),
+                    )
+            except (OSError, ValueError, TypeError):
+                pass  # damaged checkpoints are replaced by new ones
+            # checkpoints of another calculation, start from scratch
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+        checkpoint = cls(run_dir, key, parameters, batches)
+        run_dir.mkdir(parents=True, exist_ok=True)
+        (run_dir / BATCHES_FILE_NAME).write_text(
+            json.dumps([asdict(batch) for batch in batches]), encoding="utf-8"
+        )
+        checkpoint.write_manifest()
+        return checkpoint
+
+    @property
+    def pending_batches(self) -> List[FeatureBatch]:
+        """
+        Returns:
+            List[FeatureBatch]: batches without saved results.
+        """
+        return [batch for batch in self.batches if batch.batch_id not in self.completed]
+
+    def shard_path(self, batch_id: int, geospatial_output: bool) -> Path:
+        """
+        Args:
+            batch_id (int): id of the batch.
+            geospatial_output (bool): whether the result is geospatial.
+
+        Returns:
+            Path: path to the shard with the result of the batch.
+        """
+        extension = "gpkg" if geospatial_output else "pkl"
+        return self.run_dir / f"batch_{batch_id}.{extension}"
+
+    def write_manifest(self):
+        """
+        Writes the manifest atomically, so it's never left half written.
+        """
+        manifest = {
+            "run_key": self.key,
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "parameters": self.parameters,
+            "batches_count": len(self.batches),
+            "completed": sorted(self.completed),
+        }
+        temporary_path = self.run_dir / f"{MANIFEST_FILE_NAME}.tmp"
+        temporary_path.write_text(
+            json.dumps(manifest, indent=2, default=str), encoding="utf-8"
+        )
+        os.replace(temporary_path, self.run_dir / MANIFEST_FILE_NAME)
+
+    def save_batch(self, batch: FeatureBatch, result):
+        """
+        Saves the result of the batch as a shard and marks the batch as completed in the manifest. The batch is
+        marked as completed only once its shard is written.
+
+        Args:
+            batch (FeatureBatch): finished batch.
+            result: QgsVectorLayer with geospatial result or pandas DataFrame.
+
+        Returns:
+            result of the batch, geospatial result is replaced with the layer reading the saved shard.
+
+        Raises:
+            OutputWriteError: if the shard or the manifest can't be written.
+        """
+        geospatial_output = isinstance(result, QgsVectorLayer)
+        shard_path = self.shard_path(batch.batch_id, geospatial_output)
+        try:
+            if geospatial_output:
+                # shards written by worker processes are already in the run directory
+                if Path(result.source().split("|")[0]) != shard_path:
+                    options = QgsVectorFileWriter.SaveVectorOptions()
+                    options.driverName = "GPKG"
+                    error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+                        result,
+                        str(shard_path),
+                        QgsCoordinateTransformContext(),
+                        options,
+                    )
+                    if error != QgsVectorFileWriter.NoError:
+                        raise OutputWriteError(
+                            f"Unable to save checkpoint {shard_path}: {message}"
+                        )
+                    result = QgsVectorLayer(str(shard_path), "temporary_layer", "ogr")
+            else:
+                result.to_pickle(shard_path)
+            with self._lock:
+                self.completed.add(batch.batch_id)
+                try:
+                    self.write_manifest()
+                except OSError:
+                    self.completed.discard(batch.batch_id)
+                    raise
+        except OSError as ex:
+            raise OutputWriteError(
+                f"Unable to save checkpoint {shard_path}: {ex}"
+            ) from ex
+        return result
+
+    def load_results(self, geospatial_output: bool) -> List:
+        """
+        Loads results of batches completed before the calculation was resumed.
+
+        Args:
+            geospatial_output (bool): whether results are geospatial.
+
+        Returns:
+            List: QgsVectorLayer or pandas DataFrame for every completed batch.
+        """
+        results = []
+        for batch_id in sorted(self.completed):
+            shard_path = self.shard_path(batch_id, geospatial_output)
+            if geospatial_output:
+                results.append(
+                    QgsVectorLayer(str(shard_path), "temporary_layer", "ogr")
+                )
+            else:
+                import pandas as pd
+
+                results.append(pd.read_pickle(shard_path))
+        return results
+
+    def remove(self):
+        """
+        Removes the run directory after the calculation has finished.
+        """
+        shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -0,0 +1,612 @@
+"""
+Coverage fractions of polygons on raster grids. Coverage fractions depend only on polygons and the grid,
+so they're calculated once per grid and reused by every raster sharing it. Each additional raster only
+reads its pixels and reduces them with coverage fractions in one vectorised pass.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from exactextract import exact_extract
+from exactextract.feature import FeatureSource
+from exactextract.raster import GDALRasterSource
+from osgeo import gdal
+
+from .result_cache import split_operation_columns
+
+# statistics calculated from coverage fractions without exactextract
+LINEAR_STATS = ("count", "sum", "mean", "weighted_sum", "weighted_mean")
+WEIGHTED_STATS = ("weighted_sum", "weighted_mean")
+# exactextract names the single band weights raster given as a path
+WEIGHTS_NAME = "weight"
+# names of arrays of the coverage index saved on disk
+INDEX_ARRAYS = ("feature_ids", "offsets", "cell_ids", "coverage")
+
+
+@dataclass
+class CoveredCells:
+    """
+    Distinct raster cells covered by features of the coverage index, as row-major indexes of cells in the whole
+    raster in ascending order, with the position of every cell of the index among them - columns of the sparse
+    feature x cell matrix.
+    """
+
+    cell_ids: np.ndarray
+    columns: np.ndarray
+
+
+@dataclass(frozen=True)
+class RasterGrid:
+    """
+    Size, geotransform and CRS of the raster. Rasters with equal grids have cells in the same places.
+    """
+
+    width: int
+    height: int
+    geotransform: Tuple[float, ...]
+    crs_wkt: str
+
+
+def read_grid(raster_path: str) -> Optional[RasterGrid]:
+    """
+    Args:
+        raster_path (str): path to the raster.
+
+    Returns:
+        Optional[RasterGrid]: grid of the raster or None if raster can't be opened by GDAL.
+    """
+    dataset = gdal.Open(raster_path)
+    if dataset is None:
+        return None
+    return RasterGrid(
+        dataset.RasterXSize,
+        dataset.RasterYSize,
+        tuple(dataset.GetGeoTransform()),
+        dataset.GetProjection(),
+    )
+
+
+def raster_band_names(raster_path: str, bands_count: int) -> List[str]:
+    """
+    Names bands of the raster the same way exactextract names rasters given as paths.
+
+    Args:
+        raster_path (str): path to the raster.
+        bands_count (int): number of bands of the raster.
+
+    Returns:
+        List[str]: name of every band.
+    """
+    root = Path(raster_path).stem
+    if bands_count > 1:
+        return [f"{root}_band_{band}" for band in range(1, bands_count + 1)]
+    return [root]
+
+
+def raster_bands(
+    raster_path: str, bands_count: int, selected: Optional[List[int]] = None
+) -> List[Tuple[int, str]]:
+    """
+    Numbers and names of calculated bands of the raster. Selected bands keep names with their numbers
+    in the raster, e.g. `raster_band_3`, so columns have the same names as when all bands are calculated.
+
+    Args:
+        raster_path (str): path to the raster.
+        bands_count (int): number of bands of the raster.
+        selected (Optional[List[int]]): numbers of bands selected by user, all bands if not set.
+
+    Returns:
+        List[Tuple[int, str]]: number and name of every calculated band.
+    """
+    names = raster_band_names(raster_path, bands_count)
+    if not selected:
+        return list(enumerate(names, start=1))
+    return [(band, names[band - 1]) for band in selected]
+
+
+def column_name(
+    values_name: str, stat: str, prefixed: bool, weights_name: Optional[str] = None
+) -> str:
+    """
+    Names the output column the same way exactextract does. Columns are prefixed with names of rasters
+    only if more than one raster band is used.
+
+    Args:
+        values_name (str): name of the raster band.
+        stat (str): name of the statistic.
+        prefixed (bool): whether more than one raster band is used.
+        weights_name (Optional[str]): name of the weights raster for weighted statistics.
+
+    Returns:
+        str: name of the output column.
+    """
+    if not prefixed:
+        return stat
+    if weights_name is not None:
+        return f"{values_name}_{weights_name}_{stat}"
+    return f"{values_name}_{stat}"
+
+
+class _RecordingFeatureSource(FeatureSource):
+    """
+    Feature source passing features of another source to exactextract and recording their ids,
+    so rows of exactextract output can be matched with features.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.feature_ids: List[int] = []
+
+    def count(self):
+        return self.source.count()
+
+    def srs_wkt(self):
+        return self.source.srs_wkt()
+
+    def __iter__(self):
+        self.feature_ids = []
+        for feature in self.source:
+            self.feature_ids.append(feature.feature.id())
+            yield feature
+
+
+@dataclass
+class CoverageIndex:
+    """
+    Sparse feature x cell matrix of coverage fractions in CSR layout. Cells of the feature in row `i`
+    are `cell_ids[offsets[i]:offsets[i + 1]]`, row-major indexes of cells in the whole raster.
+    """
+
+    feature_ids: np.ndarray
+    offsets: np.ndarray
+    cell_ids: np.ndarray
+    coverage: np.ndarray
+
+    @classmethod
+    def build(cls, feature_source, raster_path: str) -> "CoverageIndex":
+        """
+        Calculates coverage fractions of features on the grid of the raster with exactextract.
+
+        Args:
+            feature_source: exactextract feature source, e.g. `FeatureSubsetSource`.
+            raster_path (str): path to the raster defining the grid.
+
+        Returns:
+            CoverageIndex: coverage fractions of features in order of the feature source.
+        """
+        dataset = gdal.Open(raster_path)
+        recording_source = _RecordingFeatureSource(feature_source)
+        result = exact_extract(
+            vec=recording_source,
+            rast=GDALRasterSource(dataset, 1, name=""),
+            ops=["cell_id", "coverage"],
+            output="pandas",
+            strategy="feature-sequential",
+        )
+        cell_ids = [np.asarray(cells, dtype=np.int64) for cells in result["cell_id"]]
+        coverage = [
+            np.asarray(fractions, dtype=np.float64) for fractions in result["coverage"]
+        ]
+        offsets = np.zeros(len(cell_ids) + 1, dtype=np.int64)
+        np.cumsum([len(cells) for cells in cell_ids], out=offsets[1:])
+        return cls(
+            feature_ids=np.asarray(recording_source.feature_ids, dtype=np.int64),
+            offsets=offsets,
+            cell_ids=np.concatenate(cell_ids) if cell_ids else np.zeros(0, np.int64),
+            coverage=np.concatenate(coverage) if coverage else np.zeros(0),
+        )
+
+    def save(self, directory: Path):
+        """
+        Saves arrays of the index as `.npy` files.
+
+        Args:
+            directory (Path): directory of the index.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: Path) -> "CoverageIndex":
+        """
+        Opens the index saved by `save`. Arrays are memory-mapped, so they're not read into memory at once.
+
+        Args:
+            directory (Path): directory of the index.
+
+        Returns:
+            CoverageIndex: the memory-mapped index.
+        """
+        directory = Path(directory)
+        return cls(
+            **{
+                name: np.load(directory / f"{name}.npy", mmap_mode="r")
+                for name in INDEX_ARRAYS
+            }
+        )
+
+    @property
+    def features_count(self) -> int:
+        return len(self.feature_ids)
+
+    def feature_rows(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: row of the feature for every covered cell.
+        """
+        return np.repeat(
+            np.arange(self.features_count, dtype=np.int64), np.diff(self.offsets)
+        )
+
+    def covered_cells(self) -> CoveredCells:
+        """
+        Returns:
+            CoveredCells: cells covered by features, only values of these cells are read from rasters.
+        """
+        cell_ids, columns = np.unique(np.asarray(self.cell_ids), return_inverse=True)
+        return CoveredCells(cell_ids, columns.ravel())
+
+    def reduce(self, cells: CoveredCells, stack: np.ndarray) -> np.ndarray:
+        """
+        Multiplies the sparse feature x cell matrix of coverage fractions with values of covered cells.
+        It uses SciPy sparse matrices if SciPy is available, otherwise one NumPy reduction for every column.
+
+        Args:
+            cells (CoveredCells): cells covered by features, see `covered_cells`.
+            stack (np.ndarray): values of covered cells (rows) for every quantity (columns).
+
+        Returns:
+            np.ndarray: coverage-weighted sums of quantities (columns) for every feature (rows).
+        """
+        coverage = np.asarray(self.coverage)
+        try:
+            from scipy import sparse
+        except ImportError:
+            sparse = None
+        if sparse is not None:
+            matrix = sparse.csr_matrix(
+                (coverage, cells.columns, np.asarray(self.offsets)),
+                shape=(self.features_count, len(cells.cell_ids)),
+            )
+            return np.asarray(matrix @ stack)
+        rows = self.feature_rows()
+        result = np.empty((self.features_count, stack.shape[1]))
+        for column in range(stack.shape[1]):
+            result[:, column] = np.bincount(
+                rows,
+                weights=coverage * stack[cells.columns, column],
+                minlength=self.features_count,
+            )
+        return result
+
+
+def read_band_cells(band: gdal.Band, cells: CoveredCells, width: int) -> np.ndarray:
+    """
+    Reads values of covered cells strip by strip. A strip is a row of raster blocks, cut to columns of cells
+    covered in it, strips without covered cells are not read. Only values of covered cells are kept.
+
+    Args:
+        band (gdal.Band): band of the raster.
+        cells (CoveredCells): cells covered by features.
+        width (int): width of the raster.
+
+    Returns:
+        np.ndarray: value of every covered cell, NaN for cells without data.
+    """
+    values = np.empty(len(cells.cell_ids))
+    if len(values) == 0:
+        return values
+    nodata = band.GetNoDataValue()
+    strip_height = max(1, band.GetBlockSize()[1])
+    first_row = int(cells.cell_ids[0]) // width
+    last_row = int(cells.cell_ids[-1]) // width
+    for strip_row in range(
+        first_row - first_row % strip_height, last_row + 1, strip_height
+    ):
+        # cell ids are row-major, so cells of the strip are consecutive
+        start, stop = np.searchsorted(
+            cells.cell_ids, [strip_row * width, (strip_row + strip_height) * width]
+        )
+        if start == stop:
+            continue
+        rows, columns = np.divmod(cells.cell_ids[start:stop], width)
+        column_offset = int(columns.min())
+        strip = band.ReadAsArray(
+            column_offset,
+            strip_row,
+            int(columns.max()) - column_offset + 1,
+            int(rows.max()) - strip_row + 1,
+        )
+        strip_values = strip[rows - strip_row, columns - column_offset].astype(
+            np.float64
+        )
+        if nodata is not None:
+            strip_values[strip_values == nodata] = np.nan
+        values[start:stop] = strip_values
+    return values
+
+
+def linear_statistic(stat: str, sums: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Args:
+        stat (str): one of `LINEAR_STATS`.
+        sums (Dict[str, np.ndarray]): coverage-weighted sums of quantities for every feature - "count" of cells
+            with data, "sum" of values and for weighted statistics "weighted_sum" of values multiplied by weights
+            and "weights" sum.
+
+    Returns:
+        np.ndarray: value of the statistic for every feature.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if stat == "mean":
+            return np.where(sums["count"] > 0, sums["sum"] / sums["count"], np.nan)
+        if stat == "weighted_mean":
+            return sums["weighted_sum"] / sums["weights"]
+        return sums[stat]
+
+
+class CoverageIndexStore:
+    """
+    Coverage indexes shared by calculation subtasks, one for every grid and batch of features.
+    Indexes are kept in memory or saved in a directory and memory-mapped.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Attributes:
+            directory (Optional[str]): directory of memory-mapped indexes, indexes are kept in memory if not set.
+        """
+        self.directory: Optional[str] = directory
+        self._indexes: Dict[str, CoverageIndex] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def key(grid: RasterGrid, feature_ids: List[int]) -> str:
+        """
+        Args:
+            grid (RasterGrid): grid of the index.
+            feature_ids (List[int]): ids of indexed features.
+
+        Returns:
+            str: key of the index.
+        """
+        description = repr((grid, sorted(feature_ids)))
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def get(
+        self,
+        grid: RasterGrid,
+        feature_ids: List[int],
+        feature_source,
+        raster_path: str,
+    ) -> CoverageIndex:
+        """
+        Returns the index of features on the grid, it's built from the raster when it's needed for the first time.
+
+        Args:
+            grid (RasterGrid): grid of the raster.
+            feature_ids (List[int]): ids of features of the feature source.
+            feature_source: exactextract feature source with features to index.
+            raster_path (str): path to a raster on the grid.
+
+        Returns:
+            CoverageIndex: coverage fractions of features on the grid.
+        """
+        key = self.key(grid, feature_ids)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = CoverageIndex.build(feature_source, raster_path)
+                if self.directory is not None:
+                    index_directory = Path(self.directory) / key
+                    index.save(index_directory)
+                    index = CoverageIndex.load(index_directory)
+                self._indexes[key] = index
+            return index
+
+    def clear(self):
+        """
+        Releases all indexes and removes their directory.
+        """
+        with self._lock:
+            self._indexes.clear()
+            self._key_locks.clear()
+        if self.directory is not None and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def split_linear_stats(
+    stats: List, rasters: List[str], weights: Optional[str]
+) -> Tuple[List[str], List]:
+    """
+    Divides statistics into linear ones, calculated from coverage indexes, and other ones calculated
+    by exactextract. Weighted statistics are linear only if the weights raster has a single band and
+    it's on the grid of all rasters.
+
+    Args:
+        stats (List): names of statistics and custom functions.
+        rasters (List[str]): paths to rasters.
+        weights (Optional[str]): path to the weights raster.
+
+    Returns:
+        Tuple[List[str], List]: linear statistics and other statistics.
+    """
+    weights_on_grid = False
+    if weights:
+        weights_dataset = gdal.Open(weights)
+        weights_on_grid = (
+            weights_dataset is not None
+            and weights_dataset.RasterCount == 1
+            and all(read_grid(raster) == read_grid(weights) for raster in rasters)
+        )
+    linear, other = [], []
+    for stat in stats:
+        if (
+            isinstance(stat, str)
+            and stat in LINEAR_STATS
+            and (stat not in WEIGHTED_STATS or weights_on_grid)
+        ):
+            linear.append(stat)
+        else:
+            other.append(stat)
+    return linear, other
+
+
+def calculate_linear_statistics(
+    feature_source,
+    feature_ids: List[int],
+    rasters: List[str],
+    weights: Optional[str],
+    stats: List[str],
+    include_cols: List[str],
+    store: CoverageIndexStore,
+    check_canceled: Callable[[], None] = None,
+    selected_bands: Optional[Dict[str, List[int]]] = None,
+):
+    """
+    Calculates linear statistics of features using coverage indexes. Rasters are grouped by their grid and
+    coverage fractions are calculated once per grid. Only covered cells of bands are read, and bands are
+    reduced with the sparse matrix of coverage fractions one at a time, so memory doesn't grow with the number
+    of bands or the extent of features.
+
+    Args:
+        feature_source: exactextract feature source, e.g. `FeatureSubsetSource`.
+        feature_ids (List[int]): ids of features of the feature source.
+        rasters (List[str]): paths to rasters.
+        weights (Optional[str]): path to the weights raster on the grid of rasters, used by weighted statistics.
+        stats (List[str]): statistics, all of them in `LINEAR_STATS`.
+        include_cols (List[str]): columns copied from the input layer.
+        store (CoverageIndexStore): store of coverage indexes.
+        check_canceled (Callable[[], None]): function raising an exception if the calculation was canceled.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters,
+            all bands of other rasters are calculated.
+
+    Returns:
+        pandas DataFrame with the same columns as exactextract output.
+    """
+    import pandas as pd
+
+    selected_bands = selected_bands or {}
+    weighted = any(stat in WEIGHTED_STATS for stat in stats)
+    quantities = ["count", "sum"] + (["weighted_sum", "weights"] if weighted else [])
+    grids: Dict[RasterGrid, List[str]] = {}
+    band_names: List[str] = []
+    for raster_path in rasters:
+        grids.setdefault(read_grid(raster_path), []).append(raster_path)
+        band_names.extend(
+            name
+            for _, name in raster_bands(
+                raster_path,
+                gdal.Open(raster_path).RasterCount,
+                selected_bands.get(raster_path),
+            )
+        )
+
+    # band name: quantity: coverage-weighted sum for every feature
+    sums: Dict[str, Dict[str, np.ndarray]] = {}
+    index = None
+    for grid, grid_rasters in grids.items():
+        if check_canceled is not None:
+            check_canceled()
+        index = store.get(grid, feature_ids, feature_source, grid_rasters[0])
+        cells = index.covered_cells()
+        weights_values = None
+        if weighted:
+            weights_values = read_band_cells(
+                gdal.Open(weights).GetRasterBand(1), cells, grid.width
+            )
+        for raster_path in grid_rasters:
+            dataset = gdal.Open(raster_path)
+            for band_number, name in raster_bands(
+                raster_path, dataset.RasterCount, selected_bands.get(raster_path)
+            ):
+                if check_canceled is not None:
+                    check_canceled()
+                values = read_band_cells(
+                    dataset.GetRasterBand(band_number), cells, grid.width
+                )
+                has_data = ~np.isnan(values)
+                columns = [has_data.astype(np.float64), np.where(has_data, values, 0.0)]
+                if weighted:
+                    # like in exactextract, a nodata weight of a cell with data makes weighted statistics NaN
+                    columns.append(np.where(has_data, values * weights_values, 0.0))
+                    columns.append(np.where(has_data, weights_values, 0.0))
+                reduced = index.reduce(cells, np.column_stack(columns))
+                sums[name] = {
+                    quantity: reduced[:, j] for j, quantity in enumerate(quantities)
+                }
+
+    attributes = {
+        feature.feature.id(): [feature.get(column) for column in include_cols]
+        for feature in feature_source
+    }
+    row_ids = index.feature_ids if index is not None else list(attributes)
+    output = {
+        column: [attributes[fid][i] for fid in row_ids]
+        for i, column in enumerate(include_cols)
+    }
+    prefixed = len(band_names) > 1
+    # operations are written one after another, every one of them for all bands
+    for stat in stats:
+        weights_name = WEIGHTS_NAME if stat in WEIGHTED_STATS else None
+        for name in band_names:
+            output[column_name(name, stat, prefixed, weights_name)] = linear_statistic(
+                stat, sums[name]
+            )
+    return pd.DataFrame(output)
+
+
+def merge_operation_columns(
+    stats: List,
+    linear_stats: List[str],
+    linear_result,
+    other_result,
+    include_cols: List[str],
+):
+    """
+    Merges results of linear statistics and statistics calculated by exactextract for the same features,
+    keeping the order of operations of exactextract output.
+
+    Args:
+        stats (List): all statistics in requested order.
+        linear_stats (List[str]): statistics calculated by `calculate_linear_statistics`.
+        linear_result (pandas.DataFrame): result of `calculate_linear_statistics`.
+        other_result (pandas.DataFrame): result of exactextract for the other statistics, rows in the same order.
+        include_cols (List[str]): columns copied from the input layer.
+
+    Returns:
+        pandas DataFrame with columns of all statistics.
+    """
+    import pandas as pd
+
+    linear_columns = iter(
+        split_operation_columns(
+            list(linear_result.columns), include_cols, len(linear_stats)
+        )
+    )
+    other_columns = iter(
+        split_operation_columns(
+            list(other_result.columns), include_cols, len(stats) - len(linear_stats)
+        )
+    )
+    linear_result = linear_result.reset_index(drop=True)
+    other_result = other_result.reset_index(drop=True)
+    parts = [linear_result[include_cols]]
+    for stat in stats:
+        if isinstance(stat, str) and stat in linear_stats:
+            parts.append(linear_result[next(linear_columns)])
+        else:
+            parts.append(other_result[next(other_columns)])
+    return pd.concat(parts, axis=1)
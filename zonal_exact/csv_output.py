@@ -0,0 +1,263 @@
+"""
+CSV output of tabular results. Results are written in blocks of rows, blocks are formatted (and compressed with gzip)
+in parallel threads and written to the file in order. Types of columns are written to the `.csvt` file next to
+the output, so QGIS reads statistics as numbers without inferring their types. zstd compression needs the optional
+`zstandard` library.
+"""
+
+import gzip
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+CSV_COMPRESSIONS = ("none", "gzip", "zstd")
+# extension added to the output file for every compression
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# maximum number of rows formatted at once, bigger batches are split into more blocks
+CSV_BLOCK_ROWS = 100_000
+GZIP_COMPRESSION_LEVEL = 6
+
+
+def zstd_available() -> bool:
+    """
+    Returns:
+        bool: whether zstandard is installed, so CSV output can be compressed with zstd.
+    """
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def compressed_path(output_file_path: Path, compression: str) -> Path:
+    """
+    Args:
+        output_file_path (Path): path to the CSV output selected by user.
+        compression (str): one of `CSV_COMPRESSIONS`.
+
+    Returns:
+        Path: path to the written file, with the extension of the compression, e.g. `output.csv.gz`.
+    """
+    output_file_path = Path(output_file_path)
+    if compression not in COMPRESSION_SUFFIXES:
+        return output_file_path
+    return output_file_path.with_name(
+        output_file_path.name + COMPRESSION_SUFFIXES[compression]
+    )
+
+
+def csvt_path(csv_path: Path) -> Path:
+    """
+    Args:
+        csv_path (Path): path to the CSV file, compressed or not.
+
+    Returns:
+        Path: path to the `.csvt` file with types of columns, e.g. `output.csvt` for `output.csv.gz`.
+    """
+    csv_path = Path(csv_path)
+    if csv_path.suffix in COMPRESSION_SUFFIXES.values():
+        csv_path = csv_path.with_suffix("")
+    return csv_path.with_suffix(".csvt")
+
+
+def csvt_types(frame) -> List[str]:
+    """
+    Returns OGR types of columns of the frame written to the `.csvt` file next to the CSV file, so the CSV driver
+    reads statistics as numbers instead of strings.
+
+    Args:
+        frame: pandas DataFrame written to the CSV file.
+
+    Returns:
+        List[str]: OGR type of every column, "String" for columns that are not numbers (e.g. arrays).
+    """
+    types = []
+    for dtype in frame.dtypes:
+        if dtype.kind == "b":
+            types.append("Integer(Boolean)")
+        elif dtype.kind in ("i", "u"):
+            types.append("Integer64")
+        elif dtype.kind == "f":
+            types.append("Real")
+        else:
+            types.append("String")
+    return types
+
+
+def write_csvt(frame, csv_path: Path):
+    """
+    Writes types of columns of the frame to the `.csvt` file of the CSV file.
+
+    Args:
+        frame: pandas DataFrame written to the CSV file.
+        csv_path (Path): path to the CSV file.
+    """
+    csvt_path(csv_path).write_text(
+        ",".join(f'"{column_type}"' for column_type in csvt_types(frame))
+    )
+
+
+def split_blocks(frame, row_block_sizes: List[int]) -> List:
+    """
+    Splits rows of the frame into blocks of batches, blocks are at most `CSV_BLOCK_ROWS` rows long.
+
+    Args:
+        frame: pandas DataFrame with results of all batches, in the order of batches.
+        row_block_sizes (List[int]): number of rows of every batch. Rows over their sum are the last block.
+
+    Returns:
+        List: pandas DataFrames with consecutive rows, at least one (possibly empty) block.
+    """
+    blocks = []
+    start = 0
+    for size in row_block_sizes + [len(frame)]:
+        stop = min(len(frame), start + size)
+        for block_start in range(start, stop, CSV_BLOCK_ROWS):
+            blocks.append(
+                frame.iloc[block_start : min(stop, block_start + CSV_BLOCK_ROWS)]
+            )
+        start = stop
+    if not blocks:
+        blocks.append(frame)
+    return blocks
+
+
+class CsvBlockWriter:
+    """
+    CSV file written block by block. Appended DataFrames are split into blocks of at most `CSV_BLOCK_ROWS` rows,
+    blocks are formatted in a pool of threads and written in the order they were appended. With gzip compression
+    every block is compressed by the thread as a separate gzip member (a file of concatenated members is a valid
+    gzip file), zstd compresses the stream of blocks in order, using its own threads. Only a few blocks are
+    formatted ahead of the written one, so neither appended rows nor formatted text pile up in memory. The file is
+    written next to the output and replaces it by `close`, which writes the `.csvt` file too.
+    """
+
+    def __init__(self, path: Path, compression: str = "none", max_workers: int = None):
+        """
+        Attributes:
+            path (Path): path to the written file, with the extension of the compression, see `compressed_path`.
+            compression (str): one of `CSV_COMPRESSIONS`.
+            max_workers (int): number of threads formatting blocks, number of CPUs if not set.
+        """
+        self.path: Path = Path(path)
+        self.compression: str = compression
+        self.max_workers: int = max(1, max_workers or os.cpu_count() or 1)
+        self.partial_path: Path = self.path.with_name(
+            f"{self.path.stem}_zonal_partial{self.path.suffix}"
+        )
+        self.blocks_count: int = 0
+        # empty frame with columns of the first appended frame, their types are written to the `.csvt` file
+        self._columns = None
+        self._file = None
+        self._stream = None
+        self._executor: ThreadPoolExecutor = None
+        self._pending: deque = deque()
+
+    def format_block(self, block, header: bool) -> bytes:
+        """
+        Args:
+            block: pandas DataFrame with rows of the block.
+            header (bool): whether names of columns are written before the rows.
+
+        Returns:
+            bytes: the block formatted as CSV, compressed if the compression is gzip.
+        """
+        data = block.to_csv(index=False, header=header).encode("utf-8")
+        if self.compression == "gzip":
+            return gzip.compress(data, compresslevel=GZIP_COMPRESSION_LEVEL)
+        return data
+
+    def append(self, frame):
+        """
+        Appends rows of the frame, the first frame writes the header.
+
+        Args:
+            frame: pandas DataFrame with results of a batch.
+        """
+        if self._file is None:
+            self._columns = frame.iloc[:0]
+            self._file = open(self.partial_path, "wb")
+            self._stream = self._file
+            if self.compression == "zstd":
+                import zstandard
+
+                self._stream = zstandard.ZstdCompressor(threads=-1).stream_writer(
+                    self._file, closefd=False
+                )
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        # an empty frame is a single block, so the header is written even without rows
+        for block_start in range(0, max(1, len(frame)), CSV_BLOCK_ROWS):
+            block = frame.iloc[block_start : block_start + CSV_BLOCK_ROWS]
+            self._pending.append(
+                self._executor.submit(self.format_block, block, self.blocks_count == 0)
+            )
+            self.blocks_count += 1
+            if len(self._pending) > 2 * self.max_workers:
+                self._stream.write(self._pending.popleft().result())
+
+    def close(self):
+        """
+        Writes the remaining blocks, completes the file and replaces the output with it.
+        """
+        if self._file is None:
+            return
+        while self._pending:
+            self._stream.write(self._pending.popleft().result())
+        self.release()
+        os.replace(self.partial_path, self.path)
+        write_csvt(self._columns, self.path)
+
+    def release(self):
+        """
+        Stops the threads and closes the partial file.
+        """
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        self._stream = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """
+        Removes the partial file, an existing output is left as it was.
+        """
+        self.release()
+        self.partial_path.unlink(missing_ok=True)
+
+
+def write_csv(
+    frame,
+    path: Path,
+    row_block_sizes: List[int],
+    compression: str = "none",
+    max_workers: int = None,
+):
+    """
+    Writes results of all batches to the CSV file by `CsvBlockWriter`, see `split_blocks` for blocks of rows.
+
+    Args:
+        frame: pandas DataFrame with results of all batches, in the order of batches.
+        path (Path): path to the written file, with the extension of the compression, see `compressed_path`.
+        row_block_sizes (List[int]): number of rows of every batch, see `split_blocks`.
+        compression (str): one of `CSV_COMPRESSIONS`.
+        max_workers (int): number of threads formatting blocks, number of CPUs if not set.
+    """
+    blocks = split_blocks(frame, row_block_sizes)
+    writer = CsvBlockWriter(path, compression, max_workers)
+    try:
+        for block in blocks:
+            writer.append(block)
+        writer.close()
+    except BaseException:
+        writer.discard()
+        raise
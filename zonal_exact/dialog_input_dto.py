@@ -1,10 +1,10 @@
 from dataclasses import dataclass
-from typing import List, Callable
+from typing import Callable, Dict, List
 from pathlib import Path
 
-from qgis.core import QgsVectorLayer
+from qgis.core import QgsRectangle, QgsVectorLayer
 
-from .utils import extract_function_name
+from .utils import create_custom_function
 
 
 @dataclass
@@ -22,26 +22,60 @@ class DialogInputDTO:
     strategy: str
     input_layername: str = None
     output_layername: str = None
+    # "threads" or "processes"
+    backend: str = "threads"
+    # save results of finished batches when calculation is canceled
+    keep_partial_results: bool = False
+    # save results of finished batches in the run directory to resume interrupted calculation
+    checkpoints: bool = False
+    # reuse statistics of single features cached in earlier calculations
+    use_cache: bool = False
+    cache_size_mb: int = 1024
+    # recalculate only features with changed geometry and patch them into the existing output
+    incremental: bool = False
+    # recalculate features intersecting raster blocks with changed checksums
+    detect_raster_changes: bool = False
+    # extent of raster region updated in place, in CRS of the vector layer
+    changed_extent: QgsRectangle = None
+    # "off", "memory" or "disk" - where coverage fractions shared by rasters on the same grid are kept
+    coverage_index: str = "off"
+    # number of raster bands calculated by one subtask, 0 - all bands together
+    bands_per_subtask: int = 0
+    # memory budget of all calculation subtasks in megabytes, 0 - not limited
+    memory_budget_mb: int = 0
+    # size of results of batches kept in memory in megabytes, bigger results are spilled to disk, 0 - not limited
+    result_buffer_mb: int = 1024
+    # every subtask writes its own shard, shards are united by a virtual layer instead of being merged
+    sharded_output: bool = False
+    # Parquet output is written with geometries (GeoParquet) by GDAL, otherwise it's a table written by pyarrow
+    geoparquet: bool = False
+    # "none", "gzip" or "zstd" - compression of CSV output
+    csv_compression: str = "none"
+    # numbers of bands selected by user for rasters (raster path: bands), all bands of other rasters are calculated
+    selected_bands: Dict[str, List[int]] = None
 
     def __post_init__(self):
         # after conversion of function code to function - function name: function
         self.custom_functions_list: List[Callable] = []
         self.convert_custom_functions()
 
+    @property
+    def stats_list(self) -> List:
+        """
+        All statistics to calculate: aggregates, arrays and custom functions.
+        """
+        return (
+            self.aggregates_stats_list
+            + self.arrays_stats_list
+            + self.custom_functions_list
+        )
+
     def convert_custom_functions(self):
         """
         This method converts a list of custom function strings into a list of callable custom functions.
-        It uses a helper function to extract the function name and another helper function to create
-        the custom function.
+        It uses a helper function to create the custom function (defined outside loop to workaround
+        pythons' late binding).
         """
-
-        # Define a helper function to create custom functions.
-        # It's defined outside loop to workaround pythons' late binding
-        def create_custom_function(function_str: str):
-            namespace = {}
-            exec(function_str, namespace)
-            return namespace[extract_function_name(function_str)]
-
         for function_str in self.custom_functions_str_list:
             custom_function = create_custom_function(function_str)
             self.custom_functions_list.append(custom_function)
@@ -0,0 +1,316 @@
+"""
+Incremental update of existing output. Hashes of geometries used to calculate the output are stored next to it,
+so the next calculation recalculates only features whose geometry changed and patches their rows in the output.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFeedback,
+    QgsRectangle,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from .csv_output import write_csv
+from .parquet_output import PARQUET_EXTENSION, write_parquet
+from .partitioning import PROGRESS_INTERVAL
+from .raster_changes import BlockChecksums
+from .result_cache import feature_hash
+
+
+def hashes_path(output_file_path: Path) -> Path:
+    """
+    Args:
+        output_file_path (Path): path to the output file.
+
+    Returns:
+        Path: path to the file with geometry hashes of features used to calculate the output.
+    """
+    output_file_path = Path(output_file_path)
+    return output_file_path.with_name(f"{output_file_path.name}.hashes.json")
+
+
+def increment_path(output_file_path: Path) -> Path:
+    """
+    Args:
+        output_file_path (Path): path to the output file.
+
+    Returns:
+        Path: path to the temporary file with statistics of changed features.
+    """
+    output_file_path = Path(output_file_path)
+    return output_file_path.with_name(
+        f"{output_file_path.stem}_increment{output_file_path.suffix}"
+    )
+
+
+def remove_increment(output_file_path: Path):
+    """
+    Removes the temporary file with statistics of changed features after it was patched into the output.
+
+    Args:
+        output_file_path (Path): path to the output file.
+    """
+    path = increment_path(output_file_path)
+    if path.suffix.lower() == ".shp":
+        QgsVectorFileWriter.deleteShapeFile(str(path))
+    elif path.exists():
+        path.unlink()
+
+
+def geometry_hashes(
+    source,
+    id_field_index: int,
+    feedback: QgsFeedback = None,
+    features_count: int = 0,
+) -> Dict[int, Tuple[str, str]]:
+    """
+    Calculates hashes of WKB of geometries of all features.
+
+    Args:
+        source: QgsVectorLayer or QgsVectorLayerFeatureSource to read features from.
+        id_field_index (int): index of the ID field.
+        feedback (QgsFeedback): feedback receiving progress, reading stops when it's canceled.
+        features_count (int): expected number of features used to report progress.
+
+    Returns:
+        Dict[int, Tuple[str, str]]: feature id: (value of ID field, geometry hash).
+    """
+    hashes: Dict[int, Tuple[str, str]] = {}
+    request = QgsFeatureRequest().setSubsetOfAttributes([id_field_index])
+    for feature in source.getFeatures(request):
+        if feedback is not None and len(hashes) % PROGRESS_INTERVAL == 0:
+            if feedback.isCanceled():
+                break
+            if features_count > 0:
+                feedback.setProgress(100.0 * len(hashes) / features_count)
+        hashes[feature.id()] = (
+            str(feature.attribute(id_field_index)),
+            feature_hash(feature.geometry()),
+        )
+    return hashes
+
+
+@dataclass
+class IncrementalUpdate:
+    """
+    State of the incremental update of the output. Without previous hashes all features are calculated
+    and hashes are stored for the next update. Features intersecting changed regions of rasters (given
+    by the user or found by comparing checksums of raster blocks) are recalculated too.
+    """
+
+    hashes_path: Path
+    run_key: str
+    id_field: str
+    id_field_index: int
+    # value of ID field: geometry hash, of features used to calculate the existing output
+    previous: Optional[Dict[str, str]] = None
+    # feature id: (value of ID field, geometry hash), of current features
+    current: Dict[int, Tuple[str, str]] = field(default_factory=dict)
+    changed_ids: Set[str] = field(default_factory=set)
+    removed_ids: Set[str] = field(default_factory=set)
+    # extent of raster region updated in place, in CRS of the input layer
+    changed_extent: Optional[QgsRectangle] = None
+    # whether checksums of raster blocks are compared to find regions updated in place
+    detect_raster_changes: bool = False
+    # raster path: checksums of its blocks stored with the existing output
+    previous_blocks: Optional[Dict[str, BlockChecksums]] = None
+    # raster path: current checksums of its blocks
+    current_blocks: Dict[str, BlockChecksums] = field(default_factory=dict)
+
+    @classmethod
+    def load(
+        cls,
+        output_file_path: Path,
+        run_key: str,
+        id_field: str,
+        id_field_index: int,
+    ) -> "IncrementalUpdate":
+        """
+        Reads hashes stored with the existing output. They're ignored if the output doesn't exist or was
+        calculated with other parameters.
+
+        Args:
+            output_file_path (Path): path to the output file.
+            run_key (str): key of calculation parameters, see `checkpoint.run_key`.
+            id_field (str): name of the ID field.
+            id_field_index (int): index of the ID field in the input layer.
+
+        Returns:
+            IncrementalUpdate: state of the update.
+        """
+        path = hashes_path(output_file_path)
+        update = cls(path, run_key, id_field, id_field_index)
+        if not Path(output_file_path).exists() or not path.exists():
+            return update
+        try:
+            stored = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return update
+        if stored.get("run_key") == run_key and stored.get("id_field") == id_field:
+            update.previous = stored.get("hashes", {})
+            update.previous_blocks = stored.get("raster_blocks")
+        return update
+
+    @property
+    def active(self) -> bool:
+        """
+        Returns:
+            bool: whether the existing output is patched instead of calculated from scratch.
+        """
+        return self.previous is not None
+
+    def detect_changes(self) -> List[int]:
+        """
+        Compares current hashes with the previous ones.
+
+        Returns:
+            List[int]: ids of new features and features with changed geometry.
+        """
+        changed_fids = []
+        current_ids = set()
+        for fid, (id_value, geometry_hash) in self.current.items():
+            current_ids.add(id_value)
+            if self.previous.get(id_value) != geometry_hash:
+                changed_fids.append(fid)
+                self.changed_ids.add(id_value)
+        self.removed_ids = set(self.previous) - current_ids
+        return changed_fids
+
+    def mark_changed(
+        self, changed_fids: List[int], feature_ids: List[int]
+    ) -> List[int]:
+        """
+        Marks features as changed, e.g. features intersecting changed regions of rasters.
+
+        Args:
+            changed_fids (List[int]): ids of features already marked as changed.
+            feature_ids (List[int]): ids of features to mark.
+
+        Returns:
+            List[int]: ids of all changed features.
+        """
+        changed = set(changed_fids)
+        for fid in feature_ids:
+            if fid in self.current and fid not in changed:
+                changed.add(fid)
+                self.changed_ids.add(self.current[fid][0])
+        return sorted(changed)
+
+    def save(self):
+        """
+        Stores current hashes next to the output.
+        """
+        stored = {
+            "run_key": self.run_key,
+            "id_field": self.id_field,
+            "hashes": {
+                id_value: geometry_hash
+                for id_value, geometry_hash in self.current.values()
+            },
+        }
+        if self.detect_raster_changes:
+            stored["raster_blocks"] = self.current_blocks
+        temporary_path = self.hashes_path.with_name(f"{self.hashes_path.name}.tmp")
+        temporary_path.write_text(json.dumps(stored), encoding="utf-8")
+        os.replace(temporary_path, self.hashes_path)
+
+    @property
+    def replaced_ids(self) -> Set[str]:
+        """
+        Returns:
+            Set[str]: values of ID field of rows removed from the output.
+        """
+        return self.changed_ids | self.removed_ids
+
+
+def patch_table(
+    output_file_path: Path, new_rows, id_column: str, replaced_ids: Set[str]
+):
+    """
+    Replaces rows of changed features in the CSV or Parquet output. Files can't be modified in place,
+    so they're written again.
+
+    Args:
+        output_file_path (Path): path to the CSV or Parquet output.
+        new_rows (pandas.DataFrame): statistics of changed features, may be None.
+        id_column (str): name of the ID column.
+        replaced_ids (Set[str]): values of ID column of rows to remove.
+    """
+    import pandas as pd
+
+    parquet = Path(output_file_path).suffix == PARQUET_EXTENSION
+    if parquet:
+        existing = pd.read_parquet(output_file_path)
+    else:
+        existing = pd.read_csv(output_file_path)
+    kept = existing[~existing[id_column].astype(str).isin(replaced_ids)]
+    row_group_sizes = [len(kept)]
+    if new_rows is not None:
+        kept = pd.concat([kept, new_rows[existing.columns]])
+    if parquet:
+        write_parquet(kept, output_file_path, row_group_sizes)
+    else:
+        write_csv(kept, output_file_path, row_group_sizes)
+
+
+def patch_layer(
+    output_file_path: Path,
+    increment_layer: Optional[QgsVectorLayer],
+    id_column: str,
+    replaced_ids: Set[str],
+):
+    """
+    Replaces features of changed polygons in the geospatial output in place.
+
+    Args:
+        output_file_path (Path): path to the geospatial output.
+        increment_layer (Optional[QgsVectorLayer]): statistics of changed features.
+        id_column (str): name of the ID column.
+        replaced_ids (Set[str]): values of ID column of features to remove.
+
+    Raises:
+        ValueError: if the output can't be edited.
+    """
+    output_layer = QgsVectorLayer(str(output_file_path), "output", "ogr")
+    if not output_layer.isValid():
+        raise ValueError(f"Unable to open {output_file_path} to update it")
+    if increment_layer is not None and not increment_layer.isValid():
+        raise ValueError("Unable to load statistics of changed features")
+    output_fields = output_layer.fields()
+    removed_fids = []
+    if replaced_ids:
+        id_index = output_fields.indexFromName(id_column)
+        if id_index < 0:
+            raise ValueError(f"Column {id_column} is missing in {output_file_path}")
+        request = QgsFeatureRequest().setSubsetOfAttributes([id_index])
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        for feature in output_layer.getFeatures(request):
+            if str(feature.attribute(id_index)) in replaced_ids:
+                removed_fids.append(feature.id())
+
+    new_features = []
+    if increment_layer is not None:
+        for increment_feature in increment_layer.getFeatures():
+            feature = QgsFeature(output_fields)
+            feature.setGeometry(increment_feature.geometry())
+            for field in increment_layer.fields():
+                index = output_fields.indexFromName(field.name())
+                if index >= 0:
+                    feature.setAttribute(index, increment_feature[field.name()])
+            new_features.append(feature)
+
+    output_layer.startEditing()
+    output_layer.deleteFeatures(removed_fids)
+    output_layer.addFeatures(new_features)
+    if not output_layer.commitChanges():
+        errors = "; ".join(output_layer.commitErrors())
+        output_layer.rollBack()
+        raise ValueError(f"Unable to update {output_file_path}: {errors}")
@@ -0,0 +1,266 @@
+"""
+Streaming writer of geospatial output. Results of batches are appended to the output file as soon as subtasks
+calculate them, so they're not kept in memory until all batches are done and they're not copied by a merge.
+Formats that can't be appended to (GeoParquet) are written by a single writer kept open until the output is done.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
+    QgsFields,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from .parquet_output import PARQUET_COMPRESSION, PARQUET_DRIVER
+
+# column with feature ids of GeoPackages
+GEOPACKAGE_FID = "fid"
+
+
+class OutputWriteError(Exception):
+    """
+    Raised when results of a batch can't be written to the output.
+    """
+
+
+class PrefixFieldConverter(QgsVectorFileWriter.FieldValueConverter):
+    """
+    Adds the prefix to names of columns with statistics while the output schema is created, values are
+    written unchanged. Written layers are not edited.
+    """
+
+    def __init__(self, prefix: str, source_columns: Dict[str, int]):
+        """
+        Attributes:
+            prefix (str): prefix added to names of columns with statistics.
+            source_columns (Dict[str, int]): columns copied from the input layer, they're not prefixed.
+        """
+        super().__init__()
+        self.prefix: str = prefix
+        self.source_columns: Dict[str, int] = source_columns
+
+    def fieldDefinition(self, field: QgsField) -> QgsField:
+        # feature ids of GeoPackage shards written by workers and checkpoints are kept as they are
+        if field.name() in self.source_columns or field.name() == GEOPACKAGE_FID:
+            return QgsField(field)
+        prefixed = QgsField(field)
+        prefixed.setName(f"{self.prefix}{field.name()}")
+        return prefixed
+
+    def convert(self, field_index: int, value):
+        return value
+
+    def clone(self) -> "PrefixFieldConverter":
+        return PrefixFieldConverter(self.prefix, self.source_columns)
+
+
+class StreamingLayerWriter:
+    """
+    Output layer shared by calculation subtasks. Every appended batch is written by `QgsVectorFileWriter`,
+    which writes features in transactions where the format supports them. Batches are written to a partial
+    file next to the output, which replaces the output by `finish`, so an existing output is kept until
+    the calculation is done. The prefix is added to column names by the field converter of the writer,
+    appended batches are matched with prefixed columns of the output. GeoParquet output is written by a writer
+    kept open until `finish`, with compressed columns and row groups of the size of batches.
+    """
+
+    def __init__(
+        self,
+        output_file_path: Path,
+        crs: QgsCoordinateReferenceSystem,
+        prefix: str = "",
+        source_columns: Dict[str, int] = None,
+    ):
+        """
+        Attributes:
+            output_file_path (Path): path to the output file.
+            crs (QgsCoordinateReferenceSystem): CRS of the output, batches in other CRS are transformed.
+            prefix (str): prefix added to names of columns with statistics.
+            source_columns (Dict[str, int]): columns copied from the input layer, they're not prefixed.
+        """
+        self.output_file_path: Path = Path(output_file_path)
+        self.crs: QgsCoordinateReferenceSystem = crs
+        self.prefix: str = prefix
+        self.source_columns: Dict[str, int] = source_columns or {}
+        self.partial_path: Path = self.output_file_path.with_name(
+            f"{self.output_file_path.stem}_zonal_partial{self.output_file_path.suffix}"
+        )
+        self.field_converter: PrefixFieldConverter = None
+        if len(self.prefix) > 0:
+            self.field_converter = PrefixFieldConverter(
+                self.prefix, self.source_columns
+            )
+        self.driver_name: str = QgsVectorFileWriter.driverForExtension(
+            self.output_file_path.suffix
+        )
+        # rows of row groups of GeoParquet output, default of the driver if 0
+        self.row_group_size: int = 0
+        self.batches_count: int = 0
+        # open writer of formats that can't be appended to and fields of its output
+        self._writer: QgsVectorFileWriter = None
+        self._fields: QgsFields = None
+        self._lock = threading.Lock()
+
+    def append(self, layer: QgsVectorLayer):
+        """
+        Appends features of the batch to the output. The first batch creates the output layer.
+
+        Args:
+            layer (QgsVectorLayer): result of the batch.
+
+        Raises:
+            OutputWriteError: if features can't be written.
+        """
+        if self.driver_name == PARQUET_DRIVER:
+            self.write_features(layer)
+            return
+        options = self.save_options()
+        if self.crs is not None and self.crs.isValid() and layer.crs() != self.crs:
+            options.ct = QgsCoordinateTransform(
+                layer.crs(), self.crs, QgsCoordinateTransformContext()
+            )
+        with self._lock:
+            if self.batches_count > 0:
+                options.actionOnExistingFile = (
+                    QgsVectorFileWriter.AppendToLayerNoNewFields
+                )
+            error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+                layer,
+                str(self.partial_path),
+                QgsCoordinateTransformContext(),
+                options,
+            )
+            if error != QgsVectorFileWriter.NoError:
+                raise OutputWriteError(
+                    f"Unable to write {self.output_file_path}: {message}"
+                )
+            self.batches_count += 1
+
+    def save_options(self) -> QgsVectorFileWriter.SaveVectorOptions:
+        """
+        Returns:
+            QgsVectorFileWriter.SaveVectorOptions: options of the writer of the output layer.
+        """
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = self.driver_name
+        options.layerName = self.output_file_path.stem
+        if self.field_converter is not None:
+            options.fieldValueConverter = self.field_converter
+        return options
+
+    def write_features(self, layer: QgsVectorLayer):
+        """
+        Adds features of the batch to the writer kept open, the first batch opens it. Attributes are matched
+        with fields of the output by name, so batches read from GeoPackages (with the fid column) and batches
+        calculated in memory can be mixed.
+
+        Args:
+            layer (QgsVectorLayer): result of the batch.
+
+        Raises:
+            OutputWriteError: if features can't be written.
+        """
+        crs = self.crs if self.crs is not None and self.crs.isValid() else layer.crs()
+        with self._lock:
+            if self._writer is None:
+                self._fields = QgsFields()
+                for field in layer.fields():
+                    if field.name() != GEOPACKAGE_FID:
+                        self._fields.append(field)
+                options = self.save_options()
+                options.layerOptions = [f"COMPRESSION={PARQUET_COMPRESSION.upper()}"]
+                if self.row_group_size > 0:
+                    options.layerOptions.append(f"ROW_GROUP_SIZE={self.row_group_size}")
+                self._writer = QgsVectorFileWriter.create(
+                    str(self.partial_path),
+                    self._fields,
+                    layer.wkbType(),
+                    crs,
+                    QgsCoordinateTransformContext(),
+                    options,
+                )
+                if self._writer.hasError() != QgsVectorFileWriter.NoError:
+                    message = self._writer.errorMessage()
+                    self._writer = None
+                    raise OutputWriteError(
+                        f"Unable to write {self.output_file_path}: {message}"
+                    )
+            attribute_indexes = [
+                layer.fields().indexFromName(name) for name in self._fields.names()
+            ]
+            request = QgsFeatureRequest()
+            if layer.crs() != crs:
+                request.setDestinationCrs(crs, QgsCoordinateTransformContext())
+            features = []
+            for source_feature in layer.getFeatures(request):
+                feature = QgsFeature(self._fields)
+                feature.setGeometry(source_feature.geometry())
+                feature.setAttributes(
+                    [
+                        source_feature.attribute(index) if index >= 0 else None
+                        for index in attribute_indexes
+                    ]
+                )
+                features.append(feature)
+            if not self._writer.addFeatures(features):
+                raise OutputWriteError(
+                    f"Unable to write {self.output_file_path}: {self._writer.errorMessage()}"
+                )
+            self.batches_count += 1
+
+    def close_writer(self):
+        """
+        Closes the writer kept open, so its file is complete. It's called with the lock held.
+        """
+        if self._writer is not None:
+            self._writer.flushBuffer()
+            # the file is closed when the writer is deleted
+            self._writer = None
+
+    def partial_files(self):
+        """
+        Returns:
+            List[Path]: files of the partial output, e.g. the shapefile with its sidecar files.
+        """
+        if not self.partial_path.parent.exists():
+            return []
+        return [
+            path
+            for path in self.partial_path.parent.iterdir()
+            if path.name.startswith(f"{self.partial_path.stem}.")
+        ]
+
+    def finish(self):
+        """
+        Replaces the output with the partial output written so far.
+        """
+        with self._lock:
+            self.close_writer()
+            for path in self.partial_files():
+                os.replace(
+                    path,
+                    self.output_file_path.with_name(
+                        self.output_file_path.stem
+                        + path.name[len(self.partial_path.stem) :]
+                    ),
+                )
+
+    def discard(self):
+        """
+        Removes the partial output, an existing output is left as it was.
+        """
+        with self._lock:
+            self.close_writer()
+            for path in self.partial_files():
+                path.unlink(missing_ok=True)
+            self.batches_count = 0
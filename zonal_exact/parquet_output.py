@@ -0,0 +1,110 @@
+"""
+Parquet output of tabular results. Results are written by pyarrow with compressed columns, every batch of polygons
+is a row group of the file, so readers can skip or read batches in parallel. pyarrow is an optional dependency,
+it's needed only for Parquet output. Geospatial results are written as GeoParquet by the OGR Parquet driver.
+"""
+
+import os
+from pathlib import Path
+from typing import List
+
+PARQUET_EXTENSION = ".parquet"
+# OGR driver writing GeoParquet
+PARQUET_DRIVER = "Parquet"
+# compression of columns, readable by pandas, duckdb and GDAL
+PARQUET_COMPRESSION = "zstd"
+
+
+def parquet_available() -> bool:
+    """
+    Returns:
+        bool: whether pyarrow is installed, so tabular results can be written to Parquet.
+    """
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ParquetTableWriter:
+    """
+    Parquet file written batch by batch, every appended pandas DataFrame is a single row group. Schema of the file
+    is taken from the first DataFrame. Row groups are written to a partial file next to the output, which replaces
+    the output by `close`.
+    """
+
+    def __init__(self, path: Path, compression: str = PARQUET_COMPRESSION):
+        """
+        Attributes:
+            path (Path): path to the Parquet file.
+            compression (str): compression of columns.
+        """
+        self.path: Path = Path(path)
+        self.compression: str = compression
+        self.partial_path: Path = self.path.with_name(
+            f"{self.path.stem}_zonal_partial{self.path.suffix}"
+        )
+        self.row_groups_count: int = 0
+        self._schema = None
+        self._writer = None
+
+    def append(self, frame):
+        """
+        Writes the DataFrame as a row group.
+
+        Args:
+            frame: pandas DataFrame with results of a batch.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._schema = pa.Schema.from_pandas(frame, preserve_index=False)
+            self._writer = pq.ParquetWriter(
+                self.partial_path, self._schema, compression=self.compression
+            )
+        table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=max(1, len(frame)))
+        self.row_groups_count += 1
+
+    def close(self):
+        """
+        Completes the file and replaces the output with it.
+        """
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self.partial_path, self.path)
+
+    def discard(self):
+        """
+        Removes the partial file, an existing output is left as it was.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.partial_path.unlink(missing_ok=True)
+
+
+def write_parquet(frame, path: Path, row_group_sizes: List[int]):
+    """
+    Writes results to the Parquet file with a row group for every batch.
+
+    Args:
+        frame: pandas DataFrame with results of all batches, in the order of batches.
+        path (Path): path to the Parquet file.
+        row_group_sizes (List[int]): number of rows of every batch. Rows over their sum are written as the last
+            row group, e.g. features missing in some band ranges.
+    """
+    writer = ParquetTableWriter(path)
+    start = 0
+    for size in row_group_sizes + [len(frame)]:
+        stop = min(len(frame), start + size)
+        if stop > start:
+            writer.append(frame.iloc[start:stop])
+        start = stop
+    if writer.row_groups_count == 0:
+        writer.append(frame)
+    writer.close()
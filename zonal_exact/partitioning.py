@@ -0,0 +1,350 @@
+"""
+Helpers used to divide features of the input vector layer into batches that are processed by
+calculation subtasks.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from osgeo import gdal
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsCsException,
+    QgsFeatureRequest,
+    QgsFeedback,
+    QgsRectangle,
+)
+
+from .raster_changes import raster_crs
+
+# number of bits used for each axis of the Hilbert curve grid (2^16 x 2^16 cells)
+HILBERT_ORDER = 16
+# cost of processing single polygon vertex expressed in number of raster cells
+VERTEX_COST = 1.0
+# number of batches (chunks) created for every subtask when more than one subtask is used
+CHUNKS_PER_SUBTASK = 8
+# number of features read between progress updates
+PROGRESS_INTERVAL = 1000
+
+
+class FeatureInfo(NamedTuple):
+    """
+    Lightweight description of the feature used to plan batches without keeping geometries in memory.
+    """
+
+    fid: int
+    xmin: float
+    ymin: float
+    xmax: float
+    ymax: float
+    vertices: int = 0
+
+    @property
+    def center(self):
+        return (self.xmin + self.xmax) / 2, (self.ymin + self.ymax) / 2
+
+
+def collect_feature_info(
+    source,
+    feedback: QgsFeedback = None,
+    features_count: int = 0,
+    feature_ids: List[int] = None,
+) -> List[FeatureInfo]:
+    """
+    Reads bounding boxes and vertex counts of all features from the source. Attributes are not fetched.
+
+    Args:
+        source: QgsVectorLayer or QgsVectorLayerFeatureSource to read features from.
+        feedback (QgsFeedback): feedback receiving progress, reading stops when it's canceled.
+        features_count (int): expected number of features used to report progress.
+        feature_ids (List[int]): ids of features to read, all features are read if not given.
+
+    Returns:
+        List[FeatureInfo]: feature id with its bounding box and vertex count for each feature in the source.
+    """
+    features_info: List[FeatureInfo] = []
+    request = QgsFeatureRequest().setNoAttributes()
+    if feature_ids is not None:
+        request.setFilterFids(feature_ids)
+    for feature in source.getFeatures(request):
+        if feedback is not None and len(features_info) % PROGRESS_INTERVAL == 0:
+            if feedback.isCanceled():
+                break
+            if features_count > 0:
+                feedback.setProgress(100.0 * len(features_info) / features_count)
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            # features without geometry don't cover any raster cell, keep them anyway
+            # so they are present in the output
+            features_info.append(
+                FeatureInfo(feature.id(), math.nan, math.nan, math.nan, math.nan)
+            )
+            continue
+        bbox = geometry.boundingBox()
+        features_info.append(
+            FeatureInfo(
+                feature.id(),
+                bbox.xMinimum(),
+                bbox.yMinimum(),
+                bbox.xMaximum(),
+                bbox.yMaximum(),
+                geometry.constGet().nCoordinates(),
+            )
+        )
+    return features_info
+
+
+@dataclass
+class FeatureBatch:
+    """
+    Group of features processed together by a single calculation subtask.
+    """
+
+    feature_ids: List[int]
+    estimated_cost: float = 0.0
+    batch_id: int = 0
+    # index of the band range calculated for features, all bands if None
+    band_range: Optional[int] = None
+    # exactextract strategy chosen for the batch by "auto" strategy, strategy of the task if None
+    strategy: Optional[str] = None
+
+
+class RasterCells(NamedTuple):
+    """
+    Cell area of the raster with the transformation of bounding boxes of features to CRS of the raster.
+    """
+
+    cell_area: float
+    # transformation from CRS of features, None if CRSs are the same
+    transform: Optional[QgsCoordinateTransform] = None
+    # whether bounding boxes of features can be compared with cells, False if CRSs differ without a transformation
+    comparable: bool = True
+
+
+def features_transform(
+    source_crs: Optional[QgsCoordinateReferenceSystem], raster_path: str
+) -> Tuple[bool, Optional[QgsCoordinateTransform]]:
+    """
+    Finds the transformation of bounding boxes of features to CRS of the raster. CRSs are considered the same
+    if the CRS of features isn't given or neither CRS is known.
+
+    Args:
+        source_crs (Optional[QgsCoordinateReferenceSystem]): CRS of features.
+        raster_path (str): path to the raster.
+
+    Returns:
+        Tuple[bool, Optional[QgsCoordinateTransform]]: whether bounding boxes can be compared with the raster
+            and the transformation, None if it's not needed.
+    """
+    if source_crs is None:
+        return True, None
+    destination_crs = raster_crs(raster_path)
+    if not source_crs.isValid() and not destination_crs.isValid():
+        return True, None
+    if not source_crs.isValid() or not destination_crs.isValid():
+        return False, None
+    if source_crs == destination_crs:
+        return True, None
+    transform = QgsCoordinateTransform(
+        source_crs, destination_crs, QgsCoordinateTransformContext()
+    )
+    if not transform.isValid():
+        return False, None
+    return True, transform
+
+
+def transform_feature_info(
+    info: FeatureInfo, transform: Optional[QgsCoordinateTransform]
+) -> FeatureInfo:
+    """
+    Args:
+        info (FeatureInfo): feature with bounding box in CRS of features.
+        transform (Optional[QgsCoordinateTransform]): transformation to CRS of the raster, None if not needed.
+
+    Returns:
+        FeatureInfo: feature with bounding box in CRS of the raster, NaN if the box can't be transformed
+            (e.g. it's outside of the area of use of the raster CRS).
+    """
+    if transform is None or math.isnan(info.xmin):
+        return info
+    try:
+        bbox = transform.transformBoundingBox(
+            QgsRectangle(info.xmin, info.ymin, info.xmax, info.ymax)
+        )
+    except QgsCsException:
+        return info._replace(xmin=math.nan, ymin=math.nan, xmax=math.nan, ymax=math.nan)
+    return info._replace(
+        xmin=bbox.xMinimum(),
+        ymin=bbox.yMinimum(),
+        xmax=bbox.xMaximum(),
+        ymax=bbox.yMaximum(),
+    )
+
+
+def raster_cell_areas(
+    raster_paths: List[str], crs: QgsCoordinateReferenceSystem = None
+) -> List[RasterCells]:
+    """
+    Reads area of a single cell of each raster and finds the transformation of features to its CRS.
+
+    Args:
+        raster_paths (List[str]): paths to rasters used in calculation.
+        crs (QgsCoordinateReferenceSystem): CRS of features, rasters are considered to be in it if not given.
+
+    Returns:
+        List[RasterCells]: cell area of every raster that could be opened by GDAL.
+    """
+    cell_areas: List[RasterCells] = []
+    for raster_path in raster_paths:
+        dataset = gdal.Open(raster_path)
+        if dataset is None:
+            continue
+        geo_transform = dataset.GetGeoTransform()
+        comparable, transform = features_transform(crs, raster_path)
+        cell_areas.append(
+            RasterCells(abs(geo_transform[1] * geo_transform[5]), transform, comparable)
+        )
+    return cell_areas
+
+
+def estimate_feature_cost(info: FeatureInfo, cell_areas: List[RasterCells]) -> float:
+    """
+    Estimates cost of calculating statistics for the feature. Cost grows with the number of raster
+    cells covered by the bounding box of the feature (in every raster) and with the number of its vertices.
+    Bounding box is transformed to CRS of every raster, only vertices are counted for rasters it can't be
+    transformed to.
+
+    Args:
+        info (FeatureInfo): feature to be estimated.
+        cell_areas (List[RasterCells]): cell area of each raster used in calculation.
+
+    Returns:
+        float: estimated cost expressed in number of raster cells.
+    """
+    if math.isnan(info.xmin):
+        return 0.0
+    cells = 0.0
+    for raster in cell_areas:
+        if raster.cell_area <= 0 or not raster.comparable:
+            continue
+        bbox = transform_feature_info(info, raster.transform)
+        if math.isnan(bbox.xmin):
+            continue
+        bbox_area = (bbox.xmax - bbox.xmin) * (bbox.ymax - bbox.ymin)
+        cells += max(1.0, bbox_area / raster.cell_area)
+    return cells + info.vertices * VERTEX_COST
+
+
+def hilbert_index(x: int, y: int, order: int = HILBERT_ORDER) -> int:
+    """
+    Calculates the distance of the cell (x, y) along the Hilbert curve filling the 2^order x 2^order grid.
+    Cells that are close along the curve are also close in space.
+
+    Args:
+        x (int): column of the cell, in range [0, 2^order).
+        y (int): row of the cell, in range [0, 2^order).
+        order (int): order of the curve.
+
+    Returns:
+        int: position of the cell along the curve.
+    """
+    n = 1 << order
+    distance = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        distance += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve stays continuous
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return distance
+
+
+def spatially_sorted_ids(
+    features_info: List[FeatureInfo], order: int = HILBERT_ORDER
+) -> List[int]:
+    """
+    Orders features along the Hilbert curve using centers of their bounding boxes, so that consecutive
+    features lie close to each other and batches cut from the result cover compact raster windows.
+
+    Args:
+        features_info (List[FeatureInfo]): features to be ordered.
+        order (int): order of the Hilbert curve used to discretize the extent of features.
+
+    Returns:
+        List[int]: feature ids ordered along the curve.
+    """
+    located = [info for info in features_info if not math.isnan(info.xmin)]
+    if not located:
+        return [info.fid for info in features_info]
+    xmin = min(info.xmin for info in located)
+    ymin = min(info.ymin for info in located)
+    xmax = max(info.xmax for info in located)
+    ymax = max(info.ymax for info in located)
+    max_cell = (1 << order) - 1
+    # avoid division by zero for single feature or features stacked in one point
+    x_scale = max_cell / (xmax - xmin) if xmax > xmin else 0.0
+    y_scale = max_cell / (ymax - ymin) if ymax > ymin else 0.0
+
+    def curve_position(info: FeatureInfo) -> int:
+        if math.isnan(info.xmin):
+            return -1  # features without geometry go first
+        center_x, center_y = info.center
+        return hilbert_index(
+            int((center_x - xmin) * x_scale), int((center_y - ymin) * y_scale), order
+        )
+
+    return [info.fid for info in sorted(features_info, key=curve_position)]
+
+
+def split_by_cost(
+    feature_ids: List[int], costs: Dict[int, float], batch_count: int
+) -> List[FeatureBatch]:
+    """
+    Cuts ordered feature ids into consecutive batches of roughly equal total cost. Order of features
+    is preserved, so batches cut from spatially sorted ids stay spatially compact.
+
+    Args:
+        feature_ids (List[int]): ordered feature ids.
+        costs (Dict[int, float]): estimated cost of each feature.
+        batch_count (int): number of batches to create. It's limited by the number of features.
+
+    Returns:
+        List[FeatureBatch]: batches with feature ids and their total estimated cost.
+    """
+    batch_count = max(1, min(batch_count, len(feature_ids)))
+    total_cost = sum(costs[fid] for fid in feature_ids)
+    batches: List[FeatureBatch] = []
+    current = FeatureBatch([])
+    accumulated_cost = 0.0
+    for index, fid in enumerate(feature_ids):
+        cost = costs[fid]
+        boundary = total_cost * (len(batches) + 1) / batch_count
+        # batches that still have to be created after the current one
+        batches_left = batch_count - len(batches) - 1
+        if (
+            current.feature_ids
+            and batches_left > 0
+            and (
+                accumulated_cost + cost / 2 > boundary
+                or len(feature_ids) - index <= batches_left
+            )
+        ):
+            batches.append(current)
+            current = FeatureBatch([])
+        current.feature_ids.append(fid)
+        current.estimated_cost += cost
+        accumulated_cost += cost
+    if current.feature_ids:
+        batches.append(current)
+    for batch_id, batch in enumerate(batches):
+        batch.batch_id = batch_id
+    return batches
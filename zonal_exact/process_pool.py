@@ -0,0 +1,447 @@
+"""
+Execution backend running calculation of batches in a pool of worker processes. Python code of custom
+functions run on threads of QGIS tasks serialises on the GIL, in separate processes it runs in parallel.
+
+This module is imported by worker processes, so it mustn't import QGIS on module level.
+"""
+
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .utils import create_custom_function, source_file_path
+
+# name of the layer with features exported for workers
+WORKER_SOURCE_LAYER_NAME = "features"
+# parts of OGR source URIs of layers read directly by workers, features are read by their ids
+DIRECT_URI_PARTS = ("path", "layerName", "layerId", "subset")
+# name of the layer with results in geospatial shards written by workers
+SHARD_LAYER_NAME = "zonal_statistics"
+# maximal number of datasets kept open by a single worker process
+MAX_OPEN_DATASETS = 32
+
+# datasets opened by the worker process, they stay open between batches and calculation runs
+# path: ((modification time, size), dataset)
+_open_datasets: "OrderedDict[str, Tuple[Tuple[float, int], object]]" = OrderedDict()
+
+
+@dataclass
+class BatchJob:
+    """
+    Description of a batch calculated in the worker process. It holds only picklable values.
+    Custom functions are passed as code and recreated in the worker.
+    """
+
+    source_path: str
+    layer_name: Optional[str]
+    rasters: List[str]
+    weights: Optional[str]
+    stats: List[str]
+    custom_functions_code: List[str]
+    include_cols: List[str]
+    geospatial_output: bool
+    strategy: str
+    shard_dir: Optional[str] = None
+    # number of raster cells read at once, the default of exactextract
+    max_cells_in_memory: int = 30_000_000
+    # GDAL block cache of the worker process, GDAL default if not set
+    cache_bytes: Optional[int] = None
+    feature_ids: List[int] = field(default_factory=list)
+    batch_id: int = 0
+    # numbers of bands selected by user for rasters, all bands of other rasters are calculated
+    selected_bands: Dict[str, List[int]] = field(default_factory=dict)
+    # index of the layer in the source file, used when the layer is not identified by its name
+    layer_id: Optional[int] = None
+
+    @property
+    def shard_path(self) -> str:
+        return os.path.join(self.shard_dir, f"batch_{self.batch_id}.gpkg")
+
+
+def python_executable() -> str:
+    """
+    Finds python interpreter used to start worker processes. `sys.executable` points to QGIS binary
+    on Windows and MacOS.
+
+    Returns:
+        str: path to python interpreter.
+    """
+    if sys.platform == "win32":
+        candidate = Path(sys.exec_prefix) / "python.exe"
+    else:
+        candidate = Path(sys.exec_prefix) / "bin" / "python3"
+    if candidate.exists():
+        return str(candidate)
+    return sys.executable
+
+
+def initialize_worker():
+    """
+    Imports heavy libraries once per worker process, so batches don't pay for it.
+    """
+    import pandas  # noqa: F401
+    from osgeo import gdal, ogr  # noqa: F401
+    from exactextract import exact_extract  # noqa: F401
+
+
+def warm_up() -> int:
+    """
+    Job doing nothing, it makes the pool start a worker process.
+
+    Returns:
+        int: id of the worker process.
+    """
+    return os.getpid()
+
+
+def open_dataset(path: str, opener):
+    """
+    Returns the dataset opened earlier by this worker process or opens it. Dataset is reopened
+    when the file was modified since it was opened, GDAL virtual rasters when the file they read was modified.
+
+    Args:
+        path (str): path to the dataset or GDAL connection string.
+        opener: function opening the dataset, e.g. `gdal.Open` or `ogr.Open`.
+
+    Returns:
+        opened dataset or None if it can't be opened.
+    """
+    try:
+        stat = os.stat(source_file_path(path))
+        file_key = (stat.st_mtime, stat.st_size)
+    except OSError:
+        # not a local file, e.g. GDAL virtual file system path
+        file_key = None
+    cached = _open_datasets.get(path)
+    if cached is not None and cached[0] == file_key:
+        _open_datasets.move_to_end(path)
+        return cached[1]
+    dataset = opener(path)
+    if dataset is None:
+        return None
+    _open_datasets[path] = (file_key, dataset)
+    while len(_open_datasets) > MAX_OPEN_DATASETS:
+        _open_datasets.popitem(last=False)
+    return dataset
+
+
+def raster_sources(
+    raster_paths: List[str],
+    use_file_names: bool = True,
+    selected_bands: Optional[Dict[str, List[int]]] = None,
+) -> list:
+    """
+    Creates exactextract raster sources reading bands of datasets kept open by the worker process.
+    Sources are named the same way exactextract names rasters given as paths, selected bands keep
+    their numbers in the raster.
+
+    Args:
+        raster_paths (List[str]): paths to rasters.
+        use_file_names (bool): whether names of sources start with the raster file name.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters,
+            all bands of other rasters are read.
+
+    Returns:
+        list: raster source for every calculated band of every raster.
+    """
+    from osgeo import gdal
+    from exactextract.raster import GDALRasterSource
+
+    sources = []
+    for raster_path in raster_paths:
+        dataset = open_dataset(raster_path, gdal.Open)
+        if dataset is None:
+            raise ValueError(f"Unable to open {raster_path} in worker process")
+        root = Path(raster_path).stem if use_file_names else ""
+        bands_count = dataset.RasterCount
+        bands = (selected_bands or {}).get(raster_path) or range(1, bands_count + 1)
+        for band in bands:
+            if bands_count > 1:
+                name = f"{root}_band_{band}" if root else f"band_{band}"
+            else:
+                name = root
+            sources.append(GDALRasterSource(dataset, band, name=name))
+    return sources
+
+
+def read_batch_features(job: BatchJob):
+    """
+    Reads features of the batch by their ids into in-memory OGR layer.
+
+    Args:
+        job (BatchJob): calculated batch.
+
+    Returns:
+        Tuple[ogr.DataSource, ogr.Layer]: in-memory data source (it has to be kept alive) and layer with features.
+    """
+    from osgeo import ogr
+
+    dataset = open_dataset(job.source_path, ogr.Open)
+    if dataset is None:
+        raise ValueError(f"Unable to open {job.source_path} in worker process")
+    if job.layer_name:
+        source_layer = dataset.GetLayerByName(job.layer_name)
+    else:
+        source_layer = dataset.GetLayer(job.layer_id or 0)
+    if source_layer is None:
+        raise ValueError(f"Unable to open layer of {job.source_path} in worker process")
+
+    batch_dataset = ogr.GetDriverByName("Memory").CreateDataSource("batch")
+    batch_layer = batch_dataset.CreateLayer(
+        "batch", source_layer.GetSpatialRef(), source_layer.GetGeomType()
+    )
+    source_definition = source_layer.GetLayerDefn()
+    for i in range(source_definition.GetFieldCount()):
+        batch_layer.CreateField(source_definition.GetFieldDefn(i))
+    for fid in job.feature_ids:
+        source_feature = source_layer.GetFeature(fid)
+        if source_feature is None:
+            continue
+        feature = ogr.Feature(batch_layer.GetLayerDefn())
+        feature.SetFrom(source_feature)
+        feature.SetFID(fid)
+        batch_layer.CreateFeature(feature)
+    return batch_dataset, batch_layer
+
+
+def calculate_batch_job(job: BatchJob):
+    """
+    Calculates statistics of the batch in the worker process.
+
+    Args:
+        job (BatchJob): calculated batch.
+
+    Returns:
+        pandas DataFrame with statistics or, for geospatial output, path to the written GeoPackage shard.
+    """
+    from osgeo import gdal, ogr
+    from exactextract import exact_extract
+
+    if job.cache_bytes is not None:
+        gdal.SetCacheMax(job.cache_bytes)
+    batch_dataset, batch_layer = read_batch_features(job)
+    stats = job.stats + [
+        create_custom_function(code) for code in job.custom_functions_code
+    ]
+    rasters = raster_sources(job.rasters, selected_bands=job.selected_bands)
+    weights = None
+    if job.weights:
+        weights = raster_sources([job.weights], use_file_names=False)
+    if job.geospatial_output:
+        shard_dataset = ogr.GetDriverByName("GPKG").CreateDataSource(job.shard_path)
+        exact_extract(
+            vec=batch_layer,
+            rast=rasters,
+            weights=weights,
+            ops=stats,
+            include_cols=job.include_cols,
+            include_geom=True,
+            output="gdal",
+            output_options={"dataset": shard_dataset, "layer_name": SHARD_LAYER_NAME},
+            strategy=job.strategy,
+            max_cells_in_memory=job.max_cells_in_memory,
+        )
+        shard_dataset.FlushCache()
+        shard_dataset = None  # close the file
+        return job.shard_path
+
+    import pandas as pd  # noqa
+
+    return exact_extract(
+        vec=batch_layer,
+        rast=rasters,
+        weights=weights,
+        ops=stats,
+        include_cols=job.include_cols,
+        output="pandas",
+        strategy=job.strategy,
+        max_cells_in_memory=job.max_cells_in_memory,
+    )
+
+
+def ogr_source_layer(vector) -> Optional[Tuple[str, Optional[str], Optional[int]]]:
+    """
+    Resolves the file based OGR layer to the single layer of its file, which workers can read directly.
+    Layers with uncommitted edits and sources with other parts than the path, the layer and the subset
+    (e.g. geometry type of a mixed layer or files inside archives) are not resolved.
+
+    Args:
+        vector (QgsVectorLayer): input vector layer.
+
+    Returns:
+        Optional[Tuple[str, Optional[str], Optional[int]]]: path to the file, name and index of the layer,
+            None if the layer can't be read directly.
+    """
+    from osgeo import ogr
+    from qgis.core import QgsProviderRegistry
+
+    if vector.providerType() != "ogr" or vector.isModified():
+        return None
+    uri_parts = QgsProviderRegistry.instance().decodeUri("ogr", vector.source())
+    path = uri_parts.get("path", "")
+    if not os.path.isfile(path) or any(
+        value for key, value in uri_parts.items() if key not in DIRECT_URI_PARTS
+    ):
+        return None
+    layer_name = uri_parts.get("layerName") or None
+    layer_id = uri_parts.get("layerId")
+    layer_id = None if layer_id in (None, "") else int(layer_id)
+    dataset = ogr.Open(path)
+    if dataset is None:
+        return None
+    if layer_name:
+        resolved = dataset.GetLayerByName(layer_name) is not None
+    elif layer_id is not None:
+        resolved = 0 <= layer_id < dataset.GetLayerCount()
+    else:
+        resolved = dataset.GetLayerCount() == 1
+    dataset = None  # close the file
+    return (path, layer_name, layer_id) if resolved else None
+
+
+def export_for_workers(
+    vector, field_names: List[str], output_dir: str
+) -> Tuple[str, Optional[str], Optional[int]]:
+    """
+    Returns the file workers read features from. File based OGR layers resolved by `ogr_source_layer` are read
+    directly, other layers (e.g. memory or database layers, layers with uncommitted edits) are exported to
+    GeoPackage once, keeping feature ids.
+
+    Args:
+        vector (QgsVectorLayer): input vector layer.
+        field_names (List[str]): names of fields needed in the calculation.
+        output_dir (str): directory for the exported file.
+
+    Returns:
+        Tuple[str, Optional[str], Optional[int]]: path to the file, name and index of the layer.
+    """
+    from osgeo import ogr, osr
+    from qgis.core import QgsFeatureRequest, QgsVariantUtils
+    from qgis.PyQt.QtCore import QVariant
+
+    source_layer = ogr_source_layer(vector)
+    if source_layer is not None:
+        return source_layer
+
+    ogr_field_types = {
+        QVariant.Int: ogr.OFTInteger,
+        QVariant.LongLong: ogr.OFTInteger64,
+        QVariant.Double: ogr.OFTReal,
+    }
+    output_path = os.path.join(output_dir, "worker_source.gpkg")
+    dataset = ogr.GetDriverByName("GPKG").CreateDataSource(output_path)
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(vector.crs().toWkt())
+    layer = dataset.CreateLayer(WORKER_SOURCE_LAYER_NAME, srs, ogr.wkbUnknown)
+    fields = vector.fields()
+    for name in field_names:
+        field_type = ogr_field_types.get(fields.field(name).type(), ogr.OFTString)
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+
+    layer.StartTransaction()
+    request = QgsFeatureRequest().setSubsetOfAttributes(field_names, fields)
+    for feature in vector.getFeatures(request):
+        ogr_feature = ogr.Feature(layer.GetLayerDefn())
+        ogr_feature.SetFID(feature.id())
+        for name in field_names:
+            value = feature[name]
+            if QgsVariantUtils.isNull(value):
+                continue
+            if fields.field(name).type() not in ogr_field_types:
+                value = str(value)
+            ogr_feature.SetField(name, value)
+        if not feature.geometry().isEmpty():
+            ogr_feature.SetGeometry(
+                ogr.CreateGeometryFromWkb(bytes(feature.geometry().asWkb()))
+            )
+        layer.CreateFeature(ogr_feature)
+    layer.CommitTransaction()
+    dataset = None  # close the file
+    return output_path, WORKER_SOURCE_LAYER_NAME, None
+
+
+class ProcessPoolBackend:
+    """
+    Pool of worker processes calculating batches. Processes are started lazily with the first job
+    (or by `start`) and stay alive between calculation runs until `shutdown` is called, keeping their
+    imported libraries and open datasets.
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        Attributes:
+            max_workers (int): The number of worker processes.
+        """
+        self.max_workers: int = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, job: BatchJob) -> Future:
+        """
+        Schedules calculation of the batch in one of the workers.
+
+        Args:
+            job (BatchJob): calculated batch.
+
+        Returns:
+            Future: future holding result of `calculate_batch_job`.
+        """
+        try:
+            return self._get_executor().submit(calculate_batch_job, job)
+        except BrokenProcessPool:
+            # one of the workers died in a previous run, replace the whole pool
+            self._executor = None
+            return self._get_executor().submit(calculate_batch_job, job)
+
+    @property
+    def running(self) -> bool:
+        """
+        Returns:
+            bool: whether worker processes were started and not shut down.
+        """
+        return self._executor is not None
+
+    def start(self):
+        """
+        Starts all worker processes in advance, so the first calculation doesn't wait for them.
+        """
+        executor = self._get_executor()
+        for _ in range(self.max_workers):
+            executor.submit(warm_up)
+
+    def resize(self, max_workers: int):
+        """
+        Sets the number of worker processes. Running workers are stopped if their number differs,
+        the new number of workers is started lazily with the next job.
+
+        Args:
+            max_workers (int): The number of worker processes.
+        """
+        if max_workers == self.max_workers:
+            return
+        self.shutdown()
+        self.max_workers = max_workers
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(python_executable())
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=initialize_worker,
+            )
+        return self._executor
+
+    def shutdown(self):
+        """
+        Stops worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
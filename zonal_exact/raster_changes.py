@@ -0,0 +1,176 @@
+"""
+Detection of raster regions updated in place. Checksums of raster blocks are stored with the output,
+blocks with changed checksums give extents of dirty windows and features intersecting them are recalculated.
+"""
+
+from typing import Dict, List, Optional
+
+from osgeo import gdal
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsCsException,
+    QgsFeatureRequest,
+    QgsFeedback,
+    QgsGeometry,
+    QgsRectangle,
+    QgsSpatialIndex,
+)
+
+# block key ("band:column:row"): checksum of the block
+BlockChecksums = Dict[str, int]
+
+
+def block_checksums(
+    raster_path: str, feedback: QgsFeedback = None
+) -> Optional[BlockChecksums]:
+    """
+    Calculates checksums of all blocks of all bands of the raster.
+
+    Args:
+        raster_path (str): path to the raster.
+        feedback (QgsFeedback): feedback used to stop reading when it's canceled.
+
+    Returns:
+        Optional[BlockChecksums]: checksum of every block or None if the raster can't be opened by GDAL.
+    """
+    dataset = gdal.Open(raster_path)
+    if dataset is None:
+        return None
+    checksums: BlockChecksums = {}
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    for band_number in range(1, dataset.RasterCount + 1):
+        band = dataset.GetRasterBand(band_number)
+        block_width, block_height = band.GetBlockSize()
+        for row, y_offset in enumerate(range(0, height, block_height)):
+            if feedback is not None and feedback.isCanceled():
+                return checksums
+            for column, x_offset in enumerate(range(0, width, block_width)):
+                checksums[f"{band_number}:{column}:{row}"] = band.Checksum(
+                    x_offset,
+                    y_offset,
+                    min(block_width, width - x_offset),
+                    min(block_height, height - y_offset),
+                )
+    return checksums
+
+
+def changed_block_extents(
+    raster_path: str, previous: BlockChecksums, current: BlockChecksums
+) -> List[QgsRectangle]:
+    """
+    Compares checksums of blocks and returns extents of changed blocks. Blocks changed in any band
+    are reported once.
+
+    Args:
+        raster_path (str): path to the raster.
+        previous (BlockChecksums): checksums stored with the output.
+        current (BlockChecksums): current checksums.
+
+    Returns:
+        List[QgsRectangle]: extents of changed blocks in the raster CRS.
+    """
+    changed_blocks = set()
+    for key in set(previous) | set(current):
+        if previous.get(key) != current.get(key):
+            _, column, row = key.split(":")
+            changed_blocks.add((int(column), int(row)))
+    if not changed_blocks:
+        return []
+
+    dataset = gdal.Open(raster_path)
+    # all bands of GDAL datasets usually share the block size
+    block_width, block_height = dataset.GetRasterBand(1).GetBlockSize()
+    x_origin, pixel_width, _, y_origin, _, pixel_height = dataset.GetGeoTransform()
+    extents = []
+    for column, row in sorted(changed_blocks):
+        x_min = x_origin + column * block_width * pixel_width
+        y_max = y_origin + row * block_height * pixel_height
+        extents.append(
+            QgsRectangle(
+                x_min,
+                y_max + block_height * pixel_height,
+                x_min + block_width * pixel_width,
+                y_max,
+            )
+        )
+    return extents
+
+
+def raster_crs(raster_path: str) -> QgsCoordinateReferenceSystem:
+    """
+    Args:
+        raster_path (str): path to the raster.
+
+    Returns:
+        QgsCoordinateReferenceSystem: CRS of the raster, invalid if it's unknown.
+    """
+    dataset = gdal.Open(raster_path)
+    if dataset is None:
+        return QgsCoordinateReferenceSystem()
+    return QgsCoordinateReferenceSystem.fromWkt(dataset.GetProjection())
+
+
+def transform_extents(
+    extents: List[QgsRectangle],
+    source_crs: QgsCoordinateReferenceSystem,
+    destination_crs: QgsCoordinateReferenceSystem,
+) -> List[QgsRectangle]:
+    """
+    Transforms extents to another CRS. Extents are left as they are if one of CRSs is unknown.
+
+    Args:
+        extents (List[QgsRectangle]): extents in the source CRS.
+        source_crs (QgsCoordinateReferenceSystem): CRS of extents.
+        destination_crs (QgsCoordinateReferenceSystem): requested CRS.
+
+    Returns:
+        List[QgsRectangle]: extents in the destination CRS.
+    """
+    if (
+        not source_crs.isValid()
+        or not destination_crs.isValid()
+        or source_crs == destination_crs
+    ):
+        return extents
+    transform = QgsCoordinateTransform(
+        source_crs, destination_crs, QgsCoordinateTransformContext()
+    )
+    transformed = []
+    for extent in extents:
+        try:
+            transformed.append(transform.transformBoundingBox(extent))
+        except QgsCsException:
+            # extent outside of the area of use of the destination CRS can't contain any feature
+            continue
+    return transformed
+
+
+def features_in_extents(source, extents: List[QgsRectangle]) -> List[int]:
+    """
+    Finds features intersecting any of the extents. Candidates are found by bounding boxes in a spatial index
+    and checked against geometries stored in the index.
+
+    Args:
+        source: QgsVectorLayer or QgsVectorLayerFeatureSource to read features from.
+        extents (List[QgsRectangle]): extents in CRS of the source.
+
+    Returns:
+        List[int]: ids of features intersecting extents.
+    """
+    if not extents:
+        return []
+    index = QgsSpatialIndex(
+        source.getFeatures(QgsFeatureRequest().setNoAttributes()),
+        flags=QgsSpatialIndex.FlagStoreFeatureGeometries,
+    )
+    feature_ids = set()
+    for extent in extents:
+        extent_geometry = QgsGeometry.fromRect(extent)
+        for fid in index.intersects(extent):
+            if fid not in feature_ids and index.geometry(fid).intersects(
+                extent_geometry
+            ):
+                feature_ids.add(fid)
+    return sorted(feature_ids)
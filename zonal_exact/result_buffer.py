@@ -0,0 +1,236 @@
+"""
+Bounded buffer of results of finished batches. Results are kept in memory until their estimated size exceeds
+the limit, then the oldest ones are spilled to temporary files - pickled pandas DataFrames or GeoPackages for
+geospatial results - and read back one by one while results are merged.
+"""
+
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set
+
+from qgis.core import (
+    QgsCoordinateTransformContext,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from .band_ranges import BandRangeResult
+from .layer_writer import OutputWriteError
+from .tuning import STATISTIC_BYTES, VERTEX_BYTES
+
+
+def result_bytes(result) -> int:
+    """
+    Estimates memory used by the result of a batch.
+
+    Args:
+        result: pandas DataFrame, QgsVectorLayer or `BandRangeResult`.
+
+    Returns:
+        int: estimated size in bytes, 0 for layers reading files.
+    """
+    if isinstance(result, BandRangeResult):
+        return result_bytes(result.result)
+    if isinstance(result, QgsVectorLayer):
+        if result.providerType() != "memory":
+            return 0
+        fields_count = len(result.fields())
+        size = 0
+        for feature in result.getFeatures():
+            size += fields_count * STATISTIC_BYTES
+            geometry = feature.geometry()
+            if not geometry.isNull():
+                size += geometry.constGet().nCoordinates() * VERTEX_BYTES
+        return size
+    return int(result.memory_usage(deep=True).sum())
+
+
+@dataclass
+class SpilledResult:
+    """
+    Result of a batch written to a temporary file.
+
+    Attributes:
+        path (str): path to the file.
+        geospatial (bool): whether the file is a GeoPackage with a geospatial result.
+        band_range (Optional[int]): index of the band range of the result, see `BandRangeResult`.
+    """
+
+    path: str
+    geospatial: bool
+    band_range: Optional[int] = None
+
+    def load(self):
+        """
+        Returns:
+            the result read from the file - QgsVectorLayer reading the GeoPackage or pandas DataFrame.
+        """
+        if self.geospatial:
+            result = QgsVectorLayer(self.path, "temporary_layer", "ogr")
+        else:
+            import pandas as pd
+
+            result = pd.read_pickle(self.path)
+        if self.band_range is not None:
+            return BandRangeResult(self.band_range, result)
+        return result
+
+
+class ResultBuffer:
+    """
+    List of results of finished batches shared by calculation subtasks. It's filled with `append` like a list.
+    Once estimated size of results kept in memory exceeds the limit, the oldest of them are spilled to files
+    in a temporary directory. Results to spill are chosen with the lock held, but their files are written without
+    it, so other subtasks can add results meanwhile. Iteration yields results in the order they were added, spilled results are
+    read back one at a time.
+    """
+
+    def __init__(self, limit_bytes: int = 0, spill_dir: str = None):
+        """
+        Attributes:
+            limit_bytes (int): size of results kept in memory, 0 keeps all results in memory.
+            spill_dir (str): directory of spilled results, a temporary directory is created if not set.
+                The directory is removed by `clear`.
+        """
+        self.limit_bytes: int = limit_bytes
+        self.spill_dir: str = spill_dir
+        self.memory_bytes: int = 0
+        # results in memory or `SpilledResult`s
+        self._results: List = []
+        self._sizes: List[int] = []
+        self._spilled_count: int = 0
+        # indices of results being written to files
+        self._spilling: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __iter__(self) -> Iterator:
+        with self._lock:
+            results = list(self._results)
+        for result in results:
+            yield result.load() if isinstance(result, SpilledResult) else result
+
+    @property
+    def spilled_count(self) -> int:
+        """
+        Returns:
+            int: number of results spilled to files.
+        """
+        return self._spilled_count
+
+    def append(self, result):
+        """
+        Adds the result of a batch, spilling the oldest results in memory if the buffer is over the limit.
+
+        Args:
+            result: pandas DataFrame, QgsVectorLayer or `BandRangeResult`.
+
+        Raises:
+            OutputWriteError: if a result can't be spilled, it's kept in memory then.
+        """
+        size = result_bytes(result) if self.limit_bytes else 0
+        with self._lock:
+            self._results.append(result)
+            self._sizes.append(size)
+            self.memory_bytes += size
+            indices = self.spill_candidates()
+        for position, index in enumerate(indices):
+            try:
+                self.spill(index)
+            except OutputWriteError:
+                with self._lock:
+                    # results that were not spilled stay in memory
+                    for kept_index in indices[position:]:
+                        self.memory_bytes += self._sizes[kept_index]
+                        self._spilling.discard(kept_index)
+                raise
+
+    def spill_candidates(self) -> List[int]:
+        """
+        Chooses the oldest results in memory to spill until the buffer is within the limit. Chosen results are
+        not counted in memory from now on, so results added meanwhile don't spill them again. It's called with
+        the lock held.
+
+        Returns:
+            List[int]: indices of results to spill.
+        """
+        indices = []
+        index = 0
+        while self.memory_bytes > self.limit_bytes and index < len(self._results):
+            if self._sizes[index] > 0 and index not in self._spilling:
+                self._spilling.add(index)
+                self.memory_bytes -= self._sizes[index]
+                indices.append(index)
+            index += 1
+        return indices
+
+    def extend(self, results: Iterable):
+        """
+        Args:
+            results (Iterable): results of batches, see `append`.
+        """
+        for result in results:
+            self.append(result)
+
+    def spill(self, index: int):
+        """
+        Writes the result to a file and replaces it with `SpilledResult`. The file is written without the lock,
+        the result is replaced with the lock held.
+
+        Args:
+            index (int): index of the result in memory, chosen by `spill_candidates`.
+
+        Raises:
+            OutputWriteError: if the file can't be written.
+        """
+        result = self._results[index]
+        band_range = None
+        if isinstance(result, BandRangeResult):
+            band_range, result = result.band_range, result.result
+        geospatial = isinstance(result, QgsVectorLayer)
+        file_name = f"result_{index}.{'gpkg' if geospatial else 'pkl'}"
+        try:
+            with self._lock:
+                if self.spill_dir is None:
+                    self.spill_dir = tempfile.mkdtemp(prefix="zonal_exact_results_")
+                spill_dir = Path(self.spill_dir)
+            spill_dir.mkdir(parents=True, exist_ok=True)
+            path = spill_dir / file_name
+            if geospatial:
+                options = QgsVectorFileWriter.SaveVectorOptions()
+                options.driverName = "GPKG"
+                error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+                    result, str(path), QgsCoordinateTransformContext(), options
+                )
+                if error != QgsVectorFileWriter.NoError:
+                    raise OutputWriteError(
+                        f"Unable to spill result {file_name}: {message}"
+                    )
+            else:
+                result.to_pickle(path)
+        except OSError as ex:
+            raise OutputWriteError(f"Unable to spill result {file_name}: {ex}") from ex
+        with self._lock:
+            self._results[index] = SpilledResult(str(path), geospatial, band_range)
+            self._sizes[index] = 0
+            self._spilling.discard(index)
+            self._spilled_count += 1
+
+    def clear(self):
+        """
+        Removes all results and files of spilled results.
+        """
+        with self._lock:
+            self._results.clear()
+            self._sizes.clear()
+            self._spilling.clear()
+            self.memory_bytes = 0
+            self._spilled_count = 0
+            if self.spill_dir is not None:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+                self.spill_dir = None
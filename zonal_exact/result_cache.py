@@ -0,0 +1,279 @@
+"""
+Persistent cache of statistics calculated for single features. Results are stored in SQLite database
+for every pair of feature geometry and operation, so repeated calculations only compute missing pairs.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from qgis.core import QgsApplication, QgsGeometry
+
+from .utils import source_file_path
+
+# default size limit of the cache database
+DEFAULT_CACHE_SIZE_MB = 1024
+# size of the cache after eviction as a fraction of its limit
+EVICTION_TARGET = 0.9
+# maximal number of SQL query parameters used at once
+QUERY_CHUNK_SIZE = 500
+
+# (feature hash, operation key)
+CacheKey = Tuple[str, str]
+
+
+def default_cache_path() -> Path:
+    """
+    Returns:
+        Path: path to the cache database in QGIS profile directory.
+    """
+    return Path(QgsApplication.qgisSettingsDirPath()) / "zonal_exact" / "cache.sqlite"
+
+
+def feature_hash(geometry: QgsGeometry) -> str:
+    """
+    Args:
+        geometry (QgsGeometry): geometry of the feature.
+
+    Returns:
+        str: hash of the WKB of the geometry.
+    """
+    return hashlib.sha1(bytes(geometry.asWkb())).hexdigest()
+
+
+def file_signature(path: Optional[str]) -> Optional[List]:
+    """
+    Describes the raster file, so changed raster doesn't reuse results cached for its previous version.
+    Connection strings of GDAL virtual rasters are described by the file they read.
+
+    Args:
+        path (Optional[str]): path or GDAL connection string of the raster.
+
+    Returns:
+        Optional[List]: path with modification time and size of the file.
+    """
+    if not path:
+        return None
+    try:
+        stat = os.stat(source_file_path(path))
+        return [path, stat.st_mtime, stat.st_size]
+    except OSError:
+        return [path]
+
+
+def operation_key(
+    stat_code: str,
+    raster_paths: List[str],
+    weights_path: Optional[str],
+    selected_bands: Optional[Dict[str, List[int]]] = None,
+    vector_crs: str = "",
+) -> str:
+    """
+    Creates the key of the operation. It combines the operation with signatures of all rasters and bands
+    it's calculated for (names of output columns depend on all of them), the weights raster and CRS of polygons.
+    Features are identified by WKB of their geometries, which exactextract reads in CRS of the layer.
+
+    Args:
+        stat_code (str): name of exactextract operation or code of the custom function.
+        raster_paths (List[str]): paths to rasters.
+        weights_path (Optional[str]): path to the weights raster.
+        selected_bands (Optional[Dict[str, List[int]]]): numbers of bands selected by user for rasters.
+        vector_crs (str): authority id or WKT of CRS of the vector layer.
+
+    Returns:
+        str: hash identifying the operation.
+    """
+    description = [
+        stat_code,
+        [file_signature(path) for path in raster_paths],
+        file_signature(weights_path),
+        vector_crs,
+    ]
+    if selected_bands:
+        # keys of operations calculated for all bands stay the same
+        description.append([selected_bands.get(path) for path in raster_paths])
+    return hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+
+
+def split_operation_columns(
+    columns: List[str], include_cols: List[str], operations_count: int
+) -> Optional[List[List[str]]]:
+    """
+    Assigns output columns of exactextract to operations. exactextract writes columns of operations
+    one after another, every operation has one column for each raster band.
+
+    Args:
+        columns (List[str]): columns of exactextract result.
+        include_cols (List[str]): columns copied from the input layer.
+        operations_count (int): number of calculated operations.
+
+    Returns:
+        Optional[List[List[str]]]: columns of each operation or None if they can't be assigned.
+    """
+    statistic_columns = [column for column in columns if column not in include_cols]
+    if operations_count == 0 or len(statistic_columns) % operations_count != 0:
+        return None
+    width = len(statistic_columns) // operations_count
+    return [
+        statistic_columns[i : i + width]
+        for i in range(0, len(statistic_columns), width)
+    ]
+
+
+class ResultCache:
+    """
+    SQLite database with results of operations for features. Least recently used results are evicted when
+    the database grows over its size limit. Every thread uses its own connection.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_size_mb: int = DEFAULT_CACHE_SIZE_MB,
+        operation_keys: List[str] = None,
+    ):
+        """
+        Attributes:
+            path (Path): path to the database.
+            max_size_mb (int): size limit of cached results in megabytes.
+            operation_keys (List[str]): keys of operations of the running calculation, see `operation_key`.
+        """
+        self.path: Path = Path(path)
+        self.max_size: int = max_size_mb * 1024 * 1024
+        self.operation_keys: List[str] = operation_keys or []
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.path), timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "feature_hash TEXT NOT NULL, operation_key TEXT NOT NULL, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (feature_hash, operation_key))"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+        )
+        return connection
+
+    def lookup(self, feature_hashes: Iterable[str]) -> Dict[CacheKey, Dict]:
+        """
+        Reads cached results of operations of the running calculation for features.
+
+        Args:
+            feature_hashes (Iterable[str]): hashes of features, see `feature_hash`.
+
+        Returns:
+            Dict[CacheKey, Dict]: output columns with values for every cached feature and operation.
+        """
+        feature_hashes = list(set(feature_hashes))
+        if not self.operation_keys or not feature_hashes:
+            return {}
+        results: Dict[CacheKey, Dict] = {}
+        connection = self._connect()
+        try:
+            operations_placeholders = ",".join("?" * len(self.operation_keys))
+            for i in range(0, len(feature_hashes), QUERY_CHUNK_SIZE):
+                chunk = feature_hashes[i : i + QUERY_CHUNK_SIZE]
+                rows = connection.execute(
+                    "SELECT feature_hash, operation_key, value FROM results "
+                    f"WHERE feature_hash IN ({','.join('?' * len(chunk))}) "
+                    f"AND operation_key IN ({operations_placeholders})",
+                    chunk + self.operation_keys,
+                ).fetchall()
+                for hash_value, key, value in rows:
+                    results[(hash_value, key)] = pickle.loads(value)
+            now = time.time()
+            with connection:
+                connection.executemany(
+                    "UPDATE results SET last_used = ? "
+                    "WHERE feature_hash = ? AND operation_key = ?",
+                    [(now, hash_value, key) for hash_value, key in results],
+                )
+        finally:
+            connection.close()
+        return results
+
+    def store(self, results: Dict[CacheKey, Dict]):
+        """
+        Saves results of operations and evicts least recently used results if the cache is too big.
+
+        Args:
+            results (Dict[CacheKey, Dict]): output columns with values for features and operations.
+        """
+        if not results:
+            return
+        now = time.time()
+        rows = []
+        for (hash_value, key), value in results.items():
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((hash_value, key, blob, len(blob), now))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO results "
+                    "(feature_hash, operation_key, value, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self._evict(connection)
+        finally:
+            connection.close()
+
+    def _evict(self, connection: sqlite3.Connection):
+        total_size = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        to_free = total_size - self.max_size * EVICTION_TARGET
+        freed = 0
+        evicted = []
+        for hash_value, key, size in connection.execute(
+            "SELECT feature_hash, operation_key, size FROM results ORDER BY last_used"
+        ):
+            evicted.append((hash_value, key))
+            freed += size
+            if freed >= to_free:
+                break
+        with connection:
+            connection.executemany(
+                "DELETE FROM results WHERE feature_hash = ? AND operation_key = ?",
+                evicted,
+            )
+
+    def size(self) -> int:
+        """
+        Returns:
+            int: size of cached results in bytes.
+        """
+        if not self.path.exists():
+            return 0
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+    def clear(self):
+        """
+        Removes all cached results.
+        """
+        if not self.path.exists():
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM results")
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
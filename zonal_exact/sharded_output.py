@@ -0,0 +1,245 @@
+"""
+Sharded output. Every calculation subtask writes results of its batches to its own shard file, so writing is
+done in parallel and no results are merged at the end. Shards are united by an OGR virtual layer (VRT) written
+in place of the merge, it's loaded into QGIS and exported like any other layer.
+"""
+
+import os
+import shutil
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List
+
+from qgis.core import QgsCoordinateReferenceSystem
+
+from .csv_output import write_csvt
+from .layer_writer import OutputWriteError, StreamingLayerWriter
+from .parquet_output import PARQUET_EXTENSION, ParquetTableWriter
+
+# extension of the virtual layer uniting shards
+UNION_EXTENSION = ".vrt"
+
+
+def write_union_vrt(union_path: Path, shard_paths: List[Path], layer_name: str):
+    """
+    Writes the OGR virtual layer uniting layers of the shards. Paths of shards are relative to the virtual layer,
+    so the output can be moved together with its shards.
+
+    Args:
+        union_path (Path): path to the `.vrt` file, it's replaced once the file is written.
+        shard_paths (List[Path]): shard files, each with a single layer named after the file.
+        layer_name (str): name of the united layer.
+    """
+    data_source = ET.Element("OGRVRTDataSource")
+    union_layer = ET.SubElement(data_source, "OGRVRTUnionLayer", name=layer_name)
+    for shard_path in shard_paths:
+        shard_layer = ET.SubElement(union_layer, "OGRVRTLayer", name=shard_path.stem)
+        source = ET.SubElement(shard_layer, "SrcDataSource", relativeToVRT="1")
+        source.text = Path(os.path.relpath(shard_path, union_path.parent)).as_posix()
+        ET.SubElement(shard_layer, "SrcLayer").text = shard_path.stem
+    partial_path = union_path.with_name(
+        f"{union_path.stem}_zonal_partial{union_path.suffix}"
+    )
+    ET.ElementTree(data_source).write(partial_path, encoding="utf-8")
+    os.replace(partial_path, union_path)
+
+
+class ShardWriter:
+    """
+    Shard written by a single calculation subtask. Geospatial results are appended by `StreamingLayerWriter`,
+    tabular results are appended to the CSV file with types of columns in the `.csvt` file or written as row groups
+    of the Parquet file.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        geospatial_output: bool,
+        crs: QgsCoordinateReferenceSystem,
+        prefix: str = "",
+        source_columns: Dict[str, int] = None,
+        row_group_size: int = 0,
+    ):
+        """
+        Attributes:
+            path (Path): path to the shard file.
+            geospatial_output (bool): whether results are layers, otherwise they're pandas DataFrames.
+            crs (QgsCoordinateReferenceSystem): CRS of geospatial output.
+            prefix (str): prefix added to names of columns with statistics.
+            source_columns (Dict[str, int]): columns copied from the input layer, they're not prefixed.
+            row_group_size (int): rows of row groups of GeoParquet shards, see `StreamingLayerWriter`.
+        """
+        self.path: Path = Path(path)
+        self.prefix: str = prefix
+        self.source_columns: Dict[str, int] = source_columns or {}
+        self.layer_writer: StreamingLayerWriter = None
+        self.parquet_writer: ParquetTableWriter = None
+        if geospatial_output:
+            self.layer_writer = StreamingLayerWriter(
+                self.path, crs, prefix, self.source_columns
+            )
+            self.layer_writer.row_group_size = row_group_size
+        elif self.path.suffix == PARQUET_EXTENSION:
+            self.parquet_writer = ParquetTableWriter(self.path)
+        self.batches_count: int = 0
+
+    def append(self, result):
+        """
+        Appends the result of a batch to the shard.
+
+        Args:
+            result: QgsVectorLayer or pandas DataFrame.
+
+        Raises:
+            OutputWriteError: if the result can't be written.
+        """
+        if self.layer_writer is not None:
+            self.layer_writer.append(result)
+        else:
+            frame = result.rename(
+                columns={
+                    column: f"{self.prefix}{column}"
+                    for column in result.columns
+                    if column not in self.source_columns
+                }
+            )
+            try:
+                if self.parquet_writer is not None:
+                    self.parquet_writer.append(frame)
+                else:
+                    self.append_csv(frame)
+            except OSError as ex:
+                raise OutputWriteError(f"Unable to write {self.path}: {ex}") from ex
+        self.batches_count += 1
+
+    def append_csv(self, frame):
+        """
+        Appends rows to the CSV file, the first batch writes the header and the `.csvt` file.
+
+        Args:
+            frame: pandas DataFrame with prefixed columns.
+        """
+        first_batch = self.batches_count == 0
+        frame.to_csv(
+            self.path,
+            mode="w" if first_batch else "a",
+            header=first_batch,
+            index=False,
+        )
+        if first_batch:
+            write_csvt(frame, self.path)
+
+    def finish(self):
+        """
+        Completes the shard, geospatial and Parquet shards are moved from their partial files.
+        """
+        if self.layer_writer is not None:
+            self.layer_writer.finish()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+class ShardedOutput:
+    """
+    Output written as shards in the directory next to the output file and united by the virtual layer.
+    Shards have format of the output file, the virtual layer has the name of the output file with `.vrt`
+    extension. Writers of shards are created for every subtask, shards are united by `finish`.
+    """
+
+    def __init__(
+        self,
+        output_file_path: Path,
+        geospatial_output: bool,
+        crs: QgsCoordinateReferenceSystem,
+        prefix: str = "",
+        source_columns: Dict[str, int] = None,
+    ):
+        """
+        Attributes:
+            output_file_path (Path): path to the output file selected by user, it decides format of shards.
+            geospatial_output (bool): whether results are layers, otherwise they're pandas DataFrames.
+            crs (QgsCoordinateReferenceSystem): CRS of geospatial output.
+            prefix (str): prefix added to names of columns with statistics.
+            source_columns (Dict[str, int]): columns copied from the input layer, they're not prefixed.
+        """
+        self.output_file_path: Path = Path(output_file_path)
+        self.geospatial_output: bool = geospatial_output
+        self.crs: QgsCoordinateReferenceSystem = crs
+        self.prefix: str = prefix
+        self.source_columns: Dict[str, int] = source_columns or {}
+        self.union_path: Path = self.output_file_path.with_suffix(UNION_EXTENSION)
+        self.shards_dir: Path = self.output_file_path.with_name(
+            f"{self.output_file_path.stem}_shards"
+        )
+        # rows of row groups of GeoParquet shards, see `StreamingLayerWriter`
+        self.row_group_size: int = 0
+        self.writers: List[ShardWriter] = []
+        self.completed: bool = False
+        self._lock = threading.Lock()
+
+    @property
+    def batches_count(self) -> int:
+        """
+        Returns:
+            int: number of batches written to all shards.
+        """
+        return sum(writer.batches_count for writer in self.writers)
+
+    def prepare(self):
+        """
+        Removes shards of the previous calculation with the same output.
+        """
+        shutil.rmtree(self.shards_dir, ignore_errors=True)
+        self.shards_dir.mkdir(parents=True)
+
+    def create_writer(self) -> ShardWriter:
+        """
+        Returns:
+            ShardWriter: writer of a new shard.
+        """
+        with self._lock:
+            writer = ShardWriter(
+                self.shards_dir
+                / f"shard_{len(self.writers)}{self.output_file_path.suffix}",
+                self.geospatial_output,
+                self.crs,
+                self.prefix,
+                self.source_columns,
+                self.row_group_size,
+            )
+            self.writers.append(writer)
+        return writer
+
+    def shard_paths(self) -> List[Path]:
+        """
+        Returns:
+            List[Path]: shards with at least one batch.
+        """
+        return [writer.path for writer in self.writers if writer.batches_count > 0]
+
+    def finish(self) -> Path:
+        """
+        Completes all shards and writes the virtual layer uniting them.
+
+        Returns:
+            Path: path to the virtual layer.
+
+        Raises:
+            OutputWriteError: if no batch was written.
+        """
+        for writer in self.writers:
+            writer.finish()
+        shard_paths = self.shard_paths()
+        if not shard_paths:
+            raise OutputWriteError(f"No shards of {self.output_file_path} were written")
+        write_union_vrt(self.union_path, shard_paths, self.output_file_path.stem)
+        self.completed = True
+        return self.union_path
+
+    def discard(self):
+        """
+        Removes shards of a canceled or failed calculation. Shards of the finished output are kept.
+        """
+        if not self.completed:
+            shutil.rmtree(self.shards_dir, ignore_errors=True)
@@ -1,20 +1,268 @@
+import math
+import threading
+from collections import deque
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 
 from exactextract import exact_extract
+from exactextract.feature import QGISFeature, QGISFeatureSource
 
 from qgis.core import (
+    QgsAbstractFeatureSource,
+    QgsFeatureRequest,
+    QgsFeedback,
     QgsTask,
     QgsMessageLog,
+    QgsRectangle,
     QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
 )
-from qgis import processing
 from PyQt5.QtCore import pyqtSignal
 
+from .band_ranges import BandRange, BandRangeResult, band_sources, join_band_ranges
+from .checkpoint import RunCheckpoint
+from .coverage_index import (
+    WEIGHTED_STATS,
+    CoverageIndexStore,
+    calculate_linear_statistics,
+    merge_operation_columns,
+    split_linear_stats,
+)
+from .csv_output import CsvBlockWriter, write_csv
+from .incremental import IncrementalUpdate, geometry_hashes
+from .layer_writer import OutputWriteError, StreamingLayerWriter
+from .parquet_output import ParquetTableWriter, write_parquet
+from .partitioning import (
+    CHUNKS_PER_SUBTASK,
+    FeatureBatch,
+    FeatureInfo,
+    collect_feature_info,
+    estimate_feature_cost,
+    raster_cell_areas,
+    spatially_sorted_ids,
+    split_by_cost,
+)
+from .process_pool import SHARD_LAYER_NAME, BatchJob, ProcessPoolBackend
+from .raster_changes import (
+    block_checksums,
+    changed_block_extents,
+    features_in_extents,
+    raster_crs,
+    transform_extents,
+)
+from .result_cache import ResultCache, feature_hash, split_operation_columns
+from .sharded_output import ShardedOutput, ShardWriter
+from .tuning import (
+    AUTO_STRATEGY,
+    DEFAULT_MAX_CELLS_IN_MEMORY,
+    MemoryPlan,
+    RasterLayout,
+    available_threads,
+    calibrate,
+    calibration_sample,
+    choose_parallelism,
+    choose_strategy,
+    estimate_batch_memory,
+    plan_memory,
+    raster_sequential_limit,
+    read_raster_layout,
+    resolve_strategy,
+    subtask_cache_bytes,
+)
+
+# interval of checking whether the task waiting for worker process was canceled
+CANCEL_POLL_SECONDS = 0.2
+
+
+class CalculationCanceled(Exception):
+    """
+    Raised from the exactextract progress callback to stop the calculation of a canceled task.
+    """
+
+
+def calculate_statistics(
+    polygon_layer,
+    rasters: List[str],
+    weights: List[str],
+    stats: List[str],
+    include_cols: Dict[str, int],
+    geospatial_output: bool,
+    strategy: str,
+    progress=False,
+    max_cells_in_memory: int = DEFAULT_MAX_CELLS_IN_MEMORY,
+):
+    """
+    Calculates the statistics for the polygon layer using exactextract
+
+    Args:
+        polygon_layer: The polygon layer (or `FeatureSubsetSource`) to perform the statistics on.
+        rasters (List[str]): The list of raster files to use in the statistics.
+        weights (List[str]): The list of weights to use in the statistics.
+        stats (List[str]): The list of statistics to calculate.
+        include_cols (Dict[str, int]): The dict of column_name: column_id. Column names are to be included in the output.
+        geospatial_output (bool): A boolean indicating whether to include the geometry in the output and use QGIS writer in exactextract.
+        strategy (str): The strategy to use in the exactextract function.
+        progress: The callback receiving progress of the calculation or False.
+        max_cells_in_memory (int): The number of raster cells exactextract reads at once.
+
+    Returns:
+        The result of exact_extract - QgsVectorLayer for geospatial output or pandas DataFrame otherwise.
+    """
+    if geospatial_output:
+        return exact_extract(
+            vec=polygon_layer,
+            rast=rasters,
+            weights=weights,
+            ops=stats,
+            include_cols=list(include_cols.keys()),
+            progress=progress,
+            include_geom=True,
+            output="qgis",
+            strategy=strategy,
+            max_cells_in_memory=max_cells_in_memory,
+        )
+    else:
+        import pandas as pd  # noqa
+
+        return exact_extract(
+            vec=polygon_layer,
+            rast=rasters,
+            weights=weights,
+            ops=stats,
+            include_cols=include_cols,
+            progress=progress,
+            output="pandas",
+            strategy=strategy,
+            max_cells_in_memory=max_cells_in_memory,
+        )
+
+
+class FeatureSubsetSource(QGISFeatureSource):
+    """
+    exactextract feature source reading a subset of features straight from the data provider of the layer.
+    Features are fetched lazily while exactextract iterates over them, so nothing is copied into a memory layer.
+    """
+
+    def __init__(
+        self,
+        feature_source: QgsAbstractFeatureSource,
+        srs_wkt: str,
+        attribute_ids: List[int],
+        feature_ids: List[int] = None,
+    ):
+        """
+        Attributes:
+            feature_source (QgsAbstractFeatureSource): thread-safe source of features, e.g. `QgsVectorLayerFeatureSource`.
+            srs_wkt (str): WKT of the layer CRS.
+            attribute_ids (List[int]): indices of attributes fetched with features.
+            feature_ids (List[int]): ids of features in the subset.
+        """
+        super().__init__(feature_source)
+        self.srs: str = srs_wkt
+        self.attribute_ids: List[int] = attribute_ids
+        self.feature_ids: List[int] = feature_ids or []
+
+    @classmethod
+    def from_layer(
+        cls, vector: QgsVectorLayer, attribute_names: List[str]
+    ) -> "FeatureSubsetSource":
+        """
+        Creates an empty subset of the layer. It has to be called from the main thread.
+
+        Args:
+            vector (QgsVectorLayer): input vector layer.
+            attribute_names (List[str]): names of attributes fetched with features.
+
+        Returns:
+            FeatureSubsetSource: subset without features, use `subset` to select them.
+        """
+        fields = vector.fields()
+        return cls(
+            QgsVectorLayerFeatureSource(vector),
+            vector.crs().toWkt(),
+            [fields.indexFromName(name) for name in attribute_names],
+        )
+
+    def subset(self, feature_ids: List[int]) -> "FeatureSubsetSource":
+        """
+        Args:
+            feature_ids (List[int]): ids of features in the subset.
+
+        Returns:
+            FeatureSubsetSource: subset with given features sharing the same feature source.
+        """
+        return FeatureSubsetSource(self.src, self.srs, self.attribute_ids, feature_ids)
+
+    def count(self):
+        return len(self.feature_ids)
+
+    def __iter__(self):
+        request = (
+            QgsFeatureRequest()
+            .setFilterFids(self.feature_ids)
+            .setSubsetOfAttributes(self.attribute_ids)
+        )
+        for feature in self.src.getFeatures(request):
+            yield QGISFeature(feature)
+
+    def srs_wkt(self):
+        return self.srs
+
+
+class BatchQueue:
+    """
+    A thread-safe queue of feature batches shared by calculation subtasks. Subtask that finished its batch
+    pulls the next one, so a single slow batch doesn't keep the remaining subtasks idle.
+    """
+
+    def __init__(self, batches: List[FeatureBatch]):
+        """
+        Attributes:
+            batches (List[FeatureBatch]): batches to be processed.
+        """
+        self._batches = deque(batches)
+        self._lock = threading.Lock()
+        self.total_count: int = len(batches)
+        self.finished_count: int = 0
+
+    def next_batch(self) -> Optional[FeatureBatch]:
+        """
+        Takes the next batch from the queue.
+
+        Returns:
+            Optional[FeatureBatch]: batch to be processed or None if the queue is empty.
+        """
+        with self._lock:
+            if not self._batches:
+                return None
+            return self._batches.popleft()
+
+    def mark_finished(self):
+        """
+        Marks one of the taken batches as processed.
+        """
+        with self._lock:
+            self.finished_count += 1
+
+    def progress(self) -> float:
+        """
+        Returns:
+            float: percentage of processed batches.
+        """
+        if self.total_count == 0:
+            return 100.0
+        return 100.0 * self.finished_count / self.total_count
+
 
 class CalculateStatsTask(QgsTask):
     """
     A class representing a task to calculate statistics using the exact_extract function.
+    It processes either a single polygon layer or batches pulled from a shared `BatchQueue` until it's empty.
+    With `process_backend` set, batches are calculated in worker processes and the task only waits for them.
+    Canceled task stops the running calculation and doesn't take next batches from the queue.
     """
 
     taskChanged = pyqtSignal(str)
@@ -31,6 +279,18 @@ class CalculateStatsTask(QgsTask):
         include_cols: Dict[str, int],
         geospatial_output: bool,
         strategy: str,
+        batch_queue: BatchQueue = None,
+        feature_source: FeatureSubsetSource = None,
+        process_backend: ProcessPoolBackend = None,
+        job_template: BatchJob = None,
+        checkpoint: RunCheckpoint = None,
+        result_cache: ResultCache = None,
+        coverage_store: CoverageIndexStore = None,
+        band_ranges: List[BandRange] = None,
+        max_cells_in_memory: int = DEFAULT_MAX_CELLS_IN_MEMORY,
+        layer_writer: StreamingLayerWriter = None,
+        shard_writer: ShardWriter = None,
+        selected_bands: Dict[str, List[int]] = None,
     ):
         """
         Attributes:
@@ -43,7 +303,25 @@ class CalculateStatsTask(QgsTask):
         stats (List[str]): The list of statistics to calculate.
         include_cols (Dict[str, int]): The dict of column_name: column_id. Column names are to be included in the output.
         geospatial_output (bool): A boolean indicating whether to include the geometry in the output and use QGIS writer in exactextract.
-        strategy (str): The strategy to use in the exactextract function. Can be "feature-sequential" or "raster-sequential".
+        strategy (str): The strategy to use in the exactextract function. Can be "feature-sequential", "raster-sequential"
+            or "auto" - strategy chosen for every batch by `PlanBatchesTask`.
+        batch_queue (BatchQueue): The queue with batches to process. If set, polygon_layer is ignored.
+        feature_source (FeatureSubsetSource): The source features of batches are read from, owned by this task.
+        process_backend (ProcessPoolBackend): The pool of worker processes calculating batches from the queue.
+        job_template (BatchJob): The job with calculation parameters used by worker processes, filled with features of each batch.
+        checkpoint (RunCheckpoint): The checkpoints of the calculation, result of every batch is saved in them.
+        result_cache (ResultCache): The cache of results of single features, used only for tabular output.
+        coverage_store (CoverageIndexStore): The coverage indexes shared by rasters on the same grid. If set,
+            linear statistics of batches are reduced from coverage fractions, other statistics are calculated by exactextract.
+        band_ranges (List[BandRange]): The ranges of raster bands referenced by batches, each batch with a band range
+            calculates only bands of the range.
+        max_cells_in_memory (int): The number of raster cells exactextract reads at once, limited by the memory budget.
+        layer_writer (StreamingLayerWriter): The writer of geospatial output. Results of batches are appended to it
+            instead of the result list.
+        shard_writer (ShardWriter): The writer of the shard of this task. Results of batches are appended to it
+            instead of the result list or the layer writer.
+        selected_bands (Dict[str, List[int]]): The numbers of bands selected by user for rasters, all bands of other
+            rasters are calculated.
         """
         super().__init__(description, flags)
         self.description = description
@@ -54,6 +332,20 @@ class CalculateStatsTask(QgsTask):
         self.include_cols: Dict[str, int] = include_cols
         self.geospatial_output: bool = geospatial_output
         self.strategy: str = strategy
+        self.batch_queue: BatchQueue = batch_queue
+        self.feature_source: FeatureSubsetSource = feature_source
+        self.process_backend: ProcessPoolBackend = process_backend
+        self.job_template: BatchJob = job_template
+        self.checkpoint: RunCheckpoint = checkpoint
+        self.result_cache: ResultCache = result_cache
+        self.coverage_store: CoverageIndexStore = coverage_store
+        self.band_ranges: List[BandRange] = band_ranges
+        self.max_cells_in_memory: int = max_cells_in_memory
+        self.layer_writer: StreamingLayerWriter = layer_writer
+        self.shard_writer: ShardWriter = shard_writer
+        self.selected_bands: Dict[str, List[int]] = selected_bands
+        self.linear_stats: List[str] = None
+        self.other_stats: List = None
 
         self.result_list: List = result_list
 
@@ -64,49 +356,365 @@ class CalculateStatsTask(QgsTask):
         """
         Run the task and calculate the statistics using exactextract
         """
-        message = f"Started task: {self.description} with {self.polygon_layer.featureCount()} polygons"
-        QgsMessageLog.logMessage(message)
-        self.taskChanged.emit(message)
+        try:
+            if self.batch_queue is None:
+                message = f"Started task: {self.description} with {self.polygon_layer.featureCount()} polygons"
+                QgsMessageLog.logMessage(message)
+                self.taskChanged.emit(message)
 
-        def task_progress_update(frac: float, message: str):
-            self.setProgress(int(frac * 100))
+                def task_progress_update(frac: float, message: str):
+                    self.check_canceled()
+                    self.setProgress(int(frac * 100))
 
-        try:
-            if self.geospatial_output:
-                result_stats = exact_extract(
-                    vec=self.polygon_layer,
-                    rast=self.rasters,
-                    weights=self.weights,
-                    ops=self.stats,
-                    include_cols=list(self.include_cols.keys()),
-                    progress=task_progress_update,
-                    include_geom=True,
-                    output="qgis",
-                    strategy=self.strategy,
+                self.result_list.append(
+                    self.calculate_batch(self.polygon_layer, task_progress_update)
                 )
             else:
-                import pandas as pd  # noqa
-
-                result_stats = exact_extract(
-                    vec=self.polygon_layer,
-                    rast=self.rasters,
-                    weights=self.weights,
-                    ops=self.stats,
-                    include_cols=self.include_cols,
-                    progress=task_progress_update,
-                    output="pandas",
-                    strategy=self.strategy,
-                )
-            self.result_list.append(result_stats)
+                while True:
+                    self.check_canceled()
+                    batch = self.batch_queue.next_batch()
+                    if batch is None:
+                        break
+                    message = f"Started batch {batch.batch_id} in task: {self.description} with {len(batch.feature_ids)} polygons"
+                    QgsMessageLog.logMessage(message)
+                    self.taskChanged.emit(message)
+
+                    if self.coverage_store is not None:
+                        result = self.calculate_batch_with_coverage(batch)
+                    elif self.result_cache is not None and not self.geospatial_output:
+                        result = self.calculate_batch_cached(batch)
+                    elif self.process_backend is not None:
+                        result = self.calculate_batch_in_process(batch)
+                    else:
+                        result = self.calculate_batch(
+                            self.feature_source.subset(batch.feature_ids),
+                            lambda frac, message: self.check_canceled(),
+                            self.batch_rasters(batch),
+                            self.batch_strategy(batch),
+                        )
+                    if self.checkpoint is not None:
+                        result = self.checkpoint.save_batch(batch, result)
+                    if batch.band_range is not None:
+                        result = BandRangeResult(batch.band_range, result)
+                    if self.shard_writer is not None:
+                        self.shard_writer.append(result)
+                    elif self.layer_writer is not None and self.geospatial_output:
+                        self.layer_writer.append(result)
+                    else:
+                        self.result_list.append(result)
+                    self.batch_queue.mark_finished()
+                    self.setProgress(self.batch_queue.progress())
 
             self.completed_succesfully = True
             return True
+        except CalculationCanceled:
+            self.completed_succesfully = False
+            QgsMessageLog.logMessage(f"Canceled task: {self.description}")
+            return False
         except TypeError as ex:
             self.completed_succesfully = False
             self.error_message = f"Error in task: {self.description}, {ex}. Probably there's an old version of exactextract installed. Follow the instructions in 'Library' tab to update the exactextract library."
             QgsMessageLog.logMessage(self.error_message)
             return False
-            
+        except BrokenProcessPool as ex:
+            self.completed_succesfully = False
+            self.error_message = f"Error in task: {self.description}, worker process terminated abruptly: {ex}"
+            QgsMessageLog.logMessage(self.error_message)
+            return False
+        except OutputWriteError as ex:
+            self.completed_succesfully = False
+            self.error_message = f"Error in task: {self.description}, {ex}"
+            QgsMessageLog.logMessage(self.error_message)
+            return False
+
+    def check_canceled(self):
+        """
+        Stops the calculation if the task was canceled. It's called from the exactextract progress callback,
+        so the exception interrupts exactextract in the middle of the batch.
+
+        Raises:
+            CalculationCanceled: if the task was canceled.
+        """
+        if self.isCanceled():
+            raise CalculationCanceled()
+
+    def calculate_batch(
+        self,
+        polygon_layer,
+        progress=False,
+        rasters: List = None,
+        strategy: str = None,
+    ):
+        """
+        Calculates the statistics for the polygon layer using exactextract
+
+        Args:
+            polygon_layer: The polygon layer (or `FeatureSubsetSource`) to perform the statistics on.
+            progress: The callback receiving progress of the calculation or False.
+            rasters (List): The rasters (paths or exactextract raster sources) used instead of the rasters of the task.
+            strategy (str): The strategy chosen for the batch, see `batch_strategy`.
+
+        Returns:
+            The result of exact_extract - QgsVectorLayer for geospatial output or pandas DataFrame otherwise.
+        """
+        return calculate_statistics(
+            polygon_layer,
+            rasters=self.task_rasters() if rasters is None else rasters,
+            weights=self.weights,
+            stats=self.stats,
+            include_cols=self.include_cols,
+            geospatial_output=self.geospatial_output,
+            strategy=strategy or resolve_strategy(self.strategy),
+            progress=progress,
+            max_cells_in_memory=self.max_cells_in_memory,
+        )
+
+    def batch_strategy(self, batch: FeatureBatch) -> str:
+        """
+        Args:
+            batch (FeatureBatch): The batch of features to perform the statistics on.
+
+        Returns:
+            str: exactextract strategy chosen for the batch or the strategy of the task.
+        """
+        return batch.strategy or resolve_strategy(self.strategy)
+
+    def task_rasters(self) -> List:
+        """
+        Returns:
+            List: raster sources of bands selected by user or paths to rasters if all bands are calculated.
+        """
+        return band_sources(self.rasters, self.selected_bands)
+
+    def batch_rasters(self, batch: FeatureBatch) -> List:
+        """
+        Args:
+            batch (FeatureBatch): The batch of features to perform the statistics on.
+
+        Returns:
+            List: raster sources of bands of the batch band range or rasters of the task.
+        """
+        if batch.band_range is None:
+            return self.task_rasters()
+        return self.band_ranges[batch.band_range].sources()
+
+    def calculate_batch_in_process(self, batch: FeatureBatch):
+        """
+        Calculates the statistics for the batch in a worker process and waits for the result
+
+        Args:
+            batch (FeatureBatch): The batch of features to perform the statistics on.
+
+        Returns:
+            QgsVectorLayer reading the GeoPackage shard for geospatial output or pandas DataFrame otherwise.
+        """
+        job = replace(
+            self.job_template,
+            feature_ids=batch.feature_ids,
+            batch_id=batch.batch_id,
+            strategy=self.batch_strategy(batch),
+        )
+        result = self.run_job(job)
+        if self.geospatial_output:
+            return QgsVectorLayer(
+                f"{result}|layername={SHARD_LAYER_NAME}", "temporary_layer", "ogr"
+            )
+        return result
+
+    def calculate_batch_with_coverage(self, batch: FeatureBatch):
+        """
+        Calculates linear statistics for the batch from coverage fractions shared by rasters on the same grid,
+        remaining statistics are calculated by exactextract and merged with them
+
+        Args:
+            batch (FeatureBatch): The batch of features to perform the statistics on.
+
+        Returns:
+            pandas DataFrame with the statistics.
+        """
+        if self.linear_stats is None:
+            self.linear_stats, self.other_stats = split_linear_stats(
+                self.stats, self.rasters, self.weights
+            )
+        source = self.feature_source.subset(batch.feature_ids)
+        if not self.linear_stats:
+            return self.calculate_batch(
+                source,
+                lambda frac, message: self.check_canceled(),
+                strategy=self.batch_strategy(batch),
+            )
+        weighted = any(stat in WEIGHTED_STATS for stat in self.linear_stats)
+        linear_result = calculate_linear_statistics(
+            source,
+            batch.feature_ids,
+            rasters=self.rasters,
+            weights=self.weights if weighted else None,
+            stats=self.linear_stats,
+            include_cols=list(self.include_cols),
+            store=self.coverage_store,
+            check_canceled=self.check_canceled,
+            selected_bands=self.selected_bands,
+        )
+        if not self.other_stats:
+            return linear_result
+        other_result = calculate_statistics(
+            source,
+            rasters=self.task_rasters(),
+            weights=self.weights,
+            stats=self.other_stats,
+            include_cols=self.include_cols,
+            geospatial_output=False,
+            strategy=self.batch_strategy(batch),
+            progress=lambda frac, message: self.check_canceled(),
+            max_cells_in_memory=self.max_cells_in_memory,
+        )
+        return merge_operation_columns(
+            self.stats,
+            self.linear_stats,
+            linear_result,
+            other_result,
+            list(self.include_cols),
+        )
+
+    def run_job(self, job: BatchJob):
+        """
+        Sends the job to a worker process and waits for its result
+
+        Args:
+            job (BatchJob): The job to calculate.
+
+        Returns:
+            The result of `calculate_batch_job`.
+        """
+        future = self.process_backend.submit(job)
+        while not wait([future], timeout=CANCEL_POLL_SECONDS).done:
+            if self.isCanceled():
+                # batch already running in the worker can't be interrupted, its result is ignored
+                future.cancel()
+                raise CalculationCanceled()
+        return future.result()
+
+    def calculate_batch_cached(self, batch: FeatureBatch):
+        """
+        Calculates the statistics for the batch using results cached for single features. Only operations
+        missing in the cache are calculated, features missing the same operations are calculated together.
+        Features are matched with rows of the result by the first included column (ID field).
+
+        Args:
+            batch (FeatureBatch): The batch of features to perform the statistics on.
+
+        Returns:
+            pandas DataFrame with the statistics.
+        """
+        import pandas as pd
+
+        include_cols = list(self.include_cols)
+        id_column = include_cols[0]
+        operation_keys = self.result_cache.operation_keys
+        # feature id: (geometry hash, included attributes)
+        features = {}
+        for feature in self.feature_source.subset(batch.feature_ids):
+            features[feature.feature.id()] = (
+                feature_hash(feature.feature.geometry()),
+                {column: feature.get(column) for column in include_cols},
+            )
+        cached = self.result_cache.lookup(
+            hash_value for hash_value, _ in features.values()
+        )
+
+        # features grouped by the operations missing in the cache
+        missing_groups: Dict[tuple, List[int]] = {}
+        for fid, (hash_value, _) in features.items():
+            missing = tuple(
+                index
+                for index, key in enumerate(operation_keys)
+                if (hash_value, key) not in cached
+            )
+            if missing:
+                missing_groups.setdefault(missing, []).append(fid)
+
+        calculated = {}
+        for operations, feature_ids in missing_groups.items():
+            self.check_canceled()
+            result = self.calculate_operations(batch, feature_ids, list(operations))
+            columns = split_operation_columns(
+                list(result.columns), include_cols, len(operations)
+            )
+            if columns is None:
+                # unknown layout of output columns, calculate the batch without the cache
+                return self.calculate_batch(
+                    self.feature_source.subset(batch.feature_ids),
+                    lambda frac, message: self.check_canceled(),
+                    strategy=self.batch_strategy(batch),
+                )
+            hashes = {
+                features[fid][1][id_column]: features[fid][0] for fid in feature_ids
+            }
+            for row in result.to_dict("records"):
+                hash_value = hashes.get(row[id_column])
+                if hash_value is None:
+                    continue
+                for index, operation_columns in zip(operations, columns):
+                    calculated[(hash_value, operation_keys[index])] = {
+                        column: row[column] for column in operation_columns
+                    }
+        self.result_cache.store(calculated)
+        cached.update(calculated)
+
+        rows = []
+        for fid in batch.feature_ids:
+            if fid not in features:
+                continue
+            hash_value, attributes = features[fid]
+            row = dict(attributes)
+            for key in operation_keys:
+                row.update(cached.get((hash_value, key), {}))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def calculate_operations(
+        self, batch: FeatureBatch, feature_ids: List[int], operations: List[int]
+    ):
+        """
+        Calculates selected operations for selected features of the batch
+
+        Args:
+            batch (FeatureBatch): The batch the features belong to.
+            feature_ids (List[int]): The ids of features to calculate.
+            operations (List[int]): The indices of operations in `stats`.
+
+        Returns:
+            pandas DataFrame with the statistics.
+        """
+        if self.process_backend is not None:
+            # custom functions follow named operations in `stats`
+            named_count = len(self.job_template.stats)
+            job = replace(
+                self.job_template,
+                feature_ids=feature_ids,
+                batch_id=batch.batch_id,
+                strategy=self.batch_strategy(batch),
+                stats=[
+                    self.job_template.stats[i] for i in operations if i < named_count
+                ],
+                custom_functions_code=[
+                    self.job_template.custom_functions_code[i - named_count]
+                    for i in operations
+                    if i >= named_count
+                ],
+            )
+            return self.run_job(job)
+        return calculate_statistics(
+            self.feature_source.subset(feature_ids),
+            rasters=self.task_rasters(),
+            weights=self.weights,
+            stats=[self.stats[i] for i in operations],
+            include_cols=self.include_cols,
+            geospatial_output=False,
+            strategy=self.batch_strategy(batch),
+            progress=lambda frac, message: self.check_canceled(),
+            max_cells_in_memory=self.max_cells_in_memory,
+        )
 
     def finished(self, result: bool):
         """
@@ -121,6 +729,324 @@ class CalculateStatsTask(QgsTask):
         self.taskChanged.emit(message)
 
 
+class PlanBatchesTask(QgsTask):
+    """
+    A task dividing features of the input vector layer into batches before the calculation starts.
+    It reads bounding boxes of all features, estimates their cost, orders them along the Hilbert curve
+    and cuts them into batches, optionally choosing the number of subtasks and exactextract strategy of every
+    batch automatically. Running it as a task keeps QGIS responsive while planning batches of big layers.
+    """
+
+    taskChanged = pyqtSignal(str)
+
+    def __init__(
+        self,
+        description: str,
+        flags: QgsTask.Flag,
+        feature_source: FeatureSubsetSource,
+        features_count: int,
+        rasters: List[str],
+        parallel_jobs: int,
+        calculate_sample: Callable = None,
+        incremental: IncrementalUpdate = None,
+        strategy: str = None,
+        operations_count: int = 1,
+        array_operations: bool = False,
+        memory_budget: int = 0,
+    ):
+        """
+        Attributes:
+            description (str): The description of the task.
+            flags (QgsTask.Flag): The flags for the task.
+            feature_source (FeatureSubsetSource): The source of input features, owned by this task.
+            features_count (int): The number of input features, used to report progress.
+            rasters (List[str]): The list of raster files used in the statistics.
+            parallel_jobs (int): The number of subtasks. 0 means it's chosen automatically.
+            calculate_sample (Callable): The function calculating statistics for a sample of features,
+                used to choose the number of subtasks automatically.
+            incremental (IncrementalUpdate): The state of the incremental update. Geometry hashes of all
+                features are calculated and only changed features are planned if the output is patched.
+            strategy (str): The exactextract strategy selected by user. With "auto" strategy is chosen for every batch.
+            operations_count (int): The number of calculated operations, used to estimate memory of raster-sequential strategy.
+            array_operations (bool): Whether operations returning arrays of cell values are calculated.
+            memory_budget (int): The memory budget of all subtasks in bytes, 0 if it's not limited. The number
+                of subtasks, exactextract chunk size and GDAL block cache are fitted in it.
+        """
+        super().__init__(description, flags)
+        self.description: str = description
+        self.feature_source: FeatureSubsetSource = feature_source
+        self.features_count: int = features_count
+        self.rasters: List[str] = rasters
+        self.parallel_jobs: int = parallel_jobs
+        self.calculate_sample: Callable = calculate_sample
+        self.incremental: IncrementalUpdate = incremental
+        self.strategy: str = strategy
+        self.operations_count: int = operations_count
+        self.array_operations: bool = array_operations
+        self.memory_budget: int = memory_budget
+
+        # feedback is canceled together with the task and reports progress of reading features
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(
+            lambda progress: self.setProgress(progress * 0.7)
+        )
+
+        self.batches: List[FeatureBatch] = []
+        self.subtasks_count: int = parallel_jobs
+        self.memory_plan: MemoryPlan = None
+        self.completed_succesfully = False
+
+    def run(self):
+        """
+        Plans batches of features processed by calculation subtasks
+        """
+        message = (
+            f"Started task: {self.description} with {self.features_count} polygons"
+        )
+        QgsMessageLog.logMessage(message)
+        self.taskChanged.emit(message)
+
+        changed_ids = None
+        if self.incremental is not None:
+            self.incremental.current = geometry_hashes(
+                self.feature_source.src,
+                self.incremental.id_field_index,
+                self.feedback,
+                self.features_count,
+            )
+            changed_extents = self.changed_raster_extents()
+            if self.isCanceled():
+                return False
+            if self.incremental.active:
+                changed_ids = self.incremental.detect_changes()
+                self.taskChanged.emit(
+                    f"Incremental update: {len(changed_ids)} new or changed polygons, "
+                    f"{len(self.incremental.removed_ids)} removed polygons"
+                )
+                if changed_extents is None:
+                    # regions changed since the output was written are unknown
+                    window_ids = list(self.incremental.current)
+                    self.taskChanged.emit(
+                        "Checksums of raster blocks are not stored with the output, "
+                        "all polygons are recalculated"
+                    )
+                else:
+                    window_ids = features_in_extents(
+                        self.feature_source.src, changed_extents
+                    )
+                    if changed_extents:
+                        self.taskChanged.emit(
+                            f"{len(changed_extents)} changed raster regions intersect "
+                            f"{len(window_ids)} polygons"
+                        )
+                changed_ids = self.incremental.mark_changed(changed_ids, window_ids)
+                if not changed_ids:
+                    self.setProgress(100)
+                    self.completed_succesfully = True
+                    return True
+
+        features_info = collect_feature_info(
+            self.feature_source.src, self.feedback, self.features_count, changed_ids
+        )
+        if self.isCanceled():
+            return False
+        # bounding boxes are compared with cells in CRS of every raster
+        cell_areas = raster_cell_areas(self.rasters, self.feature_source.src.crs())
+        costs = {
+            info.fid: estimate_feature_cost(info, cell_areas) for info in features_info
+        }
+        feature_ids = spatially_sorted_ids(features_info)
+        self.setProgress(80)
+        if self.isCanceled():
+            return False
+
+        if self.parallel_jobs == 0:
+            # "Auto" option of subtasks spin box
+            batch_size = self.tune_parallelism(features_info, costs, feature_ids)
+        else:
+            # split work into many small chunks, so subtasks can balance the load dynamically
+            chunks_count = (
+                self.parallel_jobs * CHUNKS_PER_SUBTASK if self.parallel_jobs > 1 else 1
+            )
+            batch_size = math.ceil(len(feature_ids) / chunks_count)
+        if self.isCanceled():
+            return False
+
+        batch_count = math.ceil(len(feature_ids) / max(1, batch_size))
+        self.batches = split_by_cost(feature_ids, costs, batch_count)
+        if self.strategy == AUTO_STRATEGY:
+            self.choose_batch_strategies(features_info)
+        if self.memory_budget:
+            self.fit_memory_budget(features_info)
+        self.setProgress(100)
+        self.completed_succesfully = True
+        return True
+
+    def changed_raster_extents(self) -> Optional[List[QgsRectangle]]:
+        """
+        Collects regions of rasters updated in place, the extent given by the user and extents of raster
+        blocks whose checksums differ from checksums stored with the output. Current checksums are kept
+        in the incremental update state, so they're stored with the updated output.
+
+        Returns:
+            Optional[List[QgsRectangle]]: changed extents in CRS of the input layer or None if checksums
+                of some raster are not stored with the output.
+        """
+        extents: List[QgsRectangle] = []
+        if self.incremental.changed_extent is not None:
+            extents.append(self.incremental.changed_extent)
+        if not self.incremental.detect_raster_changes:
+            return extents
+        changes_known = True
+        previous_blocks = self.incremental.previous_blocks or {}
+        for raster in self.rasters:
+            current = block_checksums(raster, self.feedback)
+            if current is None or self.isCanceled():
+                continue
+            self.incremental.current_blocks[raster] = current
+            if raster not in previous_blocks:
+                changes_known = False
+                continue
+            extents.extend(
+                transform_extents(
+                    changed_block_extents(raster, previous_blocks[raster], current),
+                    raster_crs(raster),
+                    self.feature_source.src.crs(),
+                )
+            )
+        return extents if changes_known else None
+
+    def tune_parallelism(
+        self,
+        features_info: List[FeatureInfo],
+        costs: Dict[int, float],
+        feature_ids: List[int],
+    ) -> int:
+        """
+        Chooses the number of subtasks and the batch size automatically. It uses the number of features,
+        their estimated cost, the size and block layout of rasters, the number of threads available in QGIS
+        and the time of a short calibration run on a sample of features. Chosen number of subtasks is stored
+        in `subtasks_count` and the reasoning is emitted to the console.
+
+        Args:
+            features_info (List[FeatureInfo]): Bounding boxes and vertex counts of input features.
+            costs (Dict[int, float]): Estimated cost of each feature.
+            feature_ids (List[int]): Feature ids ordered along the Hilbert curve.
+
+        Returns:
+            int: The number of features to process in each batch.
+        """
+        sample_ids = calibration_sample(feature_ids)
+        sample_seconds = calibrate(
+            self.feature_source.subset(sample_ids), self.calculate_sample
+        )
+        raster_layouts = self.raster_layouts()
+        decision = choose_parallelism(
+            features_count=len(features_info),
+            costs=costs,
+            sample_cost=sum(costs[fid] for fid in sample_ids),
+            sample_seconds=sample_seconds,
+            raster_layouts=raster_layouts,
+            max_threads=available_threads(),
+        )
+        for reason in decision.reasons:
+            self.taskChanged.emit(f"Auto subtasks: {reason}")
+        self.subtasks_count = decision.subtasks_count
+        return decision.batch_size
+
+    def raster_layouts(self) -> List[RasterLayout]:
+        """
+        Returns:
+            List[RasterLayout]: layouts of rasters that can be opened by GDAL, with transformations of features
+                to their CRS.
+        """
+        crs = self.feature_source.src.crs()
+        return [
+            layout
+            for layout in (read_raster_layout(raster, crs) for raster in self.rasters)
+            if layout is not None
+        ]
+
+    def choose_batch_strategies(self, features_info: List[FeatureInfo]):
+        """
+        Chooses exactextract strategy of every batch. Repeated reads of raster blocks under feature-sequential
+        strategy are estimated from bounding boxes of features of the batch and compared with memory
+        raster-sequential strategy needs. The choice and its reason are emitted to the console.
+
+        Args:
+            features_info (List[FeatureInfo]): Bounding boxes and vertex counts of planned features.
+        """
+        infos = {info.fid: info for info in features_info}
+        raster_layouts = self.raster_layouts()
+        cache_bytes = subtask_cache_bytes(self.subtasks_count)
+        memory_limit = raster_sequential_limit(self.memory_budget, self.subtasks_count)
+        for batch in self.batches:
+            decision = choose_strategy(
+                [infos[fid] for fid in batch.feature_ids],
+                raster_layouts,
+                self.operations_count,
+                self.array_operations,
+                cache_bytes,
+                memory_limit,
+            )
+            batch.strategy = decision.strategy
+            self.taskChanged.emit(
+                f"Auto strategy of batch {batch.batch_id}: {decision.strategy}, {decision.reason}"
+            )
+
+    def fit_memory_budget(self, features_info: List[FeatureInfo]):
+        """
+        Divides the memory budget between subtasks. Memory of the biggest batch is estimated from its strategy,
+        the number of subtasks is lowered if they don't fit in the budget. The plan is stored in `memory_plan`
+        and the reasoning is emitted to the console.
+
+        Args:
+            features_info (List[FeatureInfo]): Bounding boxes and vertex counts of planned features.
+        """
+        infos = {info.fid: info for info in features_info}
+        raster_layouts = self.raster_layouts()
+        batch_memory = max(
+            (
+                estimate_batch_memory(
+                    [infos[fid] for fid in batch.feature_ids],
+                    batch.strategy or resolve_strategy(self.strategy),
+                    raster_layouts,
+                    self.operations_count,
+                    self.array_operations,
+                )
+                for batch in self.batches
+            ),
+            default=0.0,
+        )
+        self.memory_plan = plan_memory(
+            self.memory_budget,
+            max(1, min(self.subtasks_count, len(self.batches))),
+            batch_memory,
+        )
+        for reason in self.memory_plan.reasons:
+            self.taskChanged.emit(f"Memory budget: {reason}")
+        self.subtasks_count = self.memory_plan.subtasks_count
+
+    def cancel(self):
+        """
+        Cancels the task and stops reading features
+        """
+        self.feedback.cancel()
+        super().cancel()
+
+    def finished(self, result: bool):
+        """
+        Method that is called when the task has finished
+
+        Args:
+            result (bool):  The result of the task. True if  the task was successful otherwise False.
+        """
+        message = f"Finished task: {self.description}, result: {'Successful' if result else 'Failed'}"
+        if result:
+            message += f", {len(self.batches)} batches planned"
+        self.taskChanged.emit(message)
+
+
 class MergeStatsTask(QgsTask):
     """
     A custom QgsTask for merging statistics from a list of pandas DataFrames and optionally prefixing column names.
@@ -139,15 +1065,35 @@ class MergeStatsTask(QgsTask):
         output_file_path: Path,
         source_columns: Dict[str, int],
         source_crs: str,
+        operations_count: int = 0,
+        layer_writer: StreamingLayerWriter = None,
+        sharded_output: ShardedOutput = None,
+        parquet_path: Path = None,
+        csv_path: Path = None,
+        csv_compression: str = "none",
     ):
         """
         Attributes:
             description (str): A description of the task.
             flags (QgsTask.Flag): Flags indicating the task's behavior.
-            result_list (List): A list of pandas DataFrames containing the statistics to be merged.
+            result_list (List): A list (or `ResultBuffer` spilling them to disk) of pandas DataFrames containing
+                the statistics to be merged. Results of band ranges (`BandRangeResult`) are joined column-wise
+                by the index column.
             index_column (str): The name of the index column.
             prefix (str): A prefix string to be added to the column names.
             geo_spatial_output (bool): A boolean indicating whether output is geospatial layer.
+            operations_count (int): The number of calculated operations, used to order columns of joined band ranges.
+            layer_writer (StreamingLayerWriter): The writer of geospatial output subtasks append results of batches to.
+                Results in the result list are appended to it too. A new writer is used if not set.
+            sharded_output (ShardedOutput): The output written as shards by subtasks. If set, results in the result
+                list are written to a new shard and the task only writes the virtual layer uniting the shards.
+            parquet_path (Path): The Parquet file merged tabular statistics are written to, with a row group for every
+                batch. None if statistics are not written to Parquet.
+            csv_path (Path): The CSV file merged tabular statistics are written to in blocks formatted in parallel,
+                with the `.csvt` file. None if statistics are not written to CSV.
+            csv_compression (str): The compression of the CSV file, "none", "gzip" or "zstd".
+            calculated_stats: The merged pandas DataFrame, kept only if tabular statistics are not written to a file.
+            result_shape (tuple): The number of rows and columns of merged tabular statistics.
         """
         super().__init__(description, flags)
         self.description: str = description
@@ -158,57 +1104,151 @@ class MergeStatsTask(QgsTask):
         self.output_file_path: Path = output_file_path
         self.source_columns: Dict[str, int] = source_columns
         self.source_crs: str = source_crs
+        self.operations_count: int = operations_count
+        self.layer_writer: StreamingLayerWriter = layer_writer
+        self.sharded_output: ShardedOutput = sharded_output
+        self.parquet_path: Path = parquet_path
+        self.csv_path: Path = csv_path
+        self.csv_compression: str = csv_compression
 
         self.completed_succesfully = False
         self.calculated_stats = None
+        self.result_shape = None
 
     def run(self):
         """
         Merges all dataframes in the list into one dataframe and adds prefix to column names if necessary.
+        Geospatial results are streamed to the output file by the layer writer. Tabular results are streamed
+        to the Parquet or CSV file one by one, only results of band ranges are joined in memory. Sharded output
+        is not merged, shards are united by the virtual layer.
         """
         message = f"Inside MergeStatsTask Task: {self.description}"
         QgsMessageLog.logMessage(message)
         self.taskChanged.emit(message)
 
-        if self.geospatial_output:
-            # rename calculated columns to include prefix string
-            # TODO: add prefix to column names
-            if len(self.prefix) > 0:
-                for vector_layer in self.result_list:
-                    vector_layer.startEditing()
-                    vector_fields = vector_layer.fields()
-                    for column in vector_fields:
-                        if column.name() not in list(self.source_columns.keys()):
-                            vector_layer.renameAttribute(
-                                vector_fields.indexFromName(column.name()),
-                                f"{self.prefix}{column.name()}",
-                            )
-                    vector_layer.commitChanges()
-            # merge all vectors in a list
-            parameters = {
-                "LAYERS": self.result_list,
-                "CRS": self.source_crs,
-                "OUTPUT": str(self.output_file_path),
-            }
-            processing.run("qgis:mergevectorlayers", parameters)
+        if self.sharded_output is not None:
+            # results not written by subtasks, e.g. loaded from checkpoints
+            if len(self.result_list) > 0:
+                shard_writer = self.sharded_output.create_writer()
+                for result in self.result_list:
+                    shard_writer.append(result)
+            self.sharded_output.finish()
+        elif self.geospatial_output:
+            if self.layer_writer is None:
+                self.layer_writer = StreamingLayerWriter(
+                    self.output_file_path,
+                    self.source_crs,
+                    self.prefix,
+                    self.source_columns,
+                )
+            # results not streamed by subtasks, e.g. loaded from checkpoints
+            for vector_layer in self.result_list:
+                self.layer_writer.append(vector_layer)
+            self.layer_writer.finish()
         else:
-            import pandas as pd
+            self.merge_tables()
 
-            calculated_stats = pd.concat(self.result_list)
+        self.completed_succesfully = True
+        return True
 
-            if len(self.prefix) > 0:
-                # rename columns to include prefix string
-                rename_dict = {
-                    column: f"{self.prefix}{column}"
-                    for column in calculated_stats.columns
-                    if column != self.index_column
-                }
-                calculated_stats = calculated_stats.rename(columns=rename_dict)
+    def add_prefix(self, frame):
+        """
+        Adds the prefix to names of columns with statistics.
 
-            self.calculated_stats = calculated_stats
+        Args:
+            frame: pandas DataFrame with statistics.
 
-        self.completed_succesfully = True
-        return True
+        Returns:
+            pandas DataFrame with prefixed columns, the same frame if there is no prefix.
+        """
+        if len(self.prefix) == 0:
+            return frame
+        # rename columns to include prefix string
+        rename_dict = {
+            column: f"{self.prefix}{column}"
+            for column in frame.columns
+            if column != self.index_column
+        }
+        return frame.rename(columns=rename_dict)
+
+    def merge_tables(self):
+        """
+        Writes tabular results batch by batch to the Parquet file (a row group for every batch) or the CSV file.
+        Results spilled to disk are read back one by one and written right away, so a single result of the result
+        list is in memory at once. Results are concatenated in memory only if they are not written to a file,
+        e.g. increments patched into the output.
+        """
+        import pandas as pd
+
+        results = iter(self.result_list)
+        result = next(results, None)
+        if isinstance(result, BandRangeResult):
+            self.join_band_ranges([result, *results])
+            return
+
+        writer = None
+        if self.parquet_path is not None:
+            writer = ParquetTableWriter(self.parquet_path)
+        elif self.csv_path is not None:
+            writer = CsvBlockWriter(
+                self.csv_path, self.csv_compression, available_threads()
+            )
+        frames = []
+        rows_count = 0
+        try:
+            while result is not None:
+                result = self.add_prefix(result)
+                rows_count += len(result)
+                self.result_shape = (rows_count, len(result.columns))
+                if writer is None:
+                    frames.append(result)
+                else:
+                    writer.append(result)
+                result = next(results, None)
+            if writer is not None:
+                writer.close()
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+        if writer is None:
+            self.calculated_stats = pd.concat(frames)
+            self.result_shape = self.calculated_stats.shape
+
+    def join_band_ranges(self, results: List[BandRangeResult]):
+        """
+        Joins results of band ranges by the index column and writes them to the Parquet or CSV file, results of all
+        batches are needed at once for the join.
+
+        Args:
+            results (List[BandRangeResult]): results of batches of all band ranges.
+        """
+        calculated_stats = self.add_prefix(
+            join_band_ranges(
+                results,
+                self.index_column,
+                list(self.source_columns),
+                self.operations_count,
+            )
+        )
+        # joined rows are in the order of batches of the first band range
+        first_range = min(result.band_range for result in results)
+        batch_rows = [
+            len(result.result) for result in results if result.band_range == first_range
+        ]
+        self.result_shape = calculated_stats.shape
+        if self.parquet_path is not None:
+            write_parquet(calculated_stats, self.parquet_path, batch_rows)
+        elif self.csv_path is not None:
+            write_csv(
+                calculated_stats,
+                self.csv_path,
+                batch_rows,
+                self.csv_compression,
+                available_threads(),
+            )
+        else:
+            self.calculated_stats = calculated_stats
 
     def finished(self, result: bool):
         """
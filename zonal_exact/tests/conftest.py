@@ -1,6 +1,7 @@
-from typing import Tuple
+from typing import List, Tuple
 import pytest
 import numpy as np
+import pandas as pd
 from osgeo import gdal
 from qgis.core import (
     QgsCoordinateReferenceSystem,
@@ -88,3 +89,19 @@ def setup_layers(tmp_path, qgis_new_project) -> Tuple[QgsVectorLayer, QgsRasterL
     QgsProject.instance().addMapLayer(raster_layer)
 
     return vector_layer, raster_layer
+
+
+@pytest.fixture(scope="function")
+def batch_results() -> List[pd.DataFrame]:
+    """
+    Tabular results of three batches with 2, 3 and 4 features, ids of features are unique.
+
+    Returns:
+        List[pd.DataFrame]: Results of batches with the id column and the mean statistic.
+    """
+    return [
+        pd.DataFrame(
+            {"id": [i * 10 + j for j in range(i + 2)], "mean": [float(i)] * (i + 2)}
+        )
+        for i in range(3)
+    ]
@@ -0,0 +1,191 @@
+import shutil
+
+import pandas as pd
+from qgis.core import QgsTask
+
+from zonal_exact.band_ranges import (
+    BandRangeResult,
+    RasterBand,
+    band_sources,
+    select_bands,
+    split_band_ranges,
+    split_batches_by_bands,
+)
+from zonal_exact.coverage_index import CoverageIndexStore, calculate_linear_statistics
+from zonal_exact.partitioning import FeatureBatch
+from zonal_exact.task_classes import (
+    BatchQueue,
+    CalculateStatsTask,
+    FeatureSubsetSource,
+    MergeStatsTask,
+    calculate_statistics,
+)
+
+
+def two_multiband_rasters(raster_layer, tmp_path):
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    copy_path = str(tmp_path / "pytest_raster_copy.tif")
+    shutil.copy(raster_path, copy_path)
+    return [raster_path, copy_path]
+
+
+def test_selected_bands_keep_their_numbers(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    raster_path, copy_path = two_multiband_rasters(raster_layer, tmp_path)
+    selected_bands = {raster_path: [2]}
+
+    def mean(rasters):
+        return calculate_statistics(
+            FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+            rasters=rasters,
+            weights=None,
+            stats=["mean"],
+            include_cols={"id": 0},
+            geospatial_output=False,
+            strategy="feature-sequential",
+        ).sort_values("id")
+
+    selected_result = mean(band_sources([raster_path, copy_path], selected_bands))
+    all_bands_result = mean([raster_path, copy_path])
+
+    assert band_sources([raster_path], None) == [raster_path]
+    assert select_bands([raster_path], selected_bands) == [
+        RasterBand(raster_path, 2, "pytest_raster_band_2")
+    ]
+    assert list(selected_result.columns) == [
+        "id",
+        "pytest_raster_band_2_mean",
+        "pytest_raster_copy_band_1_mean",
+        "pytest_raster_copy_band_2_mean",
+    ]
+    pd.testing.assert_frame_equal(
+        selected_result, all_bands_result[list(selected_result.columns)]
+    )
+
+
+def test_linear_statistics_of_selected_bands(setup_layers):
+    vector_layer, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    selected_bands = {raster_path: [2]}
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+
+    result = calculate_linear_statistics(
+        source,
+        vector_layer.allFeatureIds(),
+        [raster_path],
+        None,
+        ["mean"],
+        ["id"],
+        CoverageIndexStore(),
+        selected_bands=selected_bands,
+    )
+    expected = calculate_statistics(
+        source,
+        rasters=band_sources([raster_path], selected_bands),
+        weights=None,
+        stats=["mean"],
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+    )
+
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result.sort_values("id").reset_index(drop=True),
+        expected.sort_values("id").reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_split_band_ranges(tmp_path, setup_layers):
+    _, raster_layer = setup_layers
+    rasters = two_multiband_rasters(raster_layer, tmp_path)
+
+    band_ranges = split_band_ranges(rasters, 2)
+
+    assert [[band.name for band in band_range.bands] for band_range in band_ranges] == [
+        ["pytest_raster_band_1", "pytest_raster_band_2"],
+        ["pytest_raster_copy_band_1", "pytest_raster_copy_band_2"],
+    ]
+    # range with a single band is joined with the previous one
+    assert len(split_band_ranges(rasters, 3)) == 1
+    assert split_band_ranges(["missing.tif"], 2) is None
+
+
+def test_split_batches_by_bands(tmp_path, setup_layers):
+    _, raster_layer = setup_layers
+    band_ranges = split_band_ranges(two_multiband_rasters(raster_layer, tmp_path), 2)
+
+    batches = split_batches_by_bands(
+        [FeatureBatch([1, 2], 10.0, 0), FeatureBatch([3], 4.0, 1)], band_ranges
+    )
+
+    assert [(batch.feature_ids, batch.band_range) for batch in batches] == [
+        ([1, 2], 0),
+        ([1, 2], 1),
+        ([3], 0),
+        ([3], 1),
+    ]
+    assert [batch.batch_id for batch in batches] == [0, 1, 2, 3]
+    assert [batch.estimated_cost for batch in batches] == [5.0, 5.0, 2.0, 2.0]
+
+
+def test_band_ranges_joined_by_id(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    rasters = two_multiband_rasters(raster_layer, tmp_path)
+    stats = ["mean", "max"]
+    feature_ids = vector_layer.allFeatureIds()
+    band_ranges = split_band_ranges(rasters, 2)
+    batches = split_batches_by_bands(
+        [FeatureBatch(feature_ids[:5], batch_id=0), FeatureBatch(feature_ids[5:])],
+        band_ranges,
+    )
+    result_list = []
+    task = CalculateStatsTask(
+        "Band ranges task",
+        QgsTask.CanCancel,
+        result_list,
+        None,
+        rasters,
+        None,
+        stats,
+        {"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+        batch_queue=BatchQueue(batches),
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        band_ranges=band_ranges,
+    )
+    assert task.run() is True
+    assert all(isinstance(result, BandRangeResult) for result in result_list)
+
+    merge_task = MergeStatsTask(
+        "Merge statistics",
+        QgsTask.CanCancel,
+        result_list=result_list,
+        index_column="id",
+        prefix="",
+        geospatial_output=False,
+        output_file_path=tmp_path / "output.csv",
+        source_columns={"id": 0},
+        source_crs=None,
+        operations_count=len(stats),
+    )
+    assert merge_task.run() is True
+    expected = calculate_statistics(
+        FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        rasters=rasters,
+        weights=None,
+        stats=stats,
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+    )
+
+    result = merge_task.calculated_stats
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result.sort_values("id").reset_index(drop=True),
+        expected.sort_values("id").reset_index(drop=True),
+        check_dtype=False,
+    )
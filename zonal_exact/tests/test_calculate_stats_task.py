@@ -5,7 +5,13 @@ import pandas as pd
 from qgis.core import QgsTask
 from qgis.PyQt.QtWidgets import QPlainTextEdit
 
-from zonal_exact.task_classes import CalculateStatsTask
+from zonal_exact.partitioning import FeatureBatch
+from zonal_exact.result_cache import ResultCache
+from zonal_exact.task_classes import (
+    BatchQueue,
+    CalculateStatsTask,
+    FeatureSubsetSource,
+)
 from zonal_exact.user_communication import WidgetPlainTextWriter
 
 
@@ -140,3 +146,142 @@ def test_task_single_polygon_outside_raster(init_calculate_stats_task):
     assert pd.isna(polygon_outside_raster["pytest_raster_band_2_max"])
     assert pd.isna(polygon_outside_raster["pytest_raster_band_1_min"])
     assert pd.isna(polygon_outside_raster["pytest_raster_band_2_min"])
+
+
+def test_task_pulls_batches_from_queue(setup_layers):
+    vector_layer, raster_layer = setup_layers
+    raster_layer_path = raster_layer.dataProvider().dataSourceUri()
+    feature_ids = vector_layer.allFeatureIds()
+
+    batch_queue = BatchQueue(
+        [
+            FeatureBatch(feature_ids[:5], batch_id=0),
+            FeatureBatch(feature_ids[5:], batch_id=1),
+        ]
+    )
+
+    task = CalculateStatsTask(
+        "Queue Task",
+        QgsTask.CanCancel,
+        [],
+        None,
+        [raster_layer_path],
+        None,
+        ["mean"],
+        ["id"],
+        geospatial_output=False,
+        strategy="feature-sequential",
+        batch_queue=batch_queue,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+    )
+
+    assert task.run() is True
+    # one result per batch and queue is drained
+    assert len(task.result_list) == 2
+    assert sum(len(result) for result in task.result_list) == 12
+    assert batch_queue.next_batch() is None
+    assert batch_queue.progress() == 100.0
+
+
+def test_feature_subset_source(setup_layers):
+    vector_layer, _ = setup_layers
+    feature_ids = vector_layer.allFeatureIds()[:3]
+
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"]).subset(feature_ids)
+
+    assert source.count() == 3
+    assert source.srs_wkt() == vector_layer.crs().toWkt()
+    assert len(list(source)) == 3
+    # subsets share provider snapshot and don't modify each other
+    assert source.subset(feature_ids[:1]).count() == 1
+    assert source.count() == 3
+
+
+def test_canceled_task_stops_calculation(init_calculate_stats_task):
+    task, _ = init_calculate_stats_task
+    task.cancel()
+
+    # progress callback interrupts exactextract
+    assert task.run() is False
+    assert task.completed_succesfully is False
+    assert task.result_list == []
+
+
+def test_canceled_task_skips_queued_batches(setup_layers):
+    vector_layer, raster_layer = setup_layers
+    feature_ids = vector_layer.allFeatureIds()
+    batch_queue = BatchQueue([FeatureBatch(feature_ids, batch_id=0)])
+
+    task = CalculateStatsTask(
+        "Queue Task",
+        QgsTask.CanCancel,
+        [],
+        None,
+        [raster_layer.dataProvider().dataSourceUri()],
+        None,
+        ["mean"],
+        ["id"],
+        geospatial_output=False,
+        strategy="feature-sequential",
+        batch_queue=batch_queue,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+    )
+    task.cancel()
+
+    assert task.run() is False
+    assert batch_queue.next_batch() is not None
+
+
+def run_cached_task(vector_layer, raster_layer_path, stats, result_cache):
+    task = CalculateStatsTask(
+        "Cached Task",
+        QgsTask.CanCancel,
+        [],
+        None,
+        [raster_layer_path],
+        None,
+        stats,
+        ["id"],
+        geospatial_output=False,
+        strategy="feature-sequential",
+        batch_queue=BatchQueue([FeatureBatch(vector_layer.allFeatureIds())]),
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        result_cache=result_cache,
+    )
+    assert task.run() is True
+    return task.result_list[0].sort_values("id").reset_index(drop=True)
+
+
+def test_task_uses_result_cache(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    raster_layer_path = raster_layer.dataProvider().dataSourceUri()
+    cache_path = tmp_path / "cache.sqlite"
+
+    run_cached_task(
+        vector_layer,
+        raster_layer_path,
+        ["mean"],
+        ResultCache(cache_path, operation_keys=["mean"]),
+    )
+    # only "max" is calculated, "mean" is read from the cache
+    cached = run_cached_task(
+        vector_layer,
+        raster_layer_path,
+        ["mean", "max"],
+        ResultCache(cache_path, operation_keys=["mean", "max"]),
+    )
+    calculated = run_cached_task(
+        vector_layer,
+        raster_layer_path,
+        ["mean", "max"],
+        ResultCache(tmp_path / "empty.sqlite", operation_keys=["mean", "max"]),
+    )
+
+    pd.testing.assert_frame_equal(cached, calculated, check_dtype=False)
+    assert list(cached.columns) == [
+        "id",
+        "pytest_raster_band_1_mean",
+        "pytest_raster_band_2_mean",
+        "pytest_raster_band_1_max",
+        "pytest_raster_band_2_max",
+    ]
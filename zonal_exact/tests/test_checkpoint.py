@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from zonal_exact.checkpoint import RunCheckpoint, run_directory
+from zonal_exact.layer_writer import OutputWriteError
+from zonal_exact.partitioning import FeatureBatch
+
+PARAMETERS = {"vector": "polygons.gpkg", "stats": ["mean"]}
+
+
+def planned_batches():
+    return [FeatureBatch([1, 2], 2.0, 0), FeatureBatch([3], 1.0, 1)]
+
+
+def test_run_directory(tmp_path):
+    assert run_directory(tmp_path / "output.csv") == tmp_path / "output_zonal_run"
+
+
+def test_resume_skips_completed_batches(tmp_path):
+    run_dir = tmp_path / "run"
+    checkpoint = RunCheckpoint.open(run_dir, PARAMETERS, planned_batches())
+    result = pd.DataFrame({"id": [1, 2], "mean": [1.0, 2.0]})
+
+    checkpoint.save_batch(checkpoint.batches[0], result)
+    # the same calculation planned differently resumes with stored batches
+    resumed = RunCheckpoint.open(run_dir, PARAMETERS, [FeatureBatch([1, 2, 3])])
+
+    assert resumed.completed == {0}
+    assert [batch.feature_ids for batch in resumed.pending_batches] == [[3]]
+    loaded = resumed.load_results(geospatial_output=False)
+    assert len(loaded) == 1
+    pd.testing.assert_frame_equal(loaded[0], result)
+
+
+def test_other_calculation_starts_from_scratch(tmp_path):
+    run_dir = tmp_path / "run"
+    checkpoint = RunCheckpoint.open(run_dir, PARAMETERS, planned_batches())
+    checkpoint.save_batch(checkpoint.batches[0], pd.DataFrame({"id": [1, 2]}))
+
+    other = RunCheckpoint.open(run_dir, {**PARAMETERS, "stats": ["max"]}, [])
+
+    assert other.completed == set()
+    assert not checkpoint.shard_path(0, geospatial_output=False).exists()
+
+
+def test_save_geospatial_batch(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    checkpoint = RunCheckpoint.open(tmp_path / "run", PARAMETERS, planned_batches())
+
+    saved = checkpoint.save_batch(checkpoint.batches[1], vector_layer)
+
+    assert saved.isValid()
+    assert saved.featureCount() == vector_layer.featureCount()
+    assert checkpoint.shard_path(1, geospatial_output=True).exists()
+    checkpoint.remove()
+    assert not (tmp_path / "run").exists()
+
+
+def test_failed_save_keeps_batch_pending(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    run_dir = tmp_path / "run"
+    checkpoint = RunCheckpoint.open(run_dir, PARAMETERS, planned_batches())
+    # shards can't be written to a directory in place of the shard file
+    checkpoint.shard_path(0, geospatial_output=False).mkdir()
+    checkpoint.shard_path(1, geospatial_output=True).mkdir()
+
+    with pytest.raises(OutputWriteError):
+        checkpoint.save_batch(checkpoint.batches[0], pd.DataFrame({"id": [1, 2]}))
+    with pytest.raises(OutputWriteError):
+        checkpoint.save_batch(checkpoint.batches[1], vector_layer)
+
+    assert checkpoint.completed == set()
+    resumed = RunCheckpoint.open(run_dir, PARAMETERS, planned_batches())
+    assert len(resumed.pending_batches) == 2
@@ -0,0 +1,208 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+from zonal_exact.coverage_index import (
+    CoverageIndex,
+    CoverageIndexStore,
+    calculate_linear_statistics,
+    read_band_cells,
+    read_grid,
+    split_linear_stats,
+)
+from zonal_exact.partitioning import FeatureBatch
+from zonal_exact.task_classes import (
+    CalculateStatsTask,
+    FeatureSubsetSource,
+    calculate_statistics,
+)
+
+
+def rasters_on_one_grid(raster_layer, tmp_path):
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    copy_path = str(tmp_path / "pytest_raster_copy.tif")
+    shutil.copy(raster_path, copy_path)
+    return [raster_path, copy_path]
+
+
+def weights_on_grid(raster_path, tmp_path, nodata_cell=None):
+    dataset = gdal.Open(raster_path)
+    weights_path = str(tmp_path / "pytest_weights.tif")
+    weights = gdal.GetDriverByName("GTiff").Create(
+        weights_path, dataset.RasterXSize, dataset.RasterYSize, 1, gdal.GDT_Float32
+    )
+    weights.SetGeoTransform(dataset.GetGeoTransform())
+    weights.SetProjection(dataset.GetProjection())
+    values = np.arange(dataset.RasterXSize * dataset.RasterYSize, dtype=np.float32)
+    values = values.reshape(dataset.RasterYSize, dataset.RasterXSize) % 3 + 1
+    if nodata_cell is not None:
+        weights.GetRasterBand(1).SetNoDataValue(-1)
+        values[nodata_cell] = -1
+    weights.GetRasterBand(1).WriteArray(values)
+    weights = None  # close the file
+    return weights_path
+
+
+def test_linear_statistics_match_exactextract(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    rasters = rasters_on_one_grid(raster_layer, tmp_path)
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+    stats = ["count", "sum", "mean"]
+    store = CoverageIndexStore()
+
+    result = calculate_linear_statistics(
+        source, vector_layer.allFeatureIds(), rasters, None, stats, ["id"], store
+    )
+    expected = calculate_statistics(
+        source,
+        rasters=rasters,
+        weights=None,
+        stats=stats,
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+    )
+
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result.sort_values("id").reset_index(drop=True),
+        expected.sort_values("id").reset_index(drop=True),
+        check_dtype=False,
+    )
+    # both rasters share the grid, so coverage fractions are calculated once
+    assert read_grid(rasters[0]) == read_grid(rasters[1])
+    assert len(store._indexes) == 1
+
+
+def test_weighted_and_other_statistics_are_merged(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    rasters = rasters_on_one_grid(raster_layer, tmp_path)
+    weights = weights_on_grid(rasters[0], tmp_path)
+    stats = ["count", "max", "weighted_mean", "weighted_sum"]
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+    feature_ids = vector_layer.allFeatureIds()
+    result_list = []
+    task = CalculateStatsTask(
+        "Calculating statistics",
+        0,
+        result_list=result_list,
+        polygon_layer=None,
+        rasters=rasters,
+        weights=weights,
+        stats=stats,
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+        feature_source=source,
+        coverage_store=CoverageIndexStore(),
+    )
+
+    result = task.calculate_batch_with_coverage(FeatureBatch(feature_ids))
+    expected = calculate_statistics(
+        source,
+        rasters=rasters,
+        weights=weights,
+        stats=stats,
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+    )
+
+    assert task.linear_stats == ["count", "weighted_mean", "weighted_sum"]
+    assert task.other_stats == ["max"]
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        result.sort_values("id").reset_index(drop=True),
+        expected.sort_values("id").reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_nodata_weight_matches_exactextract(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    rasters = rasters_on_one_grid(raster_layer, tmp_path)
+    # the cell with data covered only by the polygon with id 3
+    weights = weights_on_grid(rasters[0], tmp_path, nodata_cell=(2, 0))
+    stats = ["weighted_mean", "weighted_sum"]
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+
+    result = calculate_linear_statistics(
+        source,
+        vector_layer.allFeatureIds(),
+        rasters,
+        weights,
+        stats,
+        ["id"],
+        CoverageIndexStore(),
+    )
+    expected = calculate_statistics(
+        source,
+        rasters=rasters,
+        weights=weights,
+        stats=stats,
+        include_cols={"id": 0},
+        geospatial_output=False,
+        strategy="feature-sequential",
+    )
+
+    result = result.sort_values("id").reset_index(drop=True)
+    pd.testing.assert_frame_equal(
+        result,
+        expected.sort_values("id").reset_index(drop=True),
+        check_dtype=False,
+    )
+    assert result[result["id"] == 3].iloc[:, 1:].isna().all(axis=None)
+
+
+def test_multiband_weights_are_not_linear(setup_layers):
+    _, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    assert raster_layer.bandCount() > 1
+
+    linear, other = split_linear_stats(
+        ["sum", "weighted_sum", "median"], [raster_path], raster_path
+    )
+
+    assert linear == ["sum"]
+    assert other == ["weighted_sum", "median"]
+
+
+def test_memory_mapped_index(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+    store = CoverageIndexStore(str(tmp_path / "coverage"))
+
+    index = store.get(
+        read_grid(raster_path), vector_layer.allFeatureIds(), source, raster_path
+    )
+    built = CoverageIndex.build(source, raster_path)
+
+    assert isinstance(index.coverage, np.memmap)
+    np.testing.assert_array_equal(index.offsets, built.offsets)
+    np.testing.assert_array_equal(index.cell_ids, built.cell_ids)
+    assert index.features_count == vector_layer.featureCount()
+    store.clear()
+    assert not (tmp_path / "coverage").exists()
+
+
+def test_only_covered_cells_are_read(setup_layers):
+    vector_layer, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    source = FeatureSubsetSource.from_layer(vector_layer, ["id"])
+    index = CoverageIndex.build(source, raster_path)
+    band = gdal.Open(raster_path).GetRasterBand(1)
+
+    cells = index.covered_cells()
+    values = read_band_cells(band, cells, band.XSize)
+
+    # cells covered by more features are read once
+    assert len(cells.cell_ids) == len(np.unique(index.cell_ids))
+    np.testing.assert_array_equal(cells.cell_ids[cells.columns], index.cell_ids)
+    dense = band.ReadAsArray().astype(np.float64).ravel()
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        dense[dense == nodata] = np.nan
+    np.testing.assert_array_equal(values, dense[cells.cell_ids])
@@ -0,0 +1,95 @@
+import gzip
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from qgis.core import QgsVectorLayer
+
+from zonal_exact import csv_output
+from zonal_exact.csv_output import (
+    compressed_path,
+    csvt_path,
+    csvt_types,
+    split_blocks,
+    write_csv,
+)
+
+
+def results_frame():
+    return pd.DataFrame(
+        {"id": range(50), "mean": [i / 3 for i in range(50)], "valid": [True] * 50}
+    )
+
+
+def test_csvt_types():
+    frame = pd.DataFrame(
+        {"id": [1], "mean": [1.5], "valid": [True], "values": [[1, 2]], "name": ["a"]}
+    )
+
+    assert csvt_types(frame) == [
+        "Integer64",
+        "Real",
+        "Integer(Boolean)",
+        "String",
+        "String",
+    ]
+
+
+def test_compressed_paths():
+    assert compressed_path(Path("output.csv"), "none") == Path("output.csv")
+    assert compressed_path(Path("output.csv"), "gzip") == Path("output.csv.gz")
+    assert compressed_path(Path("output.csv"), "zstd") == Path("output.csv.zst")
+    assert csvt_path(Path("output.csv")) == Path("output.csvt")
+    assert csvt_path(Path("output.csv.gz")) == Path("output.csvt")
+
+
+def test_blocks_of_batches_split_by_size(monkeypatch):
+    monkeypatch.setattr(csv_output, "CSV_BLOCK_ROWS", 7)
+
+    blocks = split_blocks(results_frame(), [10, 20, 5])
+
+    # batches of 10, 20 and 5 rows, 15 rows over batches
+    assert [len(block) for block in blocks] == [7, 3, 7, 7, 6, 5, 7, 7, 1]
+    assert len(split_blocks(results_frame().iloc[:0], [])) == 1
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_blocks_written_in_order(tmp_path, monkeypatch, compression):
+    monkeypatch.setattr(csv_output, "CSV_BLOCK_ROWS", 7)
+    frame = results_frame()
+    output_path = compressed_path(tmp_path / "output.csv", compression)
+
+    write_csv(frame, output_path, [10, 20, 5], compression, max_workers=3)
+
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), frame)
+    assert (
+        tmp_path / "output.csvt"
+    ).read_text() == '"Integer64","Real","Integer(Boolean)"'
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        [output_path.name, "output.csvt"]
+    )
+
+
+def test_gzip_blocks_are_gzip_members(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_output, "CSV_BLOCK_ROWS", 7)
+    output_path = tmp_path / "output.csv.gz"
+
+    write_csv(results_frame(), output_path, [], "gzip", max_workers=2)
+
+    # every block is compressed separately, readers see a single stream
+    assert output_path.read_bytes().count(b"\x1f\x8b\x08") >= 8
+    assert (
+        gzip.decompress(output_path.read_bytes()).decode().startswith("id,mean,valid")
+    )
+    output_layer = QgsVectorLayer(f"/vsigzip/{output_path}", "output", "ogr")
+    assert output_layer.featureCount() == 50
+
+
+def test_zstd_compression(tmp_path):
+    pytest.importorskip("zstandard")
+    frame = results_frame()
+    output_path = tmp_path / "output.csv.zst"
+
+    write_csv(frame, output_path, [25], "zstd")
+
+    pd.testing.assert_frame_equal(pd.read_csv(output_path), frame)
@@ -0,0 +1,139 @@
+import pandas as pd
+from qgis.core import (
+    QgsCoordinateTransformContext,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsTask,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from zonal_exact.incremental import (
+    IncrementalUpdate,
+    geometry_hashes,
+    hashes_path,
+    patch_layer,
+    patch_table,
+)
+from zonal_exact.task_classes import FeatureSubsetSource, PlanBatchesTask
+
+
+def saved_update(output_path, vector_layer, run_key="key"):
+    update = IncrementalUpdate.load(output_path, run_key, "id", 0)
+    update.current = geometry_hashes(vector_layer, 0)
+    update.save()
+    return IncrementalUpdate.load(output_path, run_key, "id", 0)
+
+
+def move_feature(vector_layer, id_value):
+    feature = next(
+        vector_layer.getFeatures(
+            QgsFeatureRequest().setFilterExpression(f'"id" = {id_value}')
+        )
+    )
+    geometry = QgsGeometry(feature.geometry())
+    geometry.translate(0.5, 0)
+    vector_layer.dataProvider().changeGeometryValues({feature.id(): geometry})
+    return feature.id()
+
+
+def test_hashes_are_ignored_without_output(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.csv"
+
+    update = saved_update(output_path, vector_layer)
+
+    assert hashes_path(output_path).exists()
+    assert update.active is False
+
+
+def test_detect_changes(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.csv"
+    output_path.write_text("id\n")
+    update = saved_update(output_path, vector_layer)
+    assert update.active is True
+
+    moved_fid = move_feature(vector_layer, 3)
+    removed = next(
+        vector_layer.getFeatures(QgsFeatureRequest().setFilterExpression('"id" = 20'))
+    )
+    vector_layer.dataProvider().deleteFeatures([removed.id()])
+    update.current = geometry_hashes(vector_layer, 0)
+
+    assert update.detect_changes() == [moved_fid]
+    assert update.changed_ids == {"3"}
+    assert update.removed_ids == {"20"}
+    assert update.replaced_ids == {"3", "20"}
+
+
+def test_other_parameters_calculate_from_scratch(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.csv"
+    output_path.write_text("id\n")
+    saved_update(output_path, vector_layer)
+
+    update = IncrementalUpdate.load(output_path, "other key", "id", 0)
+
+    assert update.active is False
+
+
+def test_plan_only_changed_features(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    output_path = tmp_path / "output.csv"
+    output_path.write_text("id\n")
+    update = saved_update(output_path, vector_layer)
+    moved_fid = move_feature(vector_layer, 3)
+
+    task = PlanBatchesTask(
+        "Planning batches",
+        QgsTask.CanCancel,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        features_count=vector_layer.featureCount(),
+        rasters=[raster_layer.dataProvider().dataSourceUri()],
+        parallel_jobs=2,
+        incremental=update,
+    )
+
+    assert task.run() is True
+    assert [fid for batch in task.batches for fid in batch.feature_ids] == [moved_fid]
+    assert len(update.current) == vector_layer.featureCount()
+
+
+def test_patch_table(tmp_path):
+    output_path = tmp_path / "output.csv"
+    pd.DataFrame({"id": [1, 2, 3], "mean": [1.0, 2.0, 3.0]}).to_csv(
+        output_path, index=False
+    )
+
+    patch_table(output_path, pd.DataFrame({"mean": [5.0], "id": [2]}), "id", {"2", "3"})
+
+    patched = pd.read_csv(output_path).sort_values("id")
+    assert patched["id"].tolist() == [1, 2]
+    assert patched["mean"].tolist() == [1.0, 5.0]
+
+
+def test_patch_layer(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.gpkg"
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    QgsVectorFileWriter.writeAsVectorFormatV3(
+        vector_layer, str(output_path), QgsCoordinateTransformContext(), options
+    )
+    features_count = vector_layer.featureCount()
+    increment_layer = QgsVectorLayer(
+        "Polygon?crs=epsg:3035&field=id:integer", "increment", "memory"
+    )
+    increment_feature = next(
+        vector_layer.getFeatures(QgsFeatureRequest().setFilterExpression('"id" = 3'))
+    )
+    increment_layer.dataProvider().addFeature(increment_feature)
+
+    patch_layer(output_path, increment_layer, "id", {"3", "20"})
+
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    ids = [feature["id"] for feature in output_layer.getFeatures()]
+    assert output_layer.featureCount() == features_count - 1
+    assert ids.count(3) == 1
+    assert 20 not in ids
@@ -0,0 +1,80 @@
+import pytest
+from qgis.core import QgsVectorFileWriter, QgsVectorLayer
+
+from zonal_exact.layer_writer import StreamingLayerWriter
+
+
+def test_batches_are_appended_to_output(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.gpkg"
+    writer = StreamingLayerWriter(output_path, vector_layer.crs())
+
+    writer.append(vector_layer)
+    writer.append(vector_layer)
+
+    # output is replaced only when the calculation is done
+    assert writer.batches_count == 2
+    assert not output_path.exists()
+    writer.finish()
+    assert writer.partial_files() == []
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    assert output_layer.featureCount() == 2 * vector_layer.featureCount()
+    assert output_layer.fields().names() == ["fid", "id"]
+
+
+def test_prefix_added_when_schema_is_created(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.gpkg"
+    writer = StreamingLayerWriter(
+        output_path, vector_layer.crs(), prefix="zonal_", source_columns={}
+    )
+
+    writer.append(vector_layer)
+    writer.append(vector_layer)
+    writer.finish()
+
+    # batches are not edited, their columns are mapped to prefixed columns of the output
+    assert vector_layer.fields().names() == ["id"]
+    assert not vector_layer.isEditable()
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    assert output_layer.fields().names() == ["fid", "zonal_id"]
+    values = [feature["zonal_id"] for feature in output_layer.getFeatures()]
+    assert len(values) == 2 * vector_layer.featureCount()
+    assert None not in values
+
+
+def test_discard_keeps_existing_output(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.gpkg"
+    output_path.write_text("previous output")
+    writer = StreamingLayerWriter(output_path, vector_layer.crs())
+
+    writer.append(vector_layer)
+    writer.discard()
+
+    assert writer.partial_files() == []
+    assert output_path.read_text() == "previous output"
+
+
+@pytest.mark.skipif(
+    "parquet" not in QgsVectorFileWriter.supportedFormatExtensions(),
+    reason="GDAL without Parquet driver",
+)
+def test_geoparquet_written_by_open_writer(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    output_path = tmp_path / "output.parquet"
+    writer = StreamingLayerWriter(
+        output_path, vector_layer.crs(), prefix="zonal_", source_columns={}
+    )
+    writer.row_group_size = vector_layer.featureCount()
+
+    # GeoParquet can't be appended to, batches are added to the writer kept open
+    writer.append(vector_layer)
+    writer.append(vector_layer)
+    writer.finish()
+
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    assert output_layer.isValid()
+    assert output_layer.featureCount() == 2 * vector_layer.featureCount()
+    assert output_layer.fields().names()[-1] == "zonal_id"
+    assert writer.partial_files() == []
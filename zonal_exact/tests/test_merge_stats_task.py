@@ -1,9 +1,15 @@
+import tracemalloc
+
+import numpy as np
 import pytest
 import pandas as pd
 
-from qgis.core import QgsTask
+from qgis.core import QgsTask, QgsVectorLayer
 from qgis.PyQt.QtWidgets import QPlainTextEdit
 
+from zonal_exact.band_ranges import BandRangeResult
+from zonal_exact.result_buffer import ResultBuffer, result_bytes
+from zonal_exact.sharded_output import ShardedOutput
 from zonal_exact.task_classes import MergeStatsTask
 from zonal_exact.user_communication import WidgetPlainTextWriter
 
@@ -39,27 +45,45 @@ def setup_stats_dfs():
 
 
 @pytest.fixture
-def init_merge_stats_task(setup_stats_dfs, tmp_path):
+def create_merge_stats_task(tmp_path):
+    def create(result_list, **kwargs):
+        # kwargs override arguments of the merge of tabular results, e.g. prefix, csv_path, parquet_path
+        # or sharded_output
+        arguments = dict(
+            description="Merge statistics",
+            flags=QgsTask.CanCancel,
+            result_list=result_list,
+            index_column="id",
+            prefix="pytest_",
+            geospatial_output=False,
+            output_file_path=tmp_path / "merged_stats.csv",
+            source_columns={"id": 0},
+            source_crs=None,
+        )
+        arguments.update(kwargs)
+        return MergeStatsTask(**arguments)
+
+    return create
+
+
+@pytest.fixture
+def init_merge_stats_task(setup_stats_dfs, create_merge_stats_task):
     stats_df1, stats_df2, stats_df3 = setup_stats_dfs
     result_list = [stats_df1, stats_df2, stats_df3]
     # Create a console writer
     console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
-    task = MergeStatsTask(
-        description="Merge statistics",
-        flags=QgsTask.CanCancel,
-        result_list=result_list,
-        index_column="id",
-        prefix="pytest_",
-        geospatial_output=False,
-        output_file_path=rf"{tmp_path}\merged_stats.csv",
-        source_columns={"id": 0},
-        source_crs=None,
-    )
+    task = create_merge_stats_task(result_list)
     task.taskChanged.connect(console.write_info)
 
     return task, console
 
 
+def parquet_row_groups(path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    metadata = pq.ParquetFile(path).metadata
+    return [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+
 def test_task_init(init_merge_stats_task):
     task, _ = init_merge_stats_task
 
@@ -110,3 +134,126 @@ def test_task_console_output(init_merge_stats_task):
         console_output[2]
         == "[INFO]: Finished MergeStatsTask Task: Merge statistics, result: Failed"
     )
+
+
+def test_task_run_streams_results_to_output(
+    tmp_path, monkeypatch, create_merge_stats_task
+):
+    # a single thread formats CSV blocks, so only a few blocks are formatted ahead of the written one
+    monkeypatch.setattr("zonal_exact.task_classes.available_threads", lambda: 1)
+    rows, batches = 5_000, 200
+
+    def spilled_results():
+        # results are read back one at a time, like spilled results of ResultBuffer
+        for batch in range(batches):
+            yield pd.DataFrame(
+                {
+                    "id": np.arange(batch * rows, (batch + 1) * rows),
+                    "mean": np.linspace(0, 1, rows),
+                }
+            )
+
+    results_bytes = batches * result_bytes(next(spilled_results()))
+    output_path = tmp_path / "merged_stats.csv"
+    task = create_merge_stats_task(spilled_results(), csv_path=output_path)
+
+    tracemalloc.start()
+    try:
+        assert task.run() is True
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # results are not concatenated, memory is bounded by a few batches instead of all of them
+    assert peak_bytes < results_bytes / 4
+    assert task.calculated_stats is None
+    assert task.result_shape == (rows * batches, 2)
+    merged_stats = pd.read_csv(output_path)
+    assert list(merged_stats.columns) == ["id", "pytest_mean"]
+    assert merged_stats["id"].tolist() == list(range(rows * batches))
+
+
+def test_task_run_merges_spilled_results(
+    tmp_path, batch_results, create_merge_stats_task
+):
+    buffer = ResultBuffer(result_bytes(batch_results[-1]), str(tmp_path / "spill"))
+    buffer.extend(batch_results)
+    task = create_merge_stats_task(buffer, prefix="")
+
+    assert task.run() is True
+    assert buffer.spilled_count == 2
+    pd.testing.assert_frame_equal(task.calculated_stats, pd.concat(batch_results))
+
+
+def test_task_run_writes_csv(tmp_path, batch_results, create_merge_stats_task):
+    output_path = tmp_path / "output.csv"
+    task = create_merge_stats_task(
+        batch_results,
+        prefix="zonal_",
+        output_file_path=output_path,
+        csv_path=output_path,
+    )
+
+    assert task.run() is True
+    output_layer = QgsVectorLayer(str(output_path), "output", "ogr")
+    assert output_layer.featureCount() == 9
+    assert output_layer.fields().names() == ["id", "zonal_mean"]
+    # types of columns are read from the .csvt file
+    assert output_layer.fields().field("zonal_mean").isNumeric()
+
+
+def test_task_run_writes_parquet(tmp_path, batch_results, create_merge_stats_task):
+    output_path = tmp_path / "output.parquet"
+    task = create_merge_stats_task(
+        batch_results,
+        prefix="zonal_",
+        output_file_path=output_path,
+        parquet_path=output_path,
+    )
+
+    assert task.run() is True
+    assert parquet_row_groups(output_path) == [2, 3, 4]
+    output = pd.read_parquet(output_path)
+    assert list(output.columns) == ["id", "zonal_mean"]
+    # dtypes are kept, unlike in CSV
+    assert output["id"].dtype == batch_results[0]["id"].dtype
+
+
+def test_task_run_writes_band_ranges_in_batches_of_first_range(
+    tmp_path, batch_results, create_merge_stats_task
+):
+    output_path = tmp_path / "output.parquet"
+    task = create_merge_stats_task(
+        [BandRangeResult(0, result) for result in batch_results]
+        + [
+            BandRangeResult(1, result.rename(columns={"mean": "max"}))
+            for result in batch_results
+        ],
+        prefix="",
+        output_file_path=output_path,
+        parquet_path=output_path,
+    )
+
+    assert task.run() is True
+    assert parquet_row_groups(output_path) == [2, 3, 4]
+    assert list(pd.read_parquet(output_path).columns) == ["id", "mean", "max"]
+
+
+def test_task_run_unites_shards(tmp_path, batch_results, create_merge_stats_task):
+    output_path = tmp_path / "output.csv"
+    sharded_output = ShardedOutput(output_path, False, None)
+    sharded_output.prepare()
+    sharded_output.create_writer().append(batch_results[0])
+    task = create_merge_stats_task(
+        # results not written by subtasks, e.g. loaded from checkpoints
+        batch_results[1:],
+        prefix="",
+        output_file_path=output_path,
+        sharded_output=sharded_output,
+    )
+
+    assert task.run() is True
+    assert task.calculated_stats is None
+    assert len(sharded_output.shard_paths()) == 2
+    output_layer = QgsVectorLayer(str(sharded_output.union_path), "output", "ogr")
+    assert output_layer.featureCount() == 9
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from zonal_exact.parquet_output import ParquetTableWriter, write_parquet
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def row_groups(path):
+    metadata = pq.ParquetFile(path).metadata
+    return [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+
+def test_row_group_for_every_batch(tmp_path, batch_results):
+    frame = pd.concat(batch_results)
+    output_path = tmp_path / "output.parquet"
+
+    write_parquet(frame, output_path, [2, 3, 4])
+
+    assert row_groups(output_path) == [2, 3, 4]
+    assert (
+        pq.ParquetFile(output_path).metadata.row_group(0).column(1).compression
+        == "ZSTD"
+    )
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(output_path), frame.reset_index(drop=True)
+    )
+
+
+def test_rows_over_batches_written_as_last_row_group(tmp_path, batch_results):
+    frame = pd.concat(batch_results)
+    output_path = tmp_path / "output.parquet"
+
+    write_parquet(frame, output_path, [2, 3])
+
+    assert row_groups(output_path) == [2, 3, 4]
+
+
+def test_discard_keeps_existing_output(tmp_path, batch_results):
+    output_path = tmp_path / "output.parquet"
+    write_parquet(batch_results[0], output_path, [2])
+    writer = ParquetTableWriter(output_path)
+
+    writer.append(batch_results[1])
+    writer.discard()
+
+    assert not writer.partial_path.exists()
+    assert len(pd.read_parquet(output_path)) == 2
@@ -0,0 +1,155 @@
+import math
+
+from osgeo import gdal, osr
+from qgis.core import QgsCoordinateReferenceSystem, QgsFeedback
+
+from zonal_exact.partitioning import (
+    VERTEX_COST,
+    FeatureInfo,
+    RasterCells,
+    collect_feature_info,
+    estimate_feature_cost,
+    hilbert_index,
+    raster_cell_areas,
+    spatially_sorted_ids,
+    split_by_cost,
+)
+
+
+def test_hilbert_index_is_continuous():
+    order = 3
+    side = 1 << order
+    cells = {
+        hilbert_index(x, y, order): (x, y) for x in range(side) for y in range(side)
+    }
+
+    # every cell gets unique position along the curve
+    assert sorted(cells) == list(range(side * side))
+    # consecutive positions along the curve are neighbouring cells
+    for distance in range(side * side - 1):
+        (x1, y1), (x2, y2) = cells[distance], cells[distance + 1]
+        assert abs(x1 - x2) + abs(y1 - y2) == 1
+
+
+def test_spatially_sorted_ids_groups_close_features():
+    features_info = [
+        FeatureInfo(1, 0, 0, 1, 1),
+        FeatureInfo(2, 99, 99, 100, 100),
+        FeatureInfo(3, 1, 0, 2, 1),
+        FeatureInfo(4, 98, 99, 99, 100),
+    ]
+
+    sorted_ids = spatially_sorted_ids(features_info)
+
+    # features from the same corner are neighbours in the result
+    assert {sorted_ids[0], sorted_ids[1]} in ({1, 3}, {2, 4})
+    assert {sorted_ids[2], sorted_ids[3]} in ({1, 3}, {2, 4})
+
+
+def test_spatially_sorted_ids_keeps_features_without_geometry():
+    features_info = [
+        FeatureInfo(1, 0, 0, 1, 1),
+        FeatureInfo(2, math.nan, math.nan, math.nan, math.nan),
+    ]
+
+    assert spatially_sorted_ids(features_info) == [2, 1]
+
+
+def test_collect_feature_info(setup_layers):
+    vector_layer, _ = setup_layers
+
+    features_info = collect_feature_info(vector_layer)
+
+    assert len(features_info) == vector_layer.featureCount()
+    assert sorted(info.fid for info in features_info) == sorted(
+        vector_layer.allFeatureIds()
+    )
+    big_polygon = [info for info in features_info if info.xmax - info.xmin == 4][0]
+    assert (big_polygon.ymin, big_polygon.ymax) == (-1, 5)
+    # triangle with closing vertex
+    assert big_polygon.vertices == 4
+
+
+def test_collect_feature_info_canceled(setup_layers):
+    vector_layer, _ = setup_layers
+    feedback = QgsFeedback()
+    feedback.cancel()
+
+    assert collect_feature_info(vector_layer, feedback) == []
+
+
+def test_estimate_feature_cost():
+    info = FeatureInfo(1, 0, 0, 4, 2, vertices=5)
+
+    # 8 cells of 1x1 raster, 2 cells of 2x2 raster and 5 vertices
+    assert estimate_feature_cost(info, [RasterCells(1.0), RasterCells(4.0)]) == 15.0
+    # feature smaller than a cell covers at least one cell
+    assert (
+        estimate_feature_cost(FeatureInfo(1, 0, 0, 0.1, 0.1), [RasterCells(1.0)]) == 1.0
+    )
+    nan = math.nan
+    assert (
+        estimate_feature_cost(FeatureInfo(1, nan, nan, nan, nan), [RasterCells(1.0)])
+        == 0.0
+    )
+
+
+def write_projected_raster(path, epsg=None):
+    # 1 km cells covering central Europe in ETRS89-LAEA
+    dataset = gdal.GetDriverByName("GTiff").Create(str(path), 2000, 2000, 1)
+    dataset.SetGeoTransform([4000000, 1000, 0, 3500000, 0, -1000])
+    if epsg is not None:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        dataset.SetProjection(srs.ExportToWkt())
+    dataset = None
+    return str(path)
+
+
+def test_cost_of_features_in_other_crs(tmp_path):
+    raster_path = write_projected_raster(tmp_path / "laea.tif", 3035)
+    # 1 x 1 degree box, about 70 x 110 km at 50 degrees north
+    info = FeatureInfo(1, 10, 50, 11, 51, vertices=5)
+
+    cell_areas = raster_cell_areas(
+        [raster_path], QgsCoordinateReferenceSystem("EPSG:4326")
+    )
+
+    assert cell_areas[0].cell_area == 1_000_000
+    assert 5000 < estimate_feature_cost(info, cell_areas) < 12000
+
+
+def test_cost_without_raster_crs_counts_vertices(tmp_path):
+    raster_path = write_projected_raster(tmp_path / "unknown.tif")
+    info = FeatureInfo(1, 10, 50, 11, 51, vertices=5)
+
+    cell_areas = raster_cell_areas(
+        [raster_path], QgsCoordinateReferenceSystem("EPSG:4326")
+    )
+
+    assert not cell_areas[0].comparable
+    assert estimate_feature_cost(info, cell_areas) == 5 * VERTEX_COST
+
+
+def test_split_by_cost_balances_batches():
+    feature_ids = list(range(12))
+    costs = {fid: 1.0 for fid in feature_ids}
+    costs[11] = 100.0
+
+    batches = split_by_cost(feature_ids, costs, 3)
+
+    # order of features is kept and expensive feature gets its own batch
+    assert [fid for batch in batches for fid in batch.feature_ids] == feature_ids
+    assert batches[-1].feature_ids == [11]
+    assert batches[-1].estimated_cost == 100.0
+    assert len(batches) == 3
+
+
+def test_split_by_cost_equal_costs():
+    feature_ids = list(range(12))
+    costs = {fid: 1.0 for fid in feature_ids}
+
+    batches = split_by_cost(feature_ids, costs, 3)
+
+    assert [len(batch.feature_ids) for batch in batches] == [4, 4, 4]
+    assert len(split_by_cost(feature_ids[:2], costs, 3)) == 2
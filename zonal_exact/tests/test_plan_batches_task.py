@@ -0,0 +1,92 @@
+from qgis.core import QgsTask
+
+from zonal_exact.task_classes import FeatureSubsetSource, PlanBatchesTask
+from zonal_exact.tuning import (
+    CHUNK_CELL_BYTES,
+    MIN_CELLS_IN_MEMORY,
+    MIN_SUBTASK_CACHE_BYTES,
+)
+
+MIN_SUBTASK_MEMORY = MIN_CELLS_IN_MEMORY * CHUNK_CELL_BYTES + MIN_SUBTASK_CACHE_BYTES
+
+
+def init_plan_batches_task(
+    setup_layers, parallel_jobs, calculate_sample=None, strategy=None, memory_budget=0
+):
+    vector_layer, raster_layer = setup_layers
+    return PlanBatchesTask(
+        "Planning batches",
+        QgsTask.CanCancel,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        features_count=vector_layer.featureCount(),
+        rasters=[raster_layer.dataProvider().dataSourceUri()],
+        parallel_jobs=parallel_jobs,
+        calculate_sample=calculate_sample,
+        strategy=strategy,
+        memory_budget=memory_budget,
+    )
+
+
+def test_plan_batches(setup_layers):
+    vector_layer, _ = setup_layers
+    task = init_plan_batches_task(setup_layers, parallel_jobs=2)
+
+    assert task.run() is True
+
+    planned_ids = [fid for batch in task.batches for fid in batch.feature_ids]
+    assert sorted(planned_ids) == sorted(vector_layer.allFeatureIds())
+    assert task.subtasks_count == 2
+    assert len(task.batches) > 2
+
+
+def test_plan_batches_auto_subtasks(setup_layers):
+    samples = []
+    task = init_plan_batches_task(
+        setup_layers, parallel_jobs=0, calculate_sample=samples.append
+    )
+
+    assert task.run() is True
+
+    # tiny calculation isn't worth more subtasks
+    assert task.subtasks_count == 1
+    assert len(task.batches) == 1
+    assert len(samples) == 1
+
+
+def test_plan_batches_auto_strategy(setup_layers):
+    messages = []
+    task = init_plan_batches_task(setup_layers, parallel_jobs=2, strategy="auto")
+    task.taskChanged.connect(messages.append)
+
+    assert task.run() is True
+
+    # small raster fits in GDAL cache
+    assert all(batch.strategy == "feature-sequential" for batch in task.batches)
+    assert len([m for m in messages if m.startswith("Auto strategy")]) == len(
+        task.batches
+    )
+
+
+def test_plan_batches_memory_budget(setup_layers):
+    messages = []
+    # enough for two subtasks with the smallest raster chunk and block cache and a few small polygons
+    task = init_plan_batches_task(
+        setup_layers,
+        parallel_jobs=4,
+        memory_budget=2 * (MIN_SUBTASK_MEMORY + 1024 * 1024),
+    )
+    task.taskChanged.connect(messages.append)
+
+    assert task.run() is True
+
+    assert task.subtasks_count == 2
+    assert task.memory_plan.subtasks_count == 2
+    assert any(m.startswith("Memory budget") for m in messages)
+
+
+def test_plan_batches_canceled(setup_layers):
+    task = init_plan_batches_task(setup_layers, parallel_jobs=2)
+    task.cancel()
+
+    assert task.run() is False
+    assert task.batches == []
@@ -0,0 +1,169 @@
+import os
+
+from osgeo import ogr
+from qgis.core import QgsVectorLayer
+
+from zonal_exact.process_pool import (
+    BatchJob,
+    ProcessPoolBackend,
+    calculate_batch_job,
+    export_for_workers,
+    open_dataset,
+    raster_sources,
+    read_batch_features,
+)
+
+CUSTOM_FUNCTION = """def values_count(values, cov):
+    return len(values)
+"""
+
+
+def make_job(vector_layer, raster_layer, tmp_path, geospatial_output=False):
+    source_path, layer_name, layer_id = export_for_workers(
+        vector_layer, ["id"], str(tmp_path)
+    )
+    return BatchJob(
+        source_path=source_path,
+        layer_name=layer_name,
+        layer_id=layer_id,
+        rasters=[raster_layer.dataProvider().dataSourceUri()],
+        weights=None,
+        stats=["count"],
+        custom_functions_code=[CUSTOM_FUNCTION],
+        include_cols=["id"],
+        geospatial_output=geospatial_output,
+        strategy="feature-sequential",
+        shard_dir=str(tmp_path),
+    )
+
+
+def test_export_keeps_feature_ids(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    job = make_job(vector_layer, raster_layer, tmp_path)
+    feature_ids = sorted(vector_layer.allFeatureIds())[:3]
+    job.feature_ids = feature_ids
+
+    _, batch_layer = read_batch_features(job)
+
+    assert batch_layer.GetFeatureCount() == 3
+    ids = {feature.GetField("id"): feature.GetFID() for feature in batch_layer}
+    for fid in feature_ids:
+        assert ids[vector_layer.getFeature(fid)["id"]] == fid
+
+
+def test_file_layer_is_read_by_its_index(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    source_path, _, _ = export_for_workers(vector_layer, ["id"], str(tmp_path))
+    dataset = ogr.Open(source_path, update=1)
+    dataset.CopyLayer(dataset.GetLayer(0), "copy")
+    for fid in vector_layer.allFeatureIds():
+        dataset.GetLayer(0).DeleteFeature(fid)
+    dataset = None
+    file_layer = QgsVectorLayer(f"{source_path}|layerid=1", "copy", "ogr")
+    assert file_layer.isValid()
+
+    (tmp_path / "workers").mkdir()
+    job = make_job(file_layer, raster_layer, tmp_path / "workers")
+    job.feature_ids = file_layer.allFeatureIds()
+    _, batch_layer = read_batch_features(job)
+
+    assert (job.source_path, job.layer_id) == (source_path, 1)
+    assert batch_layer.GetFeatureCount() == vector_layer.featureCount()
+
+
+def test_edited_file_layer_is_exported(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    source_path, _, _ = export_for_workers(vector_layer, ["id"], str(tmp_path))
+    file_layer = QgsVectorLayer(source_path, "features", "ogr")
+    fid = file_layer.allFeatureIds()[0]
+    file_layer.startEditing()
+    file_layer.changeAttributeValue(fid, file_layer.fields().indexOf("id"), 100)
+
+    (tmp_path / "workers").mkdir()
+    job = make_job(file_layer, raster_layer, tmp_path / "workers")
+    job.feature_ids = [fid]
+    _, batch_layer = read_batch_features(job)
+
+    assert job.source_path != source_path
+    assert [feature.GetField("id") for feature in batch_layer] == [100]
+    file_layer.rollBack()
+
+
+def test_calculate_batch_job(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    job = make_job(vector_layer, raster_layer, tmp_path)
+    job.feature_ids = vector_layer.allFeatureIds()
+
+    result = calculate_batch_job(job)
+
+    assert len(result) == vector_layer.featureCount()
+    assert "id" in result.columns
+    assert any(column.endswith("values_count") for column in result.columns)
+
+
+def test_calculate_batch_job_writes_shard(setup_layers, tmp_path):
+    vector_layer, raster_layer = setup_layers
+    job = make_job(vector_layer, raster_layer, tmp_path, geospatial_output=True)
+    job.feature_ids = vector_layer.allFeatureIds()[:2]
+    job.batch_id = 7
+
+    shard_path = calculate_batch_job(job)
+
+    assert shard_path == str(tmp_path / "batch_7.gpkg")
+    assert (tmp_path / "batch_7.gpkg").exists()
+
+
+def test_open_dataset_is_reused(setup_layers):
+    _, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    opened = []
+
+    def opener(path):
+        opened.append(path)
+        return object()
+
+    first = open_dataset(raster_path, opener)
+    second = open_dataset(raster_path, opener)
+
+    assert first is second
+    assert opened == [raster_path]
+
+
+def test_open_virtual_raster_is_reopened_when_its_file_changes(tmp_path):
+    raster_path = tmp_path / "raster.tif"
+    raster_path.write_bytes(b"1")
+    uri = f"vrt://{raster_path}?bands=1"
+    opened = []
+
+    def opener(path):
+        opened.append(path)
+        return object()
+
+    first = open_dataset(uri, opener)
+    assert open_dataset(uri, opener) is first
+    raster_path.write_bytes(b"12")
+    os.utime(raster_path, (0, 0))
+
+    assert open_dataset(uri, opener) is not first
+    assert opened == [uri, uri]
+
+
+def test_raster_sources_names(setup_layers):
+    _, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+
+    names = [source.name() for source in raster_sources([raster_path])]
+
+    # two bands named the same way exactextract names rasters given as paths
+    assert names == ["pytest_raster_band_1", "pytest_raster_band_2"]
+
+
+def test_backend_resized_to_subtasks():
+    backend = ProcessPoolBackend(4)
+
+    backend.resize(4)
+    assert backend.max_workers == 4
+    backend.resize(2)
+
+    assert backend.max_workers == 2
+    assert not backend.running
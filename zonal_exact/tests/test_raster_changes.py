@@ -0,0 +1,100 @@
+import numpy as np
+from osgeo import gdal
+from qgis.core import QgsRectangle, QgsTask
+
+from zonal_exact.incremental import IncrementalUpdate, geometry_hashes
+from zonal_exact.raster_changes import (
+    block_checksums,
+    changed_block_extents,
+    features_in_extents,
+)
+from zonal_exact.task_classes import FeatureSubsetSource, PlanBatchesTask
+
+
+def update_top_rows(raster_path):
+    dataset = gdal.Open(raster_path, gdal.GA_Update)
+    band = dataset.GetRasterBand(1)
+    band.WriteArray(np.full((1, dataset.RasterXSize), 100, dtype=np.float32), 0, 0)
+    dataset = None  # close the file
+
+
+def test_changed_block_extents(setup_layers):
+    _, raster_layer = setup_layers
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+    previous = block_checksums(raster_path)
+
+    update_top_rows(raster_path)
+    current = block_checksums(raster_path)
+    extents = changed_block_extents(raster_path, previous, current)
+
+    assert previous.keys() == current.keys()
+    assert changed_block_extents(raster_path, previous, previous) == []
+    assert len(extents) >= 1
+    # raster has origin at (0, 5) and 1 m cells, the first row spans y from 4 to 5
+    assert extents[0].yMaximum() == 5
+    assert extents[0].yMinimum() >= 0
+
+
+def test_features_in_extents(setup_layers):
+    vector_layer, _ = setup_layers
+
+    feature_ids = features_in_extents(vector_layer, [QgsRectangle(4.2, 4.2, 4.8, 4.8)])
+
+    ids = sorted(vector_layer.getFeature(fid)["id"] for fid in feature_ids)
+    assert ids == [14]
+    assert features_in_extents(vector_layer, []) == []
+
+
+def test_plan_features_in_changed_extent(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    output_path = tmp_path / "output.csv"
+    output_path.write_text("id\n")
+    update = IncrementalUpdate.load(output_path, "key", "id", 0)
+    update.current = geometry_hashes(vector_layer, 0)
+    update.save()
+    update = IncrementalUpdate.load(output_path, "key", "id", 0)
+    update.changed_extent = QgsRectangle(4.2, 4.2, 4.8, 4.8)
+
+    task = PlanBatchesTask(
+        "Planning batches",
+        QgsTask.CanCancel,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        features_count=vector_layer.featureCount(),
+        rasters=[raster_layer.dataProvider().dataSourceUri()],
+        parallel_jobs=1,
+        incremental=update,
+    )
+
+    assert task.run() is True
+    planned_ids = [fid for batch in task.batches for fid in batch.feature_ids]
+    assert [vector_layer.getFeature(fid)["id"] for fid in planned_ids] == [14]
+    assert update.changed_ids == {"14"}
+
+
+def test_plan_without_stored_checksums_recalculates_all(tmp_path, setup_layers):
+    vector_layer, raster_layer = setup_layers
+    output_path = tmp_path / "output.csv"
+    output_path.write_text("id\n")
+    update = IncrementalUpdate.load(output_path, "key", "id", 0)
+    update.current = geometry_hashes(vector_layer, 0)
+    update.save()
+    update = IncrementalUpdate.load(output_path, "key", "id", 0)
+    update.detect_raster_changes = True
+    raster_path = raster_layer.dataProvider().dataSourceUri()
+
+    task = PlanBatchesTask(
+        "Planning batches",
+        QgsTask.CanCancel,
+        feature_source=FeatureSubsetSource.from_layer(vector_layer, ["id"]),
+        features_count=vector_layer.featureCount(),
+        rasters=[raster_path],
+        parallel_jobs=1,
+        incremental=update,
+    )
+
+    assert task.run() is True
+    planned_ids = [fid for batch in task.batches for fid in batch.feature_ids]
+    assert len(planned_ids) == vector_layer.featureCount()
+    update.save()
+    stored = IncrementalUpdate.load(output_path, "key", "id", 0)
+    assert stored.previous_blocks == {raster_path: block_checksums(raster_path)}
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from zonal_exact.band_ranges import BandRangeResult
+from zonal_exact.layer_writer import OutputWriteError
+from zonal_exact.result_buffer import ResultBuffer, SpilledResult, result_bytes
+
+
+def test_results_over_limit_are_spilled(tmp_path, batch_results):
+    results = batch_results
+    # room for the last (biggest) result in memory
+    buffer = ResultBuffer(result_bytes(results[-1]), str(tmp_path / "spill"))
+
+    buffer.extend(results)
+
+    assert len(buffer) == 3
+    assert buffer.spilled_count == 2
+    assert buffer.memory_bytes <= buffer.limit_bytes
+    assert sum(isinstance(result, SpilledResult) for result in buffer._results) == 2
+    for loaded, result in zip(buffer, results):
+        pd.testing.assert_frame_equal(loaded, result)
+
+    buffer.clear()
+    assert len(buffer) == 0
+    assert not (tmp_path / "spill").exists()
+
+
+def test_unlimited_buffer_keeps_results_in_memory(tmp_path, batch_results):
+    buffer = ResultBuffer(0, str(tmp_path / "spill"))
+
+    buffer.extend(batch_results)
+
+    assert buffer.spilled_count == 0
+    assert not (tmp_path / "spill").exists()
+
+
+def test_failed_spill_keeps_result_in_memory(tmp_path, batch_results):
+    result = batch_results[0]
+    # the spill directory can't be created under a file
+    (tmp_path / "file").write_text("")
+    buffer = ResultBuffer(1, str(tmp_path / "file" / "spill"))
+
+    with pytest.raises(OutputWriteError):
+        buffer.append(result)
+
+    assert len(buffer) == 1
+    assert buffer.spilled_count == 0
+    assert buffer.memory_bytes == result_bytes(result)
+    pd.testing.assert_frame_equal(next(iter(buffer)), result)
+
+
+def test_spilled_band_range_result(tmp_path, batch_results):
+    result = batch_results[0]
+    buffer = ResultBuffer(1, str(tmp_path / "spill"))
+
+    buffer.append(BandRangeResult(2, result))
+
+    assert buffer.spilled_count == 1
+    loaded = next(iter(buffer))
+    assert loaded.band_range == 2
+    pd.testing.assert_frame_equal(loaded.result, result)
+
+
+def test_spilled_geospatial_result(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    buffer = ResultBuffer(1, str(tmp_path / "spill"))
+
+    buffer.append(vector_layer)
+
+    assert buffer.spilled_count == 1
+    loaded = next(iter(buffer))
+    assert loaded.providerType() == "ogr"
+    assert loaded.featureCount() == vector_layer.featureCount()
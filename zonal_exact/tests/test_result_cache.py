@@ -0,0 +1,80 @@
+import os
+
+from zonal_exact.result_cache import (
+    ResultCache,
+    file_signature,
+    operation_key,
+    split_operation_columns,
+)
+
+
+def test_split_operation_columns():
+    columns = ["id", "r_band_1_mean", "r_band_2_mean", "r_band_1_max", "r_band_2_max"]
+
+    assert split_operation_columns(columns, ["id"], 2) == [
+        ["r_band_1_mean", "r_band_2_mean"],
+        ["r_band_1_max", "r_band_2_max"],
+    ]
+    assert split_operation_columns(columns, ["id"], 3) is None
+
+
+def test_operation_key_changes_with_raster(tmp_path):
+    raster_path = tmp_path / "raster.tif"
+    raster_path.write_bytes(b"1")
+    key = operation_key("mean", [str(raster_path)], None)
+
+    assert key == operation_key("mean", [str(raster_path)], None)
+    assert key != operation_key("max", [str(raster_path)], None)
+    raster_path.write_bytes(b"12")
+    os.utime(raster_path, (0, 0))
+    assert key != operation_key("mean", [str(raster_path)], None)
+
+
+def test_operation_key_changes_with_vector_crs(tmp_path):
+    raster_path = str(tmp_path / "raster.tif")
+
+    key = operation_key("mean", [raster_path], None, vector_crs="EPSG:3035")
+
+    assert key == operation_key("mean", [raster_path], None, vector_crs="EPSG:3035")
+    assert key != operation_key("mean", [raster_path], None, vector_crs="EPSG:4326")
+
+
+def test_virtual_raster_signature_describes_its_file(tmp_path):
+    raster_path = tmp_path / "raster.tif"
+    raster_path.write_bytes(b"1")
+    uri = f"vrt://{raster_path}?bands=2"
+    key = operation_key("mean", [uri], None)
+
+    assert file_signature(uri) == [uri] + file_signature(str(raster_path))[1:]
+    raster_path.write_bytes(b"12")
+    os.utime(raster_path, (0, 0))
+    assert key != operation_key("mean", [uri], None)
+
+
+def test_store_and_lookup(tmp_path):
+    cache = ResultCache(tmp_path / "cache.sqlite", operation_keys=["mean", "max"])
+
+    cache.store(
+        {("feature_1", "mean"): {"mean": 1.5}, ("feature_2", "max"): {"max": 3}}
+    )
+
+    assert cache.lookup(["feature_1", "feature_2", "feature_3"]) == {
+        ("feature_1", "mean"): {"mean": 1.5},
+        ("feature_2", "max"): {"max": 3},
+    }
+    cache.clear()
+    assert cache.lookup(["feature_1"]) == {}
+    assert cache.size() == 0
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(tmp_path / "cache.sqlite", max_size_mb=1, operation_keys=["op"])
+    big_value = {"values": b"x" * 400_000}
+
+    cache.store({("old", "op"): big_value})
+    cache.store({("used", "op"): big_value})
+    cache.lookup(["old"])  # "old" becomes recently used
+    cache.store({("new", "op"): big_value})
+
+    assert set(cache.lookup(["old", "used", "new"])) == {("old", "op"), ("new", "op")}
+    assert cache.size() <= 1024 * 1024
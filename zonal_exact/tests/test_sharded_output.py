@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+from qgis.core import QgsVectorFileWriter, QgsVectorLayer, QgsWkbTypes
+
+from zonal_exact.sharded_output import ShardedOutput
+
+
+def test_tabular_shards_united(tmp_path, batch_results):
+    results = batch_results
+    sharded_output = ShardedOutput(
+        tmp_path / "output.csv", False, None, prefix="zonal_", source_columns={"id": 0}
+    )
+    sharded_output.prepare()
+    first_writer = sharded_output.create_writer()
+    second_writer = sharded_output.create_writer()
+    # shard without batches is left out of the union
+    sharded_output.create_writer()
+
+    first_writer.append(results[0])
+    first_writer.append(results[1])
+    second_writer.append(results[2])
+    union_path = sharded_output.finish()
+
+    assert union_path == tmp_path / "output.vrt"
+    assert sharded_output.batches_count == 3
+    assert sharded_output.shard_paths() == [
+        tmp_path / "output_shards" / "shard_0.csv",
+        tmp_path / "output_shards" / "shard_1.csv",
+    ]
+    output_layer = QgsVectorLayer(str(union_path), "output", "ogr")
+    assert output_layer.isValid()
+    assert output_layer.featureCount() == 9
+    assert output_layer.fields().names() == ["id", "zonal_mean"]
+    # types of columns are read from .csvt files
+    assert output_layer.fields().field("zonal_mean").isNumeric()
+    assert sorted(feature["id"] for feature in output_layer.getFeatures()) == sorted(
+        pd.concat(results)["id"].tolist()
+    )
+
+
+def test_parquet_shards_written_in_row_groups(tmp_path, batch_results):
+    pq = pytest.importorskip("pyarrow.parquet")
+    results = batch_results
+    sharded_output = ShardedOutput(
+        tmp_path / "output.parquet",
+        False,
+        None,
+        prefix="zonal_",
+        source_columns={"id": 0},
+    )
+    sharded_output.prepare()
+    writer = sharded_output.create_writer()
+
+    for result in results:
+        writer.append(result)
+    sharded_output.finish()
+
+    shard = pq.ParquetFile(sharded_output.shard_paths()[0])
+    assert shard.metadata.num_row_groups == 3
+    assert shard.schema_arrow.names == ["id", "zonal_mean"]
+    if "parquet" in QgsVectorFileWriter.supportedFormatExtensions():
+        output_layer = QgsVectorLayer(str(sharded_output.union_path), "output", "ogr")
+        assert output_layer.featureCount() == 9
+
+
+def test_geospatial_shards_united(tmp_path, setup_layers):
+    vector_layer, _ = setup_layers
+    sharded_output = ShardedOutput(
+        tmp_path / "output.gpkg", True, vector_layer.crs(), prefix="zonal_"
+    )
+    sharded_output.prepare()
+
+    sharded_output.create_writer().append(vector_layer)
+    sharded_output.create_writer().append(vector_layer)
+    union_path = sharded_output.finish()
+
+    output_layer = QgsVectorLayer(str(union_path), "output", "ogr")
+    assert output_layer.isValid()
+    assert output_layer.featureCount() == 2 * vector_layer.featureCount()
+    assert output_layer.fields().names() == ["zonal_id"]
+    assert output_layer.geometryType() == QgsWkbTypes.PolygonGeometry
+
+
+def test_discard_keeps_finished_shards(tmp_path, batch_results):
+    canceled_output = ShardedOutput(tmp_path / "canceled.csv", False, None)
+    canceled_output.prepare()
+    canceled_output.create_writer().append(batch_results[0])
+    canceled_output.discard()
+    assert not canceled_output.shards_dir.exists()
+
+    finished_output = ShardedOutput(tmp_path / "finished.csv", False, None)
+    finished_output.prepare()
+    finished_output.create_writer().append(batch_results[0])
+    finished_output.finish()
+    finished_output.discard()
+    assert finished_output.shard_paths()[0].exists()
@@ -0,0 +1,240 @@
+from osgeo import gdal, osr
+from qgis.core import QgsCoordinateReferenceSystem
+
+from zonal_exact.partitioning import CHUNKS_PER_SUBTASK, FeatureInfo
+from zonal_exact.tuning import (
+    CHUNK_CELL_BYTES,
+    FEATURE_SEQUENTIAL,
+    MIN_CELLS_IN_MEMORY,
+    MIN_SUBTASK_CACHE_BYTES,
+    RASTER_SEQUENTIAL,
+    RASTER_SEQUENTIAL_MEMORY_LIMIT,
+    RasterLayout,
+    calibration_sample,
+    choose_parallelism,
+    choose_strategy,
+    count_block_reads,
+    estimate_batch_memory,
+    plan_memory,
+    raster_sequential_limit,
+    read_raster_layout,
+    resolve_strategy,
+)
+
+MEGABYTE = 1024 * 1024
+
+# 1000 x 1000 raster with 100 x 100 compressed blocks and origin at (0, 1000)
+COMPRESSED_LAYOUT = RasterLayout(
+    1000,
+    1000,
+    100,
+    100,
+    geotransform=(0.0, 1.0, 0.0, 1000.0, 0.0, -1.0),
+    compression="DEFLATE",
+)
+
+
+def overlapping_features(count, vertices=10):
+    return [FeatureInfo(fid, 50, 50, 250, 250, vertices) for fid in range(count)]
+
+
+def test_read_raster_layout(setup_layers):
+    _, raster_layer = setup_layers
+
+    layout = read_raster_layout(raster_layer.dataProvider().dataSourceUri())
+
+    assert (layout.width, layout.height) == (6, 6)
+    assert layout.cells_count == 36
+
+
+def test_calibration_sample():
+    feature_ids = list(range(100))
+
+    assert calibration_sample(feature_ids, 10) == list(range(0, 100, 10))
+    assert calibration_sample(feature_ids[:5], 10) == feature_ids[:5]
+
+
+def test_choose_parallelism_short_calculation():
+    costs = {fid: 1.0 for fid in range(1000)}
+
+    decision = choose_parallelism(
+        features_count=1000,
+        costs=costs,
+        sample_cost=50.0,
+        sample_seconds=0.01,
+        raster_layouts=[RasterLayout(100, 100, 100, 1)],
+        max_threads=8,
+    )
+
+    assert decision.subtasks_count == 1
+    assert decision.batch_size == 1000
+    assert len(decision.reasons) > 0
+
+
+def test_choose_parallelism_long_calculation():
+    costs = {fid: 1000.0 for fid in range(100_000)}
+
+    decision = choose_parallelism(
+        features_count=100_000,
+        costs=costs,
+        sample_cost=50_000.0,
+        sample_seconds=1.0,
+        raster_layouts=[RasterLayout(10_000, 10_000, 256, 256)],
+        max_threads=4,
+    )
+
+    # about 2000 s of work is limited by available threads
+    assert decision.subtasks_count == 4
+    assert decision.batch_size == 100_000 // (4 * CHUNKS_PER_SUBTASK)
+
+
+def test_count_block_reads():
+    features = overlapping_features(5) + [
+        FeatureInfo(5, float("nan"), float("nan"), float("nan"), float("nan"), 0),
+        FeatureInfo(6, -500, -500, -400, -400, 4),
+    ]
+
+    # every feature reads 3 x 3 blocks, features outside the raster read nothing
+    assert count_block_reads(features, COMPRESSED_LAYOUT) == (45, 9)
+
+
+def test_choose_strategy_repeated_reads():
+    decision = choose_strategy(
+        overlapping_features(5),
+        [COMPRESSED_LAYOUT],
+        operations_count=2,
+        array_operations=False,
+        cache_bytes=0,
+    )
+
+    assert decision.strategy == RASTER_SEQUENTIAL
+    assert "36 of them repeatedly" in decision.reason
+
+
+def test_choose_strategy_feature_sequential():
+    def strategy(features, cache_bytes=0):
+        return choose_strategy(
+            features,
+            [COMPRESSED_LAYOUT],
+            operations_count=2,
+            array_operations=False,
+            cache_bytes=cache_bytes,
+        ).strategy
+
+    # blocks are read once
+    assert strategy(overlapping_features(1)) == FEATURE_SEQUENTIAL
+    # repeated reads are served from GDAL cache
+    assert strategy(overlapping_features(5), cache_bytes=10**9) == FEATURE_SEQUENTIAL
+    # polygons with too many vertices to be kept in memory
+    huge_features = overlapping_features(
+        2, vertices=RASTER_SEQUENTIAL_MEMORY_LIMIT // 16
+    )
+    assert strategy(huge_features) == FEATURE_SEQUENTIAL
+    # rasters unreadable by GDAL
+    assert choose_strategy(overlapping_features(5), [], 1, False, 0).strategy == (
+        FEATURE_SEQUENTIAL
+    )
+
+
+def write_tiled_raster(path, epsg=None):
+    # 1024 x 1024 cells of 1 km in 256 x 256 blocks, covering 0 - 1024 km in both axes
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        str(path),
+        1024,
+        1024,
+        1,
+        options=["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"],
+    )
+    dataset.SetGeoTransform([0, 1000, 0, 1_024_000, 0, -1000])
+    if epsg is not None:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        dataset.SetProjection(srs.ExportToWkt())
+    dataset = None
+    return str(path)
+
+
+def test_block_reads_of_features_in_other_crs(tmp_path):
+    layout = read_raster_layout(
+        write_tiled_raster(tmp_path / "mercator.tif", 3857),
+        QgsCoordinateReferenceSystem("EPSG:4326"),
+    )
+    # 1 x 1 degree box, about 223 - 334 km from the origin in both axes of the raster
+    features = [FeatureInfo(1, 2, 2, 3, 3, 4)]
+
+    # the box crosses block boundaries at 256 km, in degrees it would stay in a single block
+    assert count_block_reads(features, layout) == (4, 4)
+
+
+def test_choose_strategy_for_raster_without_crs(tmp_path):
+    layout = read_raster_layout(
+        write_tiled_raster(tmp_path / "unknown.tif"),
+        QgsCoordinateReferenceSystem("EPSG:4326"),
+    )
+
+    decision = choose_strategy(
+        overlapping_features(5),
+        [layout],
+        operations_count=2,
+        array_operations=False,
+        cache_bytes=0,
+    )
+
+    assert not layout.comparable
+    assert decision.strategy == FEATURE_SEQUENTIAL
+    assert "can't be transformed" in decision.reason
+
+
+def test_resolve_strategy():
+    assert resolve_strategy("auto") == FEATURE_SEQUENTIAL
+    assert resolve_strategy(RASTER_SEQUENTIAL) == RASTER_SEQUENTIAL
+
+
+def test_plan_memory_limits_subtasks():
+    plan = plan_memory(256 * MEGABYTE, subtasks_count=8, batch_memory=40 * MEGABYTE)
+
+    # every subtask needs 40 MB of polygons, 8 MB chunk and 16 MB cache at least
+    assert plan.subtasks_count == 4
+    assert plan.max_cells_in_memory == MIN_CELLS_IN_MEMORY
+    assert plan.cache_bytes == 4 * MIN_SUBTASK_CACHE_BYTES
+    assert "only 4 of 8 subtasks" in plan.reasons[0]
+
+
+def test_plan_memory_splits_free_memory():
+    plan = plan_memory(256 * MEGABYTE, subtasks_count=2, batch_memory=40 * MEGABYTE)
+
+    # 64 MB left to every subtask over the minimum is split between the chunk and the cache
+    assert plan.subtasks_count == 2
+    assert (
+        plan.max_cells_in_memory
+        == MIN_CELLS_IN_MEMORY + 32 * MEGABYTE // CHUNK_CELL_BYTES
+    )
+    assert plan.cache_bytes == 2 * (MIN_SUBTASK_CACHE_BYTES + 32 * MEGABYTE)
+
+
+def test_plan_memory_small_budget():
+    plan = plan_memory(8 * MEGABYTE, subtasks_count=2, batch_memory=0)
+
+    assert plan.subtasks_count == 1
+    assert plan.max_cells_in_memory == MIN_CELLS_IN_MEMORY
+    assert plan.cache_bytes == MIN_SUBTASK_CACHE_BYTES
+    assert any("more than the budget" in reason for reason in plan.reasons)
+
+
+def test_raster_sequential_limit():
+    minimal_buffers = MIN_CELLS_IN_MEMORY * CHUNK_CELL_BYTES + MIN_SUBTASK_CACHE_BYTES
+
+    assert raster_sequential_limit(0, 4) == RASTER_SEQUENTIAL_MEMORY_LIMIT
+    assert (
+        raster_sequential_limit(400 * MEGABYTE, 4) == 100 * MEGABYTE - minimal_buffers
+    )
+
+
+def test_estimate_batch_memory():
+    features = overlapping_features(5, vertices=100)
+
+    def memory(strategy):
+        return estimate_batch_memory(features, strategy, [COMPRESSED_LAYOUT], 1, False)
+
+    # feature-sequential strategy keeps a single polygon in memory
+    assert memory(RASTER_SEQUENTIAL) == 5 * memory(FEATURE_SEQUENTIAL)
@@ -1,4 +1,4 @@
-from zonal_exact.utils import extract_function_name
+from zonal_exact.utils import create_custom_function, extract_function_name
 
 
 def test_extract_function_name():
@@ -26,3 +26,14 @@ def test_extract_function_name():
     custom_function_str = "def my_function():  # This is a function"
     expected_result = "my_function"
     assert extract_function_name(custom_function_str) == expected_result
+
+
+def test_create_custom_function():
+    custom_function_str = (
+        "import math\n\ndef my_function(values, cov):\n    return math.fsum(values)\n"
+    )
+
+    custom_function = create_custom_function(custom_function_str)
+
+    assert custom_function.__name__ == "my_function"
+    assert custom_function([1, 2], [1, 1]) == 3
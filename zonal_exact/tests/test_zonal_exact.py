@@ -7,3 +7,13 @@ def test_plugin_init(qgis_iface):
     plugin.initGui(add_to_menu=False)
 
     assert plugin.first_start is True
+
+
+def test_plugin_unload_stops_workers(qgis_iface):
+    plugin = ZonalExact(qgis_iface)
+    plugin.initGui(add_to_menu=False)
+    plugin.process_backend.start()
+
+    plugin.unload()
+
+    assert not plugin.process_backend.running
@@ -6,6 +6,7 @@ import pandas as pd
 
 from qgis.core import (
     QgsProject,
+    QgsTask,
     QgsFeature,
     QgsGeometry,
     QgsVectorLayer,
@@ -16,6 +17,7 @@ from qgis.PyQt.QtWidgets import QPlainTextEdit
 from zonal_exact.zonal_exact_dialog import ZonalExactDialog
 from zonal_exact.user_communication import UserCommunication, WidgetPlainTextWriter
 from zonal_exact.dialog_input_dto import DialogInputDTO
+from zonal_exact.task_classes import FeatureSubsetSource, PlanBatchesTask
 
 
 @pytest.fixture
@@ -31,6 +33,25 @@ def dialog(qgis_iface, qgis_app):
     # dialog.close()
 
 
+def start_planned_calculations(dialog, vector_layer) -> PlanBatchesTask:
+    # plan batches in the test thread, then start subtasks the way the finished planning task does
+    dialog.input_vector = vector_layer
+    dialog.plan_task = PlanBatchesTask(
+        "Planning batches",
+        QgsTask.CanCancel,
+        feature_source=FeatureSubsetSource.from_layer(
+            vector_layer, list(dialog.input_attributes_dict.keys())
+        ),
+        features_count=vector_layer.featureCount(),
+        rasters=dialog.dialog_input.raster_layers_path,
+        parallel_jobs=dialog.dialog_input.parallel_jobs,
+    )
+    plan_task = dialog.plan_task
+    assert plan_task.run()
+    dialog.start_calculations()
+    return plan_task
+
+
 def test_dialog_creation(dialog):
     # Test if the dialog is created successfully
     assert isinstance(dialog, ZonalExactDialog)
@@ -206,8 +227,9 @@ def test_control_input_missing_stats_lists(dialog, setup_layers):
         )
 
 
-def test_control_input_invalid_output_format_with_array_stats(dialog, setup_layers):
-    # Test if the control_input method raises an exception when using invalid output format with array stats
+def test_control_input_parquet_output_with_array_stats(dialog, setup_layers):
+    # Test if the control_input method accepts tabular Parquet output, arrays are written as list columns
+    pytest.importorskip("pyarrow")
     vector_layer, _ = setup_layers
 
     raster_layers_path = "/path/to/raster"
@@ -216,13 +238,32 @@ def test_control_input_invalid_output_format_with_array_stats(dialog, setup_laye
     aggregates_stats_list = []
     arrays_stats_list = ["mean", "std"]
 
-    with pytest.raises(ValueError):
+    dialog.control_input(
+        raster_layers_path,
+        vector_layer,
+        output_file_path,
+        aggregates_stats_list,
+        arrays_stats_list,
+    )
+
+    assert dialog.geospatial_output is False
+
+
+def test_control_input_geoparquet_with_incremental_update(dialog, setup_layers):
+    # Test if the control_input method raises an exception when GeoParquet output is updated incrementally
+    vector_layer, _ = setup_layers
+
+    dialog.temp_index_field = "id"
+
+    with pytest.raises(ValueError, match="GeoParquet output can't be edited"):
         dialog.control_input(
-            raster_layers_path,
+            "/path/to/raster",
             vector_layer,
-            output_file_path,
-            aggregates_stats_list,
-            arrays_stats_list,
+            Path("/path/to/output.parquet"),
+            ["mean"],
+            [],
+            incremental=True,
+            geoparquet=True,
         )
 
 
@@ -256,6 +297,63 @@ def test_control_input_non_unique_id_column(dialog, setup_layers):
         )
 
 
+def test_control_input_sharded_output_with_incremental_update(dialog, setup_layers):
+    # Test if the control_input method raises an exception when sharded output is updated incrementally
+    vector_layer, _ = setup_layers
+
+    dialog.temp_index_field = "id"
+
+    with pytest.raises(
+        ValueError, match="Incremental update can't be used with sharded output"
+    ):
+        dialog.control_input(
+            "/path/to/raster",
+            vector_layer,
+            Path("/path/to/output.csv"),
+            ["mean"],
+            [],
+            incremental=True,
+            sharded_output=True,
+        )
+
+
+def test_control_input_sharded_output_vrt_extension(dialog, setup_layers):
+    # Test if the control_input method raises an exception when format of shards is not selected
+    vector_layer, _ = setup_layers
+
+    dialog.temp_index_field = "id"
+
+    with pytest.raises(ValueError, match="Sharded output is united by a .vrt"):
+        dialog.control_input(
+            "/path/to/raster",
+            vector_layer,
+            Path("/path/to/output.vrt"),
+            ["mean"],
+            [],
+            sharded_output=True,
+        )
+
+
+def test_control_input_compressed_csv_with_incremental_update(dialog, setup_layers):
+    # Test if the control_input method raises an exception when compressed CSV output is updated incrementally
+    vector_layer, _ = setup_layers
+
+    dialog.temp_index_field = "id"
+
+    with pytest.raises(
+        ValueError, match="Compressed CSV output can't be updated incrementally"
+    ):
+        dialog.control_input(
+            "/path/to/raster",
+            vector_layer,
+            Path("/path/to/output.csv"),
+            ["mean"],
+            [],
+            incremental=True,
+            csv_compression="gzip",
+        )
+
+
 def test_extract_layers_path(dialog, setup_layers):
     # Test if the extract_layers_path method returns the correct path
     vector_layer, raster_layer = setup_layers
@@ -272,7 +370,7 @@ def test_extract_layers_path(dialog, setup_layers):
 
 
 def test_process_calculations_single_task(tmp_path, dialog, setup_layers):
-    # Test if the process_calculations method processes the calculations correctly
+    # Test if the planned batches are calculated correctly
     vector_layer, raster_layer = setup_layers
 
     raster_layers_path = dialog.extract_layers_path([raster_layer])
@@ -295,7 +393,7 @@ def test_process_calculations_single_task(tmp_path, dialog, setup_layers):
     dialog.widget_console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
     dialog.features_count = vector_layer.featureCount()
 
-    dialog.process_calculations(vector_layer, dialog.features_count)
+    plan_task = start_planned_calculations(dialog, vector_layer)
 
     # manually run merge task as pytest is unable to detect that CalculateStatsTask is finished
     # wait up to 5 seconds to let the task finish
@@ -303,18 +401,23 @@ def test_process_calculations_single_task(tmp_path, dialog, setup_layers):
     wait_interval = 0.5  # Wait interval in seconds
 
     elapsed_time = 0
-    calculation_task = dialog.tasks[0]
-    while not calculation_task.completed_succesfully:
+    # subtasks pull batches from shared queue, so all of them have to finish
+    while not all(task.completed_succesfully for task in dialog.tasks):
         time.sleep(wait_interval)
         elapsed_time += wait_interval
         if elapsed_time >= max_wait_time:
             raise TimeoutError("Maximum wait time exceeded")
     dialog.merge_task.run()
-    calculated_stats = dialog.merge_task.calculated_stats.sort_values(
+    # statistics are streamed to the output file, they're not kept by the merge task
+    assert dialog.merge_task.calculated_stats is None
+    assert dialog.merge_task.result_shape == (12, 3)
+    calculated_stats = pd.read_csv(dialog.dialog_input.output_file_path).sort_values(
         by="id", ascending=True
     )
 
-    assert len(dialog.intermediate_result_list) == 1  # Only one task was run
+    # a single subtask calculates all features in one batch
+    assert len(plan_task.batches) == 1
+    assert len(dialog.intermediate_result_list) == 1
     assert list(calculated_stats.columns) == [
         "id",
         "prefixpytest_raster_band_1_mean",
@@ -376,7 +479,7 @@ def test_process_calculations_single_task(tmp_path, dialog, setup_layers):
 
 
 def test_process_calculations_multiple_tasks(tmp_path, dialog, setup_layers):
-    # Test if the process_calculations method processes the calculations correctly
+    # Test if the planned batches are calculated correctly
     vector_layer, raster_layer = setup_layers
 
     raster_layers_path = dialog.extract_layers_path([raster_layer])
@@ -399,7 +502,7 @@ def test_process_calculations_multiple_tasks(tmp_path, dialog, setup_layers):
     dialog.widget_console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
     dialog.features_count = vector_layer.featureCount()
 
-    dialog.process_calculations(vector_layer, 4)
+    plan_task = start_planned_calculations(dialog, vector_layer)
 
     # manually run merge task as pytest is unable to detect that CalculateStatsTask is finished
     # wait up to 5 seconds to let the task finish
@@ -407,18 +510,18 @@ def test_process_calculations_multiple_tasks(tmp_path, dialog, setup_layers):
     wait_interval = 0.5  # Wait interval in seconds
 
     elapsed_time = 0
-    calculation_task = dialog.tasks[0]
-    while not calculation_task.completed_succesfully:
+    # subtasks pull batches from shared queue, so all of them have to finish
+    while not all(task.completed_succesfully for task in dialog.tasks):
         time.sleep(wait_interval)
         elapsed_time += wait_interval
         if elapsed_time >= max_wait_time:
             raise TimeoutError("Maximum wait time exceeded")
     dialog.merge_task.run()
-    calculated_stats = dialog.merge_task.calculated_stats
+    calculated_stats = pd.read_csv(dialog.dialog_input.output_file_path)
 
-    assert (
-        len(dialog.intermediate_result_list) == 3
-    )  # Three tasks were run - 12 / 4 = 3
+    # 3 subtasks ask for 24 batches, so 12 features are cut into 12 batches of a single feature
+    assert len(plan_task.batches) == 12
+    assert len(dialog.intermediate_result_list) == 12
     assert list(calculated_stats.columns) == [
         "id",
         "prefixpytest_raster_band_1_mean",
@@ -470,7 +573,7 @@ def test_process_calculations_multiple_tasks(tmp_path, dialog, setup_layers):
 def test_process_calculations_geospatial_output_created(
     tmp_path, dialog, setup_layers, qgis_processing
 ):
-    # Test if the process_calculations method processes the calculations correctly
+    # Test if the planned batches are calculated correctly
     vector_layer, raster_layer = setup_layers
 
     raster_layers_path = dialog.extract_layers_path([raster_layer])
@@ -501,7 +604,7 @@ def test_process_calculations_geospatial_output_created(
     dialog.widget_console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
     dialog.features_count = vector_layer.featureCount()
 
-    dialog.process_calculations(vector_layer, dialog.features_count)
+    start_planned_calculations(dialog, vector_layer)
 
     # manually run merge task as pytest is unable to detect that CalculateStatsTask is finished
     # wait up to 5 seconds to let the task finish
@@ -509,8 +612,8 @@ def test_process_calculations_geospatial_output_created(
     wait_interval = 0.5  # Wait interval in seconds
 
     elapsed_time = 0
-    calculation_task = dialog.tasks[0]
-    while not calculation_task.completed_succesfully:
+    # subtasks pull batches from shared queue, so all of them have to finish
+    while not all(task.completed_succesfully for task in dialog.tasks):
         time.sleep(wait_interval)
         elapsed_time += wait_interval
         if elapsed_time >= max_wait_time:
@@ -524,7 +627,7 @@ def test_process_calculations_geospatial_output_created(
 def test_process_calculations_geospatial_output_contents(
     tmp_path, dialog, setup_layers, qgis_processing
 ):
-    # Test if the process_calculations method processes the calculations correctly
+    # Test if the planned batches are calculated correctly
     vector_layer, raster_layer = setup_layers
 
     raster_layers_path = dialog.extract_layers_path([raster_layer])
@@ -556,7 +659,7 @@ def test_process_calculations_geospatial_output_contents(
     dialog.widget_console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
     dialog.features_count = vector_layer.featureCount()
 
-    dialog.process_calculations(vector_layer, dialog.features_count)
+    start_planned_calculations(dialog, vector_layer)
 
     # manually run merge task as pytest is unable to detect that CalculateStatsTask is finished
     # wait up to 5 seconds to let the task finish
@@ -564,8 +667,8 @@ def test_process_calculations_geospatial_output_contents(
     wait_interval = 0.5  # Wait interval in seconds
 
     elapsed_time = 0
-    calculation_task = dialog.tasks[0]
-    while not calculation_task.completed_succesfully:
+    # subtasks pull batches from shared queue, so all of them have to finish
+    while not all(task.completed_succesfully for task in dialog.tasks):
         time.sleep(wait_interval)
         elapsed_time += wait_interval
         if elapsed_time >= max_wait_time:
@@ -580,14 +683,13 @@ def test_process_calculations_geospatial_output_contents(
 
     assert output_geospatial_layer.name() == "output_single_task"
     assert output_geospatial_layer.featureCount() == 12
-    assert output_geospatial_layer.fields().count() == 6
+    # results are written straight to the output, without columns added by merging layers
+    assert output_geospatial_layer.fields().count() == 4
     assert output_geospatial_layer.fields().names() == [
         "fid",
         "id",
         "prefixpytest_raster_band_1_mean",
         "prefixpytest_raster_band_2_mean",
-        "layer",
-        "path",
     ]
 
     request = QgsFeatureRequest()
@@ -596,20 +698,82 @@ def test_process_calculations_geospatial_output_contents(
     for f in output_geospatial_layer.getSelectedFeatures(request):
         print(f["City"])
 
-    assert next(features).attributes()[1:5] == [0, None, None, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [1, 6.0, 8.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [2, 5.0, 7.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [3, 4.0, 6.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [4, 3.0, 5.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [5, 2.0, 4.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [11, 9.0, 11.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [12, 8.0, 10.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [13, 7.0, 9.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [14, 6.0, 8.0, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [15, None, None, "temporary_layer"]
-    assert next(features).attributes()[1:5] == [
+    assert next(features).attributes()[1:4] == [0, None, None]
+    assert next(features).attributes()[1:4] == [1, 6.0, 8.0]
+    assert next(features).attributes()[1:4] == [2, 5.0, 7.0]
+    assert next(features).attributes()[1:4] == [3, 4.0, 6.0]
+    assert next(features).attributes()[1:4] == [4, 3.0, 5.0]
+    assert next(features).attributes()[1:4] == [5, 2.0, 4.0]
+    assert next(features).attributes()[1:4] == [11, 9.0, 11.0]
+    assert next(features).attributes()[1:4] == [12, 8.0, 10.0]
+    assert next(features).attributes()[1:4] == [13, 7.0, 9.0]
+    assert next(features).attributes()[1:4] == [14, 6.0, 8.0]
+    assert next(features).attributes()[1:4] == [15, None, None]
+    assert next(features).attributes()[1:4] == [
         20,
         pytest.approx(6.46),
         pytest.approx(8.46),
-        "temporary_layer",
+    ]
+
+
+def test_process_calculations_sharded_output(tmp_path, dialog, setup_layers):
+    # Test if subtasks write shards united by the virtual layer
+    vector_layer, raster_layer = setup_layers
+
+    raster_layers_path = dialog.extract_layers_path([raster_layer])
+    output_file_path = Path(tmp_path / "output_sharded.csv")
+
+    dialog.dialog_input = DialogInputDTO(
+        raster_layers_path=raster_layers_path,
+        weights_layer_path=None,
+        vector_layer=vector_layer,
+        parallel_jobs=3,
+        output_file_path=output_file_path,
+        aggregates_stats_list=["mean"],
+        arrays_stats_list=[],
+        prefix="prefix_",
+        custom_functions_str_list=[],
+        strategy="feature-sequential",
+        sharded_output=True,
+    )
+
+    dialog.temp_index_field = "id"
+    dialog.control_input(
+        raster_layers_path,
+        vector_layer,
+        dialog.dialog_input.output_file_path,
+        dialog.dialog_input.aggregates_stats_list,
+        dialog.dialog_input.arrays_stats_list,
+        sharded_output=True,
+    )
+    dialog.widget_console = WidgetPlainTextWriter(plain_text_widget=QPlainTextEdit())
+
+    start_planned_calculations(dialog, vector_layer)
+
+    # manually run merge task as pytest is unable to detect that CalculateStatsTask is finished
+    max_wait_time = 5  # Maximum wait time in seconds
+    wait_interval = 0.5  # Wait interval in seconds
+
+    elapsed_time = 0
+    while not all(task.completed_succesfully for task in dialog.tasks):
+        time.sleep(wait_interval)
+        elapsed_time += wait_interval
+        if elapsed_time >= max_wait_time:
+            raise TimeoutError("Maximum wait time exceeded")
+    dialog.merge_task.run()
+
+    # results are not merged into the output file, shards are united by the virtual layer
+    assert not output_file_path.exists()
+    # every subtask writes its shard if it took at least one of the batches
+    shards = list((tmp_path / "output_sharded_shards").glob("shard_*.csv"))
+    assert 1 <= len(shards) <= 3
+    output_layer = QgsVectorLayer(
+        str(tmp_path / "output_sharded.vrt"), "output_sharded", "ogr"
+    )
+    assert output_layer.isValid()
+    assert output_layer.featureCount() == vector_layer.featureCount()
+    assert output_layer.fields().names() == [
+        "id",
+        "prefix_pytest_raster_band_1_mean",
+        "prefix_pytest_raster_band_2_mean",
     ]
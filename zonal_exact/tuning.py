@@ -0,0 +1,615 @@
+"""
+Automatic selection of the number of subtasks, the size of batches and the exactextract strategy
+used in calculation.
+"""
+
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from osgeo import gdal
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+)
+
+from .partitioning import (
+    CHUNKS_PER_SUBTASK,
+    FeatureInfo,
+    features_transform,
+    transform_feature_info,
+)
+from .utils import source_file_path
+
+# number of features used in calibration run
+CALIBRATION_SAMPLE_SIZE = 50
+# estimated calculation time below which subtasks are not worth their start-up overhead
+MIN_PARALLEL_SECONDS = 5.0
+# minimal estimated calculation time of a single subtask
+MIN_SUBTASK_SECONDS = 2.0
+
+AUTO_STRATEGY = "auto"
+FEATURE_SEQUENTIAL = "feature-sequential"
+RASTER_SEQUENTIAL = "raster-sequential"
+# memory raster-sequential strategy may use for polygons and statistics of a single batch
+RASTER_SEQUENTIAL_MEMORY_LIMIT = 256 * 1024 * 1024
+# approximate memory used by a vertex of a polygon and by a single statistic of a polygon and band
+VERTEX_BYTES = 16
+STATISTIC_BYTES = 64
+# repeated read of a compressed or remote block is more expensive than a read of a plain block
+EXPENSIVE_READ_COST = 4.0
+# GDAL virtual file systems reading through network
+REMOTE_PREFIXES = ("/vsicurl", "/vsis3", "/vsigs", "/vsiaz", "/vsiadls", "/vsioss")
+# default number of raster cells exactextract reads at once
+DEFAULT_MAX_CELLS_IN_MEMORY = 30_000_000
+# exactextract reads raster cells as doubles
+CHUNK_CELL_BYTES = 8
+# smallest raster chunk and GDAL block cache a subtask gets under a memory budget
+MIN_CELLS_IN_MEMORY = 1024 * 1024
+MIN_SUBTASK_CACHE_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class RasterLayout:
+    """
+    Size and block structure of the raster.
+    """
+
+    width: int
+    height: int
+    block_width: int
+    block_height: int
+    geotransform: Tuple[float, ...] = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+    bands_count: int = 1
+    cell_bytes: int = 8
+    # compression of blocks, None if they're not compressed
+    compression: Optional[str] = None
+    # blocks are read through network (GDAL /vsicurl/ and similar virtual file systems)
+    remote: bool = False
+    # transformation of bounding boxes of features to CRS of the raster, None if CRSs are the same
+    transform: Optional[QgsCoordinateTransform] = None
+    # whether bounding boxes of features can be compared with blocks, False if CRSs differ without a transformation
+    comparable: bool = True
+
+    @property
+    def cells_count(self) -> int:
+        return self.width * self.height
+
+    @property
+    def block_cells_count(self) -> int:
+        return self.block_width * self.block_height
+
+    @property
+    def block_bytes(self) -> int:
+        """
+        Size of the uncompressed block of all bands.
+        """
+        return self.block_cells_count * self.cell_bytes * self.bands_count
+
+    @property
+    def expensive_reads(self) -> bool:
+        return self.compression is not None or self.remote
+
+    def raster_features(self, features_info: List[FeatureInfo]) -> List[FeatureInfo]:
+        """
+        Args:
+            features_info (List[FeatureInfo]): features with bounding boxes in CRS of features.
+
+        Returns:
+            List[FeatureInfo]: features with bounding boxes in CRS of the raster.
+        """
+        if self.transform is None:
+            return features_info
+        return [transform_feature_info(info, self.transform) for info in features_info]
+
+    def block_span(
+        self, xmin: float, ymin: float, xmax: float, ymax: float
+    ) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Finds raster blocks intersecting the bounding box in CRS of the raster.
+
+        Args:
+            xmin (float): minimal x of the bounding box.
+            ymin (float): minimal y of the bounding box.
+            xmax (float): maximal x of the bounding box.
+            ymax (float): maximal y of the bounding box.
+
+        Returns:
+            Optional[Tuple[int, int, int, int]]: first and last block column and first and last block row
+                or None if the bounding box is outside of the raster.
+        """
+        x_origin, pixel_width, _, y_origin, _, pixel_height = self.geotransform
+        columns = sorted(
+            math.floor((x - x_origin) / (pixel_width * self.block_width))
+            for x in (xmin, xmax)
+        )
+        rows = sorted(
+            math.floor((y - y_origin) / (pixel_height * self.block_height))
+            for y in (ymin, ymax)
+        )
+        blocks_x = math.ceil(self.width / self.block_width)
+        blocks_y = math.ceil(self.height / self.block_height)
+        first_column, last_column = max(0, columns[0]), min(blocks_x - 1, columns[1])
+        first_row, last_row = max(0, rows[0]), min(blocks_y - 1, rows[1])
+        if first_column > last_column or first_row > last_row:
+            return None
+        return first_column, last_column, first_row, last_row
+
+
+@dataclass
+class TuningDecision:
+    """
+    Number of subtasks and batch size chosen by `choose_parallelism` with the reasoning behind them.
+    """
+
+    subtasks_count: int
+    batch_size: int
+    reasons: List[str] = field(default_factory=list)
+
+
+@dataclass
+class StrategyDecision:
+    """
+    exactextract strategy chosen by `choose_strategy` for a batch with the reason.
+    """
+
+    strategy: str
+    reason: str
+
+
+@dataclass
+class MemoryPlan:
+    """
+    Division of the memory budget between subtasks chosen by `plan_memory` with the reasoning behind it.
+
+    Attributes:
+        subtasks_count (int): number of subtasks running at the same time.
+        max_cells_in_memory (int): number of raster cells exactextract reads at once in every subtask.
+        cache_bytes (int): size of GDAL block cache shared by all subtasks.
+    """
+
+    subtasks_count: int
+    max_cells_in_memory: int
+    cache_bytes: int
+    reasons: List[str] = field(default_factory=list)
+
+
+def read_raster_layout(
+    raster_path: str, crs: QgsCoordinateReferenceSystem = None
+) -> Optional[RasterLayout]:
+    """
+    Reads raster size, geotransform, compression and block size and data type of the first band. Finds
+    the transformation of features to CRS of the raster.
+
+    Args:
+        raster_path (str): path to the raster.
+        crs (QgsCoordinateReferenceSystem): CRS of features, the raster is considered to be in it if not given.
+
+    Returns:
+        Optional[RasterLayout]: layout of the raster or None if raster can't be opened by GDAL.
+    """
+    dataset = gdal.Open(raster_path)
+    if dataset is None or dataset.RasterCount == 0:
+        return None
+    band = dataset.GetRasterBand(1)
+    block_width, block_height = band.GetBlockSize()
+    compression = dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE")
+    source_path = source_file_path(raster_path)
+    comparable, transform = features_transform(crs, raster_path)
+    return RasterLayout(
+        dataset.RasterXSize,
+        dataset.RasterYSize,
+        block_width,
+        block_height,
+        geotransform=tuple(dataset.GetGeoTransform()),
+        bands_count=dataset.RasterCount,
+        cell_bytes=max(1, gdal.GetDataTypeSize(band.DataType) // 8),
+        compression=compression if compression not in (None, "NONE") else None,
+        remote=source_path.startswith(REMOTE_PREFIXES),
+        transform=transform,
+        comparable=comparable,
+    )
+
+
+def resolve_strategy(strategy: str) -> str:
+    """
+    Args:
+        strategy (str): strategy selected by user.
+
+    Returns:
+        str: exactextract strategy used when it's not chosen for a batch, "auto" falls back to feature-sequential.
+    """
+    return FEATURE_SEQUENTIAL if strategy == AUTO_STRATEGY else strategy
+
+
+def available_threads() -> int:
+    """
+    Returns:
+        int: number of threads QGIS is allowed to use (`Max Threads` option in QGIS settings).
+    """
+    max_threads = QgsApplication.maxThreads()
+    if max_threads < 1:
+        max_threads = os.cpu_count() or 1
+    return max_threads
+
+
+def calibrate(sample, calculate: Callable[[object], object]) -> float:
+    """
+    Measures the time of calculation of statistics for a sample of features.
+
+    Args:
+        sample: sample features, e.g. `FeatureSubsetSource` with sample feature ids.
+        calculate (Callable[[object], object]): function calculating statistics for the sample.
+
+    Returns:
+        float: calculation time in seconds.
+    """
+    start = time.perf_counter()
+    calculate(sample)
+    return time.perf_counter() - start
+
+
+def calibration_sample(
+    feature_ids: List[int], sample_size: int = CALIBRATION_SAMPLE_SIZE
+) -> List[int]:
+    """
+    Picks features evenly spread over the ordered feature ids.
+
+    Args:
+        feature_ids (List[int]): ordered feature ids.
+        sample_size (int): maximal number of features in the sample.
+
+    Returns:
+        List[int]: ids of sample features.
+    """
+    step = max(1, len(feature_ids) // sample_size)
+    return feature_ids[::step][:sample_size]
+
+
+def choose_parallelism(
+    features_count: int,
+    costs: Dict[int, float],
+    sample_cost: float,
+    sample_seconds: float,
+    raster_layouts: List[RasterLayout],
+    max_threads: int,
+) -> TuningDecision:
+    """
+    Chooses the number of subtasks and the batch size. The total calculation time is extrapolated from
+    the calibration run, and subtasks are used only if every one of them gets enough work to pay off its
+    start-up overhead. Batches are never smaller than a single raster block, so that every block read
+    from disk is used by more than one tiny batch.
+
+    Args:
+        features_count (int): number of features in input vector layer.
+        costs (Dict[int, float]): estimated cost of each feature.
+        sample_cost (float): estimated cost of features used in calibration run.
+        sample_seconds (float): time of calibration run.
+        raster_layouts (List[RasterLayout]): layouts of rasters used in calculation.
+        max_threads (int): number of threads available for QGIS tasks.
+
+    Returns:
+        TuningDecision: chosen values with the reasoning.
+    """
+    reasons: List[str] = []
+    total_cost = sum(costs.values())
+    seconds_per_cost = sample_seconds / sample_cost if sample_cost > 0 else 0.0
+    estimated_seconds = total_cost * seconds_per_cost
+    reasons.append(
+        f"{features_count} polygons with total estimated cost {total_cost:.0f} raster cells; "
+        f"calibration run took {sample_seconds:.2f} s for cost {sample_cost:.0f}, "
+        f"so the whole calculation should take about {estimated_seconds:.1f} s"
+    )
+    if raster_layouts:
+        raster_cells = sum(layout.cells_count for layout in raster_layouts)
+        reasons.append(
+            f"rasters have {raster_cells} cells in total, blocks of "
+            + ", ".join(
+                f"{layout.block_width}x{layout.block_height}"
+                for layout in raster_layouts
+            )
+        )
+
+    if features_count <= 1 or estimated_seconds < MIN_PARALLEL_SECONDS:
+        subtasks_count = 1
+        reasons.append(
+            f"calculation is shorter than {MIN_PARALLEL_SECONDS:.0f} s, "
+            "overhead of subtasks wouldn't pay off - using 1 subtask"
+        )
+    else:
+        subtasks_count = min(
+            max_threads,
+            features_count,
+            max(1, int(estimated_seconds // MIN_SUBTASK_SECONDS)),
+        )
+        reasons.append(
+            f"{max_threads} threads available in QGIS, every subtask should get at least "
+            f"{MIN_SUBTASK_SECONDS:.0f} s of work - using {subtasks_count} subtasks"
+        )
+
+    batches_count = subtasks_count * CHUNKS_PER_SUBTASK if subtasks_count > 1 else 1
+    if raster_layouts and batches_count > 1:
+        block_cells = max(layout.block_cells_count for layout in raster_layouts)
+        max_batches_count = max(subtasks_count, int(total_cost // max(1, block_cells)))
+        if max_batches_count < batches_count:
+            batches_count = max_batches_count
+            reasons.append(
+                f"batches limited to {batches_count} so each of them covers "
+                "at least one raster block"
+            )
+    batch_size = math.ceil(features_count / max(1, batches_count))
+    reasons.append(f"batch size set to {batch_size} polygons")
+
+    return TuningDecision(subtasks_count, batch_size, reasons)
+
+
+def subtask_cache_bytes(subtasks_count: int) -> float:
+    """
+    Args:
+        subtasks_count (int): number of subtasks running at the same time.
+
+    Returns:
+        float: part of GDAL block cache available to a single subtask, subtasks share the cache.
+    """
+    return gdal.GetCacheMax() / max(1, subtasks_count)
+
+
+def raster_sequential_limit(memory_budget: int, subtasks_count: int) -> float:
+    """
+    Args:
+        memory_budget (int): memory budget of the calculation in bytes, 0 if it's not limited.
+        subtasks_count (int): number of subtasks running at the same time.
+
+    Returns:
+        float: memory raster-sequential strategy may use for a single batch - part of the budget left to
+            a subtask after the smallest raster chunk and block cache or the default limit without budget.
+    """
+    if not memory_budget:
+        return RASTER_SEQUENTIAL_MEMORY_LIMIT
+    minimal_buffers = MIN_CELLS_IN_MEMORY * CHUNK_CELL_BYTES + MIN_SUBTASK_CACHE_BYTES
+    return max(0.0, memory_budget / max(1, subtasks_count) - minimal_buffers)
+
+
+def plan_memory(
+    memory_budget: int, subtasks_count: int, batch_memory: float
+) -> MemoryPlan:
+    """
+    Divides the memory budget between subtasks. Every subtask needs memory for polygons and statistics
+    of its batch, a chunk of raster cells read by exactextract and its part of GDAL block cache. The number
+    of subtasks is lowered until each of them gets at least the smallest chunk and cache, memory left to
+    a subtask on top of them is split evenly between its chunk and its cache.
+
+    Args:
+        memory_budget (int): memory budget of the calculation in bytes.
+        subtasks_count (int): requested number of subtasks.
+        batch_memory (float): estimated memory of polygons and statistics of the biggest batch.
+
+    Returns:
+        MemoryPlan: number of subtasks, chunk size and cache size with the reasoning.
+    """
+    megabyte = 1024 * 1024
+    reasons: List[str] = []
+    minimal_subtask_memory = (
+        batch_memory + MIN_CELLS_IN_MEMORY * CHUNK_CELL_BYTES + MIN_SUBTASK_CACHE_BYTES
+    )
+    fitting_count = max(1, int(memory_budget // minimal_subtask_memory))
+    if fitting_count < subtasks_count:
+        reasons.append(
+            f"every subtask needs at least {minimal_subtask_memory / megabyte:.0f} MB, "
+            f"only {fitting_count} of {subtasks_count} subtasks fit in "
+            f"{memory_budget / megabyte:.0f} MB"
+        )
+        subtasks_count = fitting_count
+    subtask_memory = memory_budget / max(1, subtasks_count)
+    if subtask_memory < minimal_subtask_memory:
+        reasons.append(
+            f"a single subtask needs about {minimal_subtask_memory / megabyte:.0f} MB, more than the budget, "
+            "use smaller batches or feature-sequential strategy"
+        )
+    free_memory = max(0.0, subtask_memory - minimal_subtask_memory)
+    max_cells_in_memory = MIN_CELLS_IN_MEMORY + int(free_memory / 2 / CHUNK_CELL_BYTES)
+    cache_bytes = MIN_SUBTASK_CACHE_BYTES + int(free_memory / 2)
+    reasons.append(
+        f"{subtasks_count} subtasks, each reads at most {max_cells_in_memory} raster cells at once "
+        f"and gets {cache_bytes / megabyte:.0f} MB of GDAL block cache"
+    )
+    return MemoryPlan(
+        subtasks_count, max_cells_in_memory, cache_bytes * subtasks_count, reasons
+    )
+
+
+def count_block_reads(
+    features_info: List[FeatureInfo], layout: RasterLayout
+) -> Tuple[int, int]:
+    """
+    Counts raster blocks read by feature-sequential strategy. Every feature reads all blocks intersecting
+    its bounding box, blocks shared by features are read repeatedly unless they stay in GDAL cache.
+
+    Args:
+        features_info (List[FeatureInfo]): bounding boxes of features of the batch in CRS of features.
+        layout (RasterLayout): layout of the raster.
+
+    Returns:
+        Tuple[int, int]: number of block reads and number of distinct blocks.
+    """
+    blocks = np.zeros(
+        (
+            math.ceil(layout.height / layout.block_height),
+            math.ceil(layout.width / layout.block_width),
+        ),
+        dtype=bool,
+    )
+    reads = 0
+    for info in layout.raster_features(features_info):
+        if math.isnan(info.xmin):
+            continue
+        span = layout.block_span(info.xmin, info.ymin, info.xmax, info.ymax)
+        if span is None:
+            continue
+        first_column, last_column, first_row, last_row = span
+        reads += (last_column - first_column + 1) * (last_row - first_row + 1)
+        blocks[first_row : last_row + 1, first_column : last_column + 1] = True
+    return reads, int(blocks.sum())
+
+
+def raster_sequential_memory(
+    features_info: List[FeatureInfo],
+    raster_layouts: List[RasterLayout],
+    operations_count: int,
+    array_operations: bool,
+) -> float:
+    """
+    Estimates memory raster-sequential strategy needs to keep all polygons of the batch and their
+    statistics until all raster chunks are processed.
+
+    Args:
+        features_info (List[FeatureInfo]): bounding boxes and vertex counts of features of the batch.
+        raster_layouts (List[RasterLayout]): layouts of rasters.
+        operations_count (int): number of calculated operations.
+        array_operations (bool): whether operations returning arrays of cell values are calculated,
+            they keep a value of every covered cell.
+
+    Returns:
+        float: estimated memory in bytes.
+    """
+    bands_count = sum(layout.bands_count for layout in raster_layouts)
+    memory = sum(info.vertices for info in features_info) * VERTEX_BYTES
+    memory += len(features_info) * bands_count * operations_count * STATISTIC_BYTES
+    if array_operations:
+        for layout in raster_layouts:
+            cell_area = abs(layout.geotransform[1] * layout.geotransform[5])
+            if not layout.comparable:
+                continue
+            for info in layout.raster_features(features_info):
+                if math.isnan(info.xmin) or cell_area == 0:
+                    continue
+                cells = (info.xmax - info.xmin) * (info.ymax - info.ymin) / cell_area
+                memory += cells * layout.bands_count * 8
+    return memory
+
+
+def estimate_batch_memory(
+    features_info: List[FeatureInfo],
+    strategy: str,
+    raster_layouts: List[RasterLayout],
+    operations_count: int,
+    array_operations: bool,
+) -> float:
+    """
+    Estimates memory of polygons and statistics a subtask keeps while calculating the batch. Raster-sequential
+    strategy keeps all polygons of the batch, feature-sequential strategy only one polygon at a time.
+
+    Args:
+        features_info (List[FeatureInfo]): bounding boxes and vertex counts of features of the batch.
+        strategy (str): exactextract strategy of the batch.
+        raster_layouts (List[RasterLayout]): layouts of rasters.
+        operations_count (int): number of calculated operations.
+        array_operations (bool): whether operations returning arrays of cell values are calculated.
+
+    Returns:
+        float: estimated memory in bytes.
+    """
+    if strategy == RASTER_SEQUENTIAL:
+        return raster_sequential_memory(
+            features_info, raster_layouts, operations_count, array_operations
+        )
+    return max(
+        (
+            raster_sequential_memory(
+                [info], raster_layouts, operations_count, array_operations
+            )
+            for info in features_info
+        ),
+        default=0.0,
+    )
+
+
+def choose_strategy(
+    features_info: List[FeatureInfo],
+    raster_layouts: List[RasterLayout],
+    operations_count: int,
+    array_operations: bool,
+    cache_bytes: float,
+    memory_limit: float = RASTER_SEQUENTIAL_MEMORY_LIMIT,
+) -> StrategyDecision:
+    """
+    Chooses exactextract strategy for a batch. Feature-sequential strategy reads blocks under every feature,
+    so blocks shared by features are read and decompressed repeatedly once they don't fit in GDAL cache.
+    Raster-sequential strategy reads every block once but keeps all polygons of the batch and their
+    statistics in memory. Raster-sequential is chosen when repeated reads, weighted by their cost for
+    compressed and remote rasters, outweigh reading every block once and the memory it needs is acceptable.
+
+    Args:
+        features_info (List[FeatureInfo]): bounding boxes and vertex counts of features of the batch.
+        raster_layouts (List[RasterLayout]): layouts of rasters.
+        operations_count (int): number of calculated operations.
+        array_operations (bool): whether operations returning arrays of cell values are calculated.
+        cache_bytes (float): GDAL block cache available to the subtask.
+        memory_limit (float): memory raster-sequential strategy may use, see `raster_sequential_limit`.
+
+    Returns:
+        StrategyDecision: chosen strategy with the reason.
+    """
+    if not raster_layouts:
+        return StrategyDecision(
+            FEATURE_SEQUENTIAL, "block layout of rasters can't be read by GDAL"
+        )
+    if not all(layout.comparable for layout in raster_layouts):
+        return StrategyDecision(
+            FEATURE_SEQUENTIAL,
+            "polygons can't be transformed to CRS of rasters, raster blocks they cover are unknown",
+        )
+    memory = raster_sequential_memory(
+        features_info, raster_layouts, operations_count, array_operations
+    )
+    megabyte = 1024 * 1024
+    if memory > memory_limit:
+        return StrategyDecision(
+            FEATURE_SEQUENTIAL,
+            f"raster-sequential would keep about {memory / megabyte:.0f} MB of polygons "
+            f"and statistics in memory (limit {memory_limit / megabyte:.0f} MB)",
+        )
+    reads = distinct = 0
+    distinct_bytes = repeated_cost = 0.0
+    for layout in raster_layouts:
+        layout_reads, layout_distinct = count_block_reads(features_info, layout)
+        reads += layout_reads
+        distinct += layout_distinct
+        distinct_bytes += layout_distinct * layout.block_bytes
+        read_cost = EXPENSIVE_READ_COST if layout.expensive_reads else 1.0
+        repeated_cost += (
+            (layout_reads - layout_distinct) * layout.block_bytes * read_cost
+        )
+    repeated = reads - distinct
+    if repeated == 0:
+        return StrategyDecision(
+            FEATURE_SEQUENTIAL, f"none of {reads} raster blocks is read more than once"
+        )
+    if distinct_bytes <= cache_bytes:
+        return StrategyDecision(
+            FEATURE_SEQUENTIAL,
+            f"{distinct} raster blocks ({distinct_bytes / megabyte:.0f} MB) fit in GDAL cache, "
+            f"{repeated} repeated reads are served from it",
+        )
+    if repeated_cost > distinct_bytes:
+        expensive = sorted(
+            {
+                layout.compression or "remote"
+                for layout in raster_layouts
+                if layout.expensive_reads
+            }
+        )
+        return StrategyDecision(
+            RASTER_SEQUENTIAL,
+            f"feature-sequential would read {reads} raster blocks, {repeated} of them repeatedly"
+            f" ({', '.join(expensive) if expensive else 'uncompressed'} blocks); raster-sequential "
+            f"reads {distinct} blocks once and needs about {memory / megabyte:.0f} MB",
+        )
+    return StrategyDecision(
+        FEATURE_SEQUENTIAL,
+        f"only {repeated} of {reads} raster block reads are repeated",
+    )
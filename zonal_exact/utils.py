@@ -1,3 +1,9 @@
+from typing import Callable
+
+# prefix of GDAL virtual raster connection strings, e.g. `vrt://raster.tif?bands=1,3`
+VRT_CONNECTION_PREFIX = "vrt://"
+
+
 def extract_function_name(custom_function_str: str) -> str:
     """
     Extract the function name from the custom function string
@@ -12,3 +18,34 @@ def extract_function_name(custom_function_str: str) -> str:
     for line in lines:
         if line.strip().startswith("def "):
             return line.split()[1].split("(")[0]
+
+
+def create_custom_function(custom_function_str: str) -> Callable:
+    """
+    Creates callable custom function from the function string
+
+    Args:
+        custom_function_str (str): function string defined by user.
+
+    Returns:
+        Callable: function defined in the function string
+    """
+    namespace = {}
+    exec(custom_function_str, namespace)
+    return namespace[extract_function_name(custom_function_str)]
+
+
+def source_file_path(uri: str) -> str:
+    """
+    Unwraps GDAL virtual raster connection strings (`vrt://path?options`), so modification time and size
+    of the file they read can be checked.
+
+    Args:
+        uri (str): path or GDAL connection string of the raster.
+
+    Returns:
+        str: path to the file read by the connection string or the URI itself.
+    """
+    while uri.startswith(VRT_CONNECTION_PREFIX):
+        uri = uri[len(VRT_CONNECTION_PREFIX) :].split("?", 1)[0]
+    return uri
@@ -4,11 +4,51 @@ by Ben W: https://gis.stackexchange.com/users/100254/ben-w
 created by: Jakub Charyton, 2024
 """
 
-from typing import List
+from typing import Dict, List, Optional
 from qgis.PyQt import QtWidgets, QtCore
 from qgis.core import QgsMapLayerType, QgsRasterLayer
 
 
+class BandSelectionDialog(QtWidgets.QDialog):
+    def __init__(self, layer: QgsRasterLayer, selected_bands: List[int], parent=None):
+        """
+        Dialog with checkable list of bands of the raster layer.
+
+        Args:
+            layer (QgsRasterLayer): The raster layer.
+            selected_bands (List[int]): Numbers of currently selected bands, all bands are checked if empty.
+            parent: The parent widget.
+        """
+        super().__init__(parent)
+        self.setWindowTitle(f"Bands of {layer.name()}")
+        self.bands_list = QtWidgets.QListWidget()
+        for band in range(1, layer.bandCount() + 1):
+            item = QtWidgets.QListWidgetItem(layer.bandName(band))
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            checked = not selected_bands or band in selected_bands
+            item.setCheckState(QtCore.Qt.Checked if checked else QtCore.Qt.Unchecked)
+            self.bands_list.addItem(item)
+        buttons = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.bands_list)
+        layout.addWidget(buttons)
+
+    def checked_bands(self) -> List[int]:
+        """
+        Returns:
+            List[int]: Numbers of checked bands, starting from 1.
+        """
+        return [
+            n + 1
+            for n in range(self.bands_list.count())
+            if self.bands_list.item(n).checkState() == QtCore.Qt.Checked
+        ]
+
+
 class MultiRasterLayerSelectionWidget(QtWidgets.QListWidget):
     def __init__(self, parent=None):
         """
@@ -20,6 +60,10 @@ class MultiRasterLayerSelectionWidget(QtWidgets.QListWidget):
         super().__init__()
         self.project = None
         self.previously_selected: List[str] = []
+        # layer name: numbers of bands selected by user, all bands are used if layer is missing
+        self.selected_bands: Dict[str, List[int]] = {}
+        self.setToolTip("Double-click a multiband raster to choose its bands")
+        self.itemDoubleClicked.connect(self.select_bands)
 
     def setup(self, project):
         """
@@ -76,7 +120,7 @@ class MultiRasterLayerSelectionWidget(QtWidgets.QListWidget):
             for layer in self.project.mapLayers().values()
             if layer.type() == QgsMapLayerType.RasterLayer
         ]
-        items = [f"{layer.name()} [{layer.crs().authid()}]" for layer in layers]
+        items = [self.item_text(layer) for layer in layers]
         for s in items:
             name = s.split(" ")[0]
             i = QtWidgets.QListWidgetItem(s)
@@ -86,3 +130,65 @@ class MultiRasterLayerSelectionWidget(QtWidgets.QListWidget):
             else:
                 i.setCheckState(QtCore.Qt.Unchecked)
             self.addItem(i)
+
+    def item_text(self, layer: QgsRasterLayer) -> str:
+        """
+        Args:
+            layer (QgsRasterLayer): The raster layer.
+
+        Returns:
+            str: Text of the list item - layer name, CRS and selected bands.
+        """
+        return f"{layer.name()} [{layer.crs().authid()}]{self.bands_description(layer)}"
+
+    def layer_bands(self, layer: QgsRasterLayer) -> Optional[List[int]]:
+        """
+        Args:
+            layer (QgsRasterLayer): The raster layer.
+
+        Returns:
+            Optional[List[int]]: Numbers of bands selected by user or None if all bands are used.
+        """
+        return self.selected_bands.get(layer.name())
+
+    def bands_description(self, layer: QgsRasterLayer) -> str:
+        """
+        Args:
+            layer (QgsRasterLayer): The raster layer.
+
+        Returns:
+            str: Selected bands shown next to the layer name, empty if all bands are used.
+        """
+        bands = self.layer_bands(layer)
+        if not bands:
+            return ""
+        return f" (bands {', '.join(str(band) for band in bands)})"
+
+    def select_bands(self, item: QtWidgets.QListWidgetItem):
+        """
+        Opens the dialog choosing bands of the double-clicked raster. Only selected bands are read
+        during calculation.
+
+        Args:
+            item (QtWidgets.QListWidgetItem): The double-clicked item.
+        """
+        name = item.text().split(" ")[0]
+        layer = next(
+            (
+                layer
+                for layer in self.project.mapLayers().values()
+                if layer.type() == QgsMapLayerType.RasterLayer and layer.name() == name
+            ),
+            None,
+        )
+        if layer is None or layer.bandCount() < 2:
+            return
+        dialog = BandSelectionDialog(layer, self.selected_bands.get(name, []), self)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return
+        bands = dialog.checked_bands()
+        if not bands or len(bands) == layer.bandCount():
+            self.selected_bands.pop(name, None)
+        else:
+            self.selected_bands[name] = bands
+        item.setText(self.item_text(layer))
@@ -34,6 +34,8 @@ from .resources import *  # noqa: F403
 # Import the code for the dialog
 from .zonal_exact_dialog import ZonalExactDialog
 from .user_communication import UserCommunication
+from .process_pool import ProcessPoolBackend
+from .tuning import available_threads
 
 
 class ZonalExact:
@@ -54,6 +56,9 @@ class ZonalExact:
         self.project = QgsProject.instance()
         # initialize UserCommunication
         self.uc = UserCommunication(iface, "Zonal ExactExtract")
+        # pool of worker processes used by "processes" backend, it's kept alive between dialog runs
+        # so workers don't import libraries and open datasets again with every calculation
+        self.process_backend = ProcessPoolBackend(available_threads())
         # initialize plugin directory
         self.plugin_dir = os.path.dirname(__file__)
         # initialize locale
@@ -183,6 +188,7 @@ class ZonalExact:
         for action in self.actions:
             self.iface.removePluginRasterMenu(self.tr("&Zonal Exact Extract"), action)
             self.iface.removeToolBarIcon(action)
+        self.process_backend.shutdown()
 
     def run(self):
         """Run method that performs all the real work"""
@@ -196,6 +202,7 @@ class ZonalExact:
                 iface=self.iface,
                 task_manager=self.task_manager,
                 project=self.project,
+                process_backend=self.process_backend,
             )
 
         # show the dialog
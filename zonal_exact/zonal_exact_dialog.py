@@ -23,9 +23,12 @@
 """
 
 import os
+import shutil
+import tempfile
 from typing import Dict, List
 from pathlib import Path
 
+from osgeo import gdal
 from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets, QtCore
 from qgis.core import (
@@ -38,13 +41,48 @@ from qgis.core import (
     QgsRasterLayer,
     QgsMapLayer,
     QgsProject,
-    QgsFeatureRequest,
     QgsVectorFileWriter,
 )
 
+from .band_ranges import (
+    BandRange,
+    band_sources,
+    split_band_ranges,
+    split_batches_by_bands,
+)
+from .checkpoint import RunCheckpoint, run_directory, run_key
+from .coverage_index import CoverageIndexStore, read_grid, split_linear_stats
 from .dialog_input_dto import DialogInputDTO
+from .csv_output import COMPRESSION_SUFFIXES, compressed_path, zstd_available
+from .layer_writer import StreamingLayerWriter
+from .incremental import (
+    IncrementalUpdate,
+    increment_path,
+    patch_layer,
+    patch_table,
+    remove_increment,
+)
 from .user_communication import UserCommunication, WidgetPlainTextWriter
-from .task_classes import CalculateStatsTask, MergeStatsTask
+from .task_classes import (
+    BatchQueue,
+    CalculateStatsTask,
+    FeatureSubsetSource,
+    MergeStatsTask,
+    PlanBatchesTask,
+    calculate_statistics,
+)
+from .parquet_output import PARQUET_EXTENSION, parquet_available
+from .partitioning import FeatureBatch
+from .process_pool import BatchJob, ProcessPoolBackend, export_for_workers
+from .result_buffer import ResultBuffer
+from .result_cache import (
+    ResultCache,
+    default_cache_path,
+    file_signature,
+    operation_key,
+)
+from .sharded_output import UNION_EXTENSION, ShardedOutput
+from .tuning import DEFAULT_MAX_CELLS_IN_MEMORY, MemoryPlan, resolve_strategy
 from .widgets.codeEditor import CodeEditorUI
 from .utils import extract_function_name
 
@@ -73,6 +111,7 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         iface=None,
         project: QgsProject = None,
         task_manager: QgsTaskManager = None,
+        process_backend: ProcessPoolBackend = None,
     ):
         """
         Initialize the ZonalExactDialog class.
@@ -83,6 +122,8 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
             iface: The QGIS interface (default: None).
             project: The QGIS project (default: None).
             task_manager: An instance of the QgsTaskManager class (default: None).
+            process_backend: The pool of worker processes kept alive between calculations (default: None).
+                If not given, the dialog starts its own pool when "processes" backend is used.
         """
         super(ZonalExactDialog, self).__init__(parent)
         # Set up the user interface from Designer through FORM_CLASS.
@@ -94,10 +135,12 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         self.dialog_input: DialogInputDTO = None
         # Initiate an empty list for storing tasks in queue
         self.tasks = []
-        # Initiate an empty list to store intermediate results of zonal statistics calculation
-        self.intermediate_result_list = []
+        # Initiate an empty buffer to store intermediate results of zonal statistics calculation
+        self.intermediate_result_list = ResultBuffer()
         # Initiate main task that will hold aggregated data from child calculating tasks
         self.merge_task: MergeStatsTask = None
+        # task planning batches before calculation subtasks are created
+        self.plan_task: PlanBatchesTask = None
         self.output_attribute_layer = None
         self.calculated_stats_list = []
         self.temp_index_field = None
@@ -105,6 +148,22 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         self.features_count = None
         self.geospatial_output = False
         self.input_attributes_dict = {}
+        # pool of worker processes and directory with their files used by "processes" backend
+        self.process_backend: ProcessPoolBackend = process_backend
+        self.worker_dir: str = None
+        # checkpoints of the running calculation
+        self.checkpoint: RunCheckpoint = None
+        # geometry hashes of the output updated incrementally
+        self.incremental: IncrementalUpdate = None
+        # coverage fractions shared by rasters on the same grid
+        self.coverage_store: CoverageIndexStore = None
+        # division of the memory budget between subtasks and GDAL block cache size to restore after calculation
+        self.memory_plan: MemoryPlan = None
+        self.previous_cache_max: int = None
+        # writer of geospatial output shared by calculation subtasks
+        self.layer_writer: StreamingLayerWriter = None
+        # shards written by calculation subtasks, united by a virtual layer
+        self.sharded_output: ShardedOutput = None
         # it holds custom functions and should reflect mCustomFunctionsComboBox content
         self.custom_functions_dict: Dict[str, str] = {}
         # assign qgis internal variables to class variables
@@ -142,6 +201,11 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         if self.mVectorLayerComboBox.currentLayer():
             self.mFieldComboBox.setLayer(self.mVectorLayerComboBox.currentLayer())
         self.mVectorLayerComboBox.layerChanged.connect(self.set_field_vector_layer)
+        # changed raster extent is given in CRS of the vector layer
+        if self.iface is not None:
+            self.mChangedExtentGroupBox.setMapCanvas(self.iface.mapCanvas())
+        self.set_changed_extent_crs()
+        self.mVectorLayerComboBox.layerChanged.connect(self.set_changed_extent_crs)
         # set temp_index_field class variable when user selects another index field
         if self.mFieldComboBox.currentField():
             self.temp_index_field = self.mFieldComboBox.currentField()
@@ -150,6 +214,8 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         self.mWeightsLayerComboBox.setCurrentIndex(0)
 
         self.mCalculateButton.clicked.connect(self.calculate)
+        self.mBackendComboBox.currentTextChanged.connect(self.start_process_backend)
+        self.mClearCacheButton.clicked.connect(self.clear_cache)
 
         self.mAddModifyMetricButton.clicked.connect(self.edit_metric_function)
         self.editor.codeSubmitted.connect(self.modify_code)
@@ -205,15 +271,10 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
             self.input_vector: QgsVectorLayer = self.dialog_input.vector_layer
 
             self.features_count = self.input_vector.featureCount()
-            batch_size = round(self.features_count / self.dialog_input.parallel_jobs)
-
-            # calculate using QgsTask and exactextract
-            self.process_calculations(self.input_vector, batch_size)
-
-            # wait for calculations to finish to continue
-            if self.merge_task is not None:
-                self.merge_task.taskCompleted.connect(self.postprocess)
-                self.merge_task.taskTerminated.connect(self.postprocess)
+            if self.dialog_input.incremental:
+                self.incremental = self.open_incremental_update(self.input_vector)
+            # batches are planned in a task, calculation subtasks are started when it's done
+            self.plan_batches(self.input_vector)
         except ValueError as exc:
             QgsMessageLog.logMessage(f"ERROR: {str(exc)}")
             self.uc.bar_warn(str(exc))
@@ -223,57 +284,210 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
                 self.input_vector.removeSelection()  # remove selection of features after processing
             self.mCalculateButton.setEnabled(True)
 
-    def process_calculations(self, vector: QgsVectorLayer, batch_size: int):
+    def plan_batches(self, vector: QgsVectorLayer):
+        """
+        Starts `PlanBatchesTask` dividing features of the vector layer into batches. Reading features
+        and (with "Auto" subtasks option) the calibration run are done in the task, so QGIS isn't blocked.
+        Calculation subtasks are created by `start_calculations` when planning is done.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+        """
+
+        def calculate_sample(sample: FeatureSubsetSource):
+            return calculate_statistics(
+                sample,
+                rasters=band_sources(
+                    self.dialog_input.raster_layers_path,
+                    self.dialog_input.selected_bands,
+                ),
+                weights=self.dialog_input.weights_layer_path,
+                stats=self.dialog_input.stats_list,
+                include_cols=self.input_attributes_dict,
+                geospatial_output=self.geospatial_output,
+                strategy=resolve_strategy(self.dialog_input.strategy),
+            )
+
+        self.plan_task = PlanBatchesTask(
+            "Planning batches",
+            QgsTask.CanCancel,
+            feature_source=FeatureSubsetSource.from_layer(
+                vector, list(self.input_attributes_dict.keys())
+            ),
+            features_count=self.features_count,
+            rasters=self.dialog_input.raster_layers_path,
+            parallel_jobs=self.dialog_input.parallel_jobs,
+            calculate_sample=calculate_sample,
+            incremental=self.incremental,
+            strategy=self.dialog_input.strategy,
+            operations_count=len(self.dialog_input.stats_list),
+            array_operations=bool(self.dialog_input.arrays_stats_list),
+            memory_budget=self.dialog_input.memory_budget_mb * 1024 * 1024,
+        )
+        self.plan_task.taskChanged.connect(self.widget_console.write_info)
+        self.plan_task.progressChanged.connect(self.update_progress_bar)
+        self.plan_task.taskCompleted.connect(self.start_calculations)
+        self.plan_task.taskTerminated.connect(self.clean)
+        self.task_manager.addTask(self.plan_task)
+
+    def start_calculations(self):
+        """
+        Starts calculation subtasks for batches planned by `PlanBatchesTask`.
+        """
+        try:
+            if self.incremental is not None and not self.plan_task.batches:
+                # no geometry changed, only rows of removed features are dropped
+                self.update_unchanged_output()
+                return
+            self.dialog_input.parallel_jobs = self.plan_task.subtasks_count
+            self.apply_memory_plan(self.plan_task.memory_plan)
+            self.process_calculations(self.input_vector, self.plan_task.batches)
+            # wait for calculations to finish to continue
+            self.merge_task.taskCompleted.connect(self.postprocess)
+            self.merge_task.taskTerminated.connect(self.calculation_terminated)
+        except ValueError as exc:
+            QgsMessageLog.logMessage(f"ERROR: {str(exc)}")
+            self.uc.bar_warn(str(exc))
+            self.widget_console.write_error(str(exc))
+            self.clean()
+        finally:
+            self.plan_task = None
+
+    def apply_memory_plan(self, memory_plan: MemoryPlan):
+        """
+        Sets GDAL block cache to the size planned for all subtasks. Previous size is restored by `clean`.
+
+        Args:
+            memory_plan (MemoryPlan): The division of the memory budget, None if memory is not limited.
+        """
+        self.memory_plan = memory_plan
+        if memory_plan is None:
+            return
+        if self.previous_cache_max is None:
+            self.previous_cache_max = gdal.GetCacheMax()
+        gdal.SetCacheMax(memory_plan.cache_bytes)
+
+    def process_calculations(self, vector: QgsVectorLayer, batches: List[FeatureBatch]):
         """
         Processes the calculations for zonal statistics using exactextract.
         This method initiates a series of tasks to calculate zonal statistics for a given vector layer
-        using exactextract. It creates a `CalculateStatsTask` for each batch of features and adds it
-        as a subtask to a `MergeStatsTask`.
+        using exactextract. Batches are planned by `PlanBatchesTask`: features are ordered along the
+        Hilbert curve before they are cut into batches, so every batch covers a compact raster window,
+        and batches have roughly equal estimated cost (raster cells covered by features and number of
+        their vertices) instead of equal number of features. Batches hold only feature ids, subtasks
+        read their features lazily from the data provider, so features are never copied into memory
+        layers. Batches are put into a `BatchQueue` shared by a fixed number of `CalculateStatsTask`
+        subtasks of a `MergeStatsTask`. Each subtask pulls the next batch as soon as it finishes the
+        previous one, so a single slow batch doesn't decide the total calculation time. With
+        "processes" backend subtasks send batches to a pool of worker processes, so Python custom
+        functions don't serialise on the GIL.
 
         Args:
             vector (QgsVectorLayer): The input vector layer for which to calculate zonal statistics.
-            batch_size (int): The number of features to process in each batch.
+            batches (List[FeatureBatch]): Batches planned by `PlanBatchesTask`.
         """
-        self.intermediate_result_list = []
-        self.merge_task = MergeStatsTask(
-            "Zonal ExactExtract task",
-            QgsTask.CanCancel,
-            result_list=self.intermediate_result_list,
-            index_column=self.temp_index_field,
-            prefix=self.dialog_input.prefix,
-            geospatial_output=self.geospatial_output,
-            output_file_path=self.dialog_input.output_file_path,
-            source_columns=self.input_attributes_dict,
-            source_crs=vector.crs(),
+        # results over the limit are spilled to temporary files
+        self.intermediate_result_list = ResultBuffer(
+            self.dialog_input.result_buffer_mb * 1024 * 1024
         )
-        self.merge_task.taskChanged.connect(self.widget_console.write_info)
-        self.merge_task.progressChanged.connect(self.update_progress_bar)
+        if self.dialog_input.sharded_output:
+            # every subtask writes its own shard, the merge task only unites them
+            self.sharded_output = ShardedOutput(
+                self.dialog_input.output_file_path,
+                self.geospatial_output,
+                vector.crs(),
+                self.dialog_input.prefix,
+                self.input_attributes_dict,
+            )
+            self.sharded_output.prepare()
+        elif self.geospatial_output:
+            # subtasks append results of batches straight to the output file
+            self.layer_writer = StreamingLayerWriter(
+                self.merge_output_path(),
+                vector.crs(),
+                self.dialog_input.prefix,
+                self.input_attributes_dict,
+            )
+        self.merge_task = self.create_merge_task(vector)
 
         self.tasks = []
 
-        feature_ids = vector.allFeatureIds()
-        for i in range(0, self.features_count, batch_size):
-            selection_ids = feature_ids[i : i + batch_size]
-            temp_vector = vector.materialize(
-                QgsFeatureRequest().setFilterFids(selection_ids)
+        if self.dialog_input.checkpoints and not self.incremental_update_active:
+            # increments are small, their batches are not checkpointed
+            batches = self.open_checkpoint(vector, batches)
+        use_processes = self.dialog_input.backend == "processes"
+        result_cache = self.create_result_cache(vector)
+        self.coverage_store = self.create_coverage_store()
+        band_ranges = self.create_band_ranges(use_processes, result_cache)
+        if band_ranges is not None:
+            batches = split_batches_by_bands(batches, band_ranges)
+        for batch in batches:
+            bands_description = ""
+            if batch.band_range is not None:
+                bands_description = (
+                    f", bands {band_ranges[batch.band_range].description()}"
+                )
+            strategy_description = f", {batch.strategy}" if batch.strategy else ""
+            self.widget_console.write_info(
+                f"Prepared batch {batch.batch_id}: {len(batch.feature_ids)} polygons{bands_description}, "
+                f"estimated cost {batch.estimated_cost:.0f} raster cells{strategy_description}"
             )
+        batch_queue = BatchQueue(batches)
+        # row groups of GeoParquet output hold a batch each
+        row_group_size = max((len(batch.feature_ids) for batch in batches), default=0)
+        if self.layer_writer is not None:
+            self.layer_writer.row_group_size = row_group_size
+        if self.sharded_output is not None:
+            self.sharded_output.row_group_size = row_group_size
 
-            stats_list = (
-                self.dialog_input.aggregates_stats_list
-                + self.dialog_input.arrays_stats_list
-                + self.dialog_input.custom_functions_list
-            )
+        subtasks_count = max(1, min(self.dialog_input.parallel_jobs, len(batches)))
+        max_cells_in_memory = DEFAULT_MAX_CELLS_IN_MEMORY
+        if self.memory_plan is not None:
+            max_cells_in_memory = self.memory_plan.max_cells_in_memory
+        job_template = None
+        if use_processes:
+            job_template = self.prepare_process_backend(vector, subtasks_count)
+            if self.checkpoint is not None:
+                # workers write geospatial shards straight to the run directory
+                job_template.shard_dir = str(self.checkpoint.run_dir)
+        for i in range(subtasks_count):
+            feature_source = None
+            if (
+                not use_processes
+                or result_cache is not None
+                or self.coverage_store is not None
+            ):
+                # every subtask reads features of its batches from its own provider snapshot
+                feature_source = FeatureSubsetSource.from_layer(
+                    vector, list(self.input_attributes_dict.keys())
+                )
             calculation_subtask = CalculateStatsTask(
                 f"calculation subtask {i}",
                 flags=QgsTask.Silent,
                 result_list=self.intermediate_result_list,
-                polygon_layer=temp_vector,
+                polygon_layer=None,
                 rasters=self.dialog_input.raster_layers_path,
                 weights=self.dialog_input.weights_layer_path,
-                stats=stats_list,
+                stats=self.dialog_input.stats_list,
                 include_cols=self.input_attributes_dict,
                 geospatial_output=self.geospatial_output,
                 strategy=self.dialog_input.strategy,
+                batch_queue=batch_queue,
+                feature_source=feature_source,
+                process_backend=self.process_backend,
+                job_template=job_template,
+                checkpoint=self.checkpoint,
+                result_cache=result_cache,
+                coverage_store=self.coverage_store,
+                band_ranges=band_ranges,
+                max_cells_in_memory=max_cells_in_memory,
+                layer_writer=self.layer_writer,
+                shard_writer=(
+                    self.sharded_output.create_writer()
+                    if self.sharded_output is not None
+                    else None
+                ),
+                selected_bands=self.dialog_input.selected_bands,
             )
             calculation_subtask.taskChanged.connect(self.widget_console.write_info)
             self.tasks.append(calculation_subtask)
@@ -283,6 +497,454 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
 
         self.task_manager.addTask(self.merge_task)
 
+    def open_checkpoint(
+        self, vector: QgsVectorLayer, batches: List[FeatureBatch]
+    ) -> List[FeatureBatch]:
+        """
+        Opens checkpoints of the calculation in the run directory next to the output file. If the same
+        calculation was interrupted before, results of its finished batches are loaded and only the remaining
+        batches are calculated.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+            batches (List[FeatureBatch]): The planned batches.
+
+        Returns:
+            List[FeatureBatch]: The batches left to calculate.
+        """
+        parameters = self.calculation_parameters(vector)
+        parameters["subset"] = vector.subsetString()
+        parameters["features_count"] = vector.featureCount()
+        # changed input files start a new run, shards of their previous version aren't mixed with new batches
+        parameters["signatures"] = [
+            file_signature(path)
+            for path in [
+                vector.source().split("|")[0],
+                *self.dialog_input.raster_layers_path,
+                self.dialog_input.weights_layer_path,
+            ]
+        ]
+        self.checkpoint = RunCheckpoint.open(
+            run_directory(self.dialog_input.output_file_path), parameters, batches
+        )
+        if self.checkpoint.completed:
+            self.intermediate_result_list.extend(
+                self.checkpoint.load_results(self.geospatial_output)
+            )
+            self.widget_console.write_info(
+                f"Resuming calculation from {self.checkpoint.run_dir}: "
+                f"{len(self.checkpoint.completed)} of {len(self.checkpoint.batches)} batches already done"
+            )
+        else:
+            self.widget_console.write_info(
+                f"Saving checkpoints to {self.checkpoint.run_dir}"
+            )
+        return self.checkpoint.pending_batches
+
+    def calculation_parameters(self, vector: QgsVectorLayer) -> Dict:
+        """
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+
+        Returns:
+            Dict: JSON serializable parameters deciding content of the output, except for input features.
+        """
+        return {
+            "vector": vector.source(),
+            "rasters": self.dialog_input.raster_layers_path,
+            "selected_bands": self.dialog_input.selected_bands or {},
+            "weights": self.dialog_input.weights_layer_path,
+            "stats": self.dialog_input.aggregates_stats_list
+            + self.dialog_input.arrays_stats_list,
+            "custom_functions": self.dialog_input.custom_functions_str_list,
+            "include_cols": list(self.input_attributes_dict.keys()),
+            "geospatial_output": self.geospatial_output,
+            "strategy": self.dialog_input.strategy,
+        }
+
+    def open_incremental_update(self, vector: QgsVectorLayer) -> IncrementalUpdate:
+        """
+        Reads geometry hashes stored with the existing output. If the output was calculated with the same
+        parameters, only new features and features with changed geometry are calculated and patched into it.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+
+        Returns:
+            IncrementalUpdate: The state of the incremental update.
+        """
+        parameters = self.calculation_parameters(vector)
+        parameters["prefix"] = self.dialog_input.prefix
+        incremental = IncrementalUpdate.load(
+            self.dialog_input.output_file_path,
+            run_key(parameters),
+            self.temp_index_field,
+            vector.fields().indexOf(self.temp_index_field),
+        )
+        incremental.changed_extent = self.dialog_input.changed_extent
+        incremental.detect_raster_changes = self.dialog_input.detect_raster_changes
+        if incremental.active:
+            self.widget_console.write_info(
+                f"Updating existing output {self.dialog_input.output_file_path} incrementally"
+            )
+        return incremental
+
+    @property
+    def incremental_update_active(self) -> bool:
+        """
+        Returns:
+            bool: whether the existing output is patched instead of written from scratch.
+        """
+        return self.incremental is not None and self.incremental.active
+
+    def update_unchanged_output(self):
+        """
+        Finishes the incremental update when no geometry has changed. Rows of removed features are dropped
+        from the output and hashes are stored.
+        """
+        try:
+            if self.incremental.removed_ids:
+                self.patch_output(None)
+            self.incremental.save()
+            self.widget_console.write_info("Output is up to date")
+            self.reload_output_layer()
+        finally:
+            self.clean()
+
+    def patch_output(self, increment):
+        """
+        Replaces rows of changed and removed features in the existing output.
+
+        Args:
+            increment: pandas DataFrame or QgsVectorLayer with statistics of changed features or None.
+        """
+        if self.geospatial_output:
+            patch_layer(
+                self.dialog_input.output_file_path,
+                increment,
+                self.temp_index_field,
+                self.incremental.replaced_ids,
+            )
+        else:
+            patch_table(
+                self.dialog_input.output_file_path,
+                increment,
+                self.temp_index_field,
+                self.incremental.replaced_ids,
+            )
+        self.widget_console.write_info(
+            f"Patched {len(self.incremental.changed_ids)} rows and removed "
+            f"{len(self.incremental.removed_ids)} rows of {self.dialog_input.output_file_path}"
+        )
+
+    def reload_output_layer(self) -> bool:
+        """
+        Reloads layers of the project reading the output file, so they show the patched output.
+
+        Returns:
+            bool: whether the output file is loaded in the project.
+        """
+        output_path = Path(self.dialog_input.output_file_path).resolve()
+        reloaded = False
+        for layer in self.project.mapLayers().values():
+            if not isinstance(layer, QgsVectorLayer):
+                continue
+            if Path(layer.source().split("|")[0]).resolve() == output_path:
+                layer.reload()
+                layer.triggerRepaint()
+                reloaded = True
+        return reloaded
+
+    def create_result_cache(self, vector: QgsVectorLayer) -> ResultCache:
+        """
+        Creates the cache of results of single features if user enabled it. Cache is used only for
+        tabular output.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer, geometries are cached in its CRS.
+
+        Returns:
+            ResultCache: The cache with keys of calculated operations or None.
+        """
+        if not self.dialog_input.use_cache or self.geospatial_output:
+            return None
+        stat_codes = (
+            self.dialog_input.aggregates_stats_list
+            + self.dialog_input.arrays_stats_list
+            + self.dialog_input.custom_functions_str_list
+        )
+        return ResultCache(
+            default_cache_path(),
+            self.dialog_input.cache_size_mb,
+            [
+                operation_key(
+                    code,
+                    self.dialog_input.raster_layers_path,
+                    self.dialog_input.weights_layer_path,
+                    self.dialog_input.selected_bands,
+                    vector.crs().authid() or vector.crs().toWkt(),
+                )
+                for code in stat_codes
+            ],
+        )
+
+    def create_coverage_store(self) -> CoverageIndexStore:
+        """
+        Creates the store of coverage indexes if user enabled it and some statistics can be reduced
+        from coverage fractions. Other statistics are calculated by exactextract.
+
+        Returns:
+            CoverageIndexStore: The store of coverage indexes or None.
+        """
+        if self.dialog_input.coverage_index == "off":
+            return None
+        reason = None
+        if self.geospatial_output:
+            reason = "it's used only for tabular (CSV or Parquet) output"
+        grids = set()
+        for raster_path in self.dialog_input.raster_layers_path:
+            grid = read_grid(raster_path)
+            if grid is None:
+                reason = f"{raster_path} can't be opened by GDAL"
+                break
+            grids.add(grid)
+        if reason is None:
+            linear_stats, other_stats = split_linear_stats(
+                self.dialog_input.aggregates_stats_list
+                + self.dialog_input.arrays_stats_list,
+                self.dialog_input.raster_layers_path,
+                self.dialog_input.weights_layer_path,
+            )
+            if not linear_stats:
+                reason = "no linear statistics (count, sum, mean, weighted_sum, weighted_mean) selected"
+        if reason is not None:
+            self.widget_console.write_info(f"Coverage index not used: {reason}")
+            return None
+        other_stats += self.dialog_input.custom_functions_str_list
+        message = (
+            f"Coverage index: {len(self.dialog_input.raster_layers_path)} rasters on {len(grids)} grids, "
+            f"sparse matrix calculates {', '.join(linear_stats)}"
+        )
+        if other_stats:
+            message += f", exactextract calculates {len(other_stats)} other operations"
+        self.widget_console.write_info(message)
+        directory = None
+        if self.dialog_input.coverage_index == "disk":
+            directory = tempfile.mkdtemp(prefix="zonal_exact_coverage_")
+        return CoverageIndexStore(directory)
+
+    def create_band_ranges(
+        self, use_processes: bool, result_cache: ResultCache
+    ) -> List[BandRange]:
+        """
+        Splits bands of rasters into ranges calculated by separate subtasks if user enabled it,
+        so bands of multiband rasters are calculated in parallel.
+
+        Args:
+            use_processes (bool): Whether batches are calculated by worker processes.
+            result_cache (ResultCache): The cache of results of single features or None.
+
+        Returns:
+            List[BandRange]: The band ranges or None if all bands are calculated together.
+        """
+        if not self.dialog_input.bands_per_subtask:
+            return None
+        reason = None
+        band_ranges = None
+        if self.geospatial_output:
+            reason = "it's used only for tabular (CSV or Parquet) output"
+        elif self.sharded_output is not None:
+            reason = "shards hold results of all bands"
+        elif use_processes:
+            reason = "it's not supported by processes backend"
+        elif self.checkpoint is not None:
+            reason = "checkpoints are saved for batches of all bands"
+        elif result_cache is not None:
+            reason = "cached results are stored for whole rasters"
+        elif self.coverage_store is not None:
+            reason = "coverage index calculates all bands on the grid at once"
+        else:
+            band_ranges = split_band_ranges(
+                self.dialog_input.raster_layers_path,
+                self.dialog_input.bands_per_subtask,
+                self.dialog_input.selected_bands,
+            )
+            if band_ranges is None:
+                reason = "some raster can't be opened by GDAL or has no bands"
+            elif len(band_ranges) < 2:
+                reason = "all bands fit in one range"
+        if reason is not None:
+            self.widget_console.write_info(f"Band ranges not used: {reason}")
+            return None
+        bands_count = sum(len(band_range.bands) for band_range in band_ranges)
+        self.widget_console.write_info(
+            f"Band ranges: {bands_count} bands split into {len(band_ranges)} ranges"
+        )
+        return band_ranges
+
+    def clear_cache(self):
+        """
+        Removes all results from the cache of single features.
+        """
+        result_cache = ResultCache(default_cache_path())
+        freed_size = result_cache.size()
+        result_cache.clear()
+        self.widget_console.write_info(
+            f"Cleared cache, freed {freed_size / 1024 / 1024:.1f} MB"
+        )
+
+    def merge_output_path(self) -> Path:
+        """
+        Returns:
+            Path: The file results are merged into - the output or, for incremental update of geospatial output,
+                the file with statistics of changed features patched into the output afterwards.
+        """
+        if self.incremental_update_active and self.geospatial_output:
+            return increment_path(self.dialog_input.output_file_path)
+        return self.dialog_input.output_file_path
+
+    def create_merge_task(self, vector: QgsVectorLayer) -> MergeStatsTask:
+        """
+        Creates the task merging results stored in `intermediate_result_list`.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+
+        Returns:
+            MergeStatsTask: The task connected to the console and the progress bar.
+        """
+        parquet_path = None
+        csv_path = None
+        if not self.geospatial_output and not self.incremental_update_active:
+            # statistics are written by the merge task in batches, increments are patched by postprocess
+            if self.dialog_input.output_file_path.suffix == PARQUET_EXTENSION:
+                parquet_path = self.dialog_input.output_file_path
+            else:
+                csv_path = compressed_path(
+                    self.dialog_input.output_file_path,
+                    self.dialog_input.csv_compression,
+                )
+        merge_task = MergeStatsTask(
+            "Zonal ExactExtract task",
+            QgsTask.CanCancel,
+            result_list=self.intermediate_result_list,
+            index_column=self.temp_index_field,
+            prefix=self.dialog_input.prefix,
+            geospatial_output=self.geospatial_output,
+            output_file_path=self.merge_output_path(),
+            source_columns=self.input_attributes_dict,
+            source_crs=vector.crs(),
+            operations_count=len(self.dialog_input.stats_list),
+            layer_writer=self.layer_writer,
+            sharded_output=self.sharded_output,
+            parquet_path=parquet_path,
+            csv_path=csv_path,
+            csv_compression=self.dialog_input.csv_compression,
+        )
+        merge_task.taskChanged.connect(self.widget_console.write_info)
+        merge_task.progressChanged.connect(self.update_progress_bar)
+        return merge_task
+
+    def calculation_terminated(self):
+        """
+        Called when the calculation failed or was canceled. Results of batches finished before
+        cancellation are merged and saved if user chose to keep partial results, otherwise they're discarded.
+        """
+        if not self.merge_task.isCanceled():
+            if self.incremental_update_active:
+                self.widget_console.write_error(
+                    "Calculation failed, existing output was not updated"
+                )
+                self.clean()
+                return
+            self.postprocess()
+            return
+        finished_batches = len(self.intermediate_result_list)
+        if self.layer_writer is not None:
+            finished_batches += self.layer_writer.batches_count
+        if self.sharded_output is not None:
+            finished_batches += self.sharded_output.batches_count
+        if (
+            not self.dialog_input.keep_partial_results
+            or finished_batches == 0
+            or self.incremental_update_active
+        ):
+            self.widget_console.write_info(
+                "Calculation canceled, partial results discarded"
+            )
+            self.clean()
+            return
+        self.widget_console.write_info(
+            f"Calculation canceled, saving partial results of {finished_batches} batches"
+        )
+        # hashes are not stored for partial output, next update calculates all features
+        self.incremental = None
+        # canceled task can't be run again, partial results are merged by a new one
+        self.merge_task = self.create_merge_task(self.input_vector)
+        self.merge_task.taskCompleted.connect(self.postprocess)
+        self.merge_task.taskTerminated.connect(self.postprocess)
+        self.task_manager.addTask(self.merge_task)
+
+    def prepare_process_backend(
+        self, vector: QgsVectorLayer, workers_count: int
+    ) -> BatchJob:
+        """
+        Prepares the file worker processes read features from. Layers that can't be read directly from their
+        OGR file (see `export_for_workers`) are exported to a temporary GeoPackage once. Pool of worker
+        processes is reused if it's running with one worker for every subtask, otherwise it's resized.
+
+        Args:
+            vector (QgsVectorLayer): The input vector layer.
+            workers_count (int): The number of worker processes, one for every subtask.
+
+        Returns:
+            BatchJob: The job with calculation parameters, without features of any batch.
+        """
+        self.worker_dir = tempfile.mkdtemp(prefix="zonal_exact_")
+        source_path, layer_name, layer_id = export_for_workers(
+            vector, list(self.input_attributes_dict.keys()), self.worker_dir
+        )
+        self.widget_console.write_info(
+            f"Worker processes read features from: {source_path}"
+        )
+        if self.process_backend is None:
+            self.process_backend = ProcessPoolBackend(workers_count)
+        else:
+            self.process_backend.resize(workers_count)
+        job = BatchJob(
+            source_path=source_path,
+            layer_name=layer_name,
+            layer_id=layer_id,
+            rasters=self.dialog_input.raster_layers_path,
+            weights=self.dialog_input.weights_layer_path,
+            stats=self.dialog_input.aggregates_stats_list
+            + self.dialog_input.arrays_stats_list,
+            custom_functions_code=self.dialog_input.custom_functions_str_list,
+            include_cols=list(self.input_attributes_dict.keys()),
+            geospatial_output=self.geospatial_output,
+            strategy=resolve_strategy(self.dialog_input.strategy),
+            shard_dir=self.worker_dir,
+            selected_bands=self.dialog_input.selected_bands or {},
+        )
+        if self.memory_plan is not None:
+            # every worker process has its own GDAL block cache
+            job.max_cells_in_memory = self.memory_plan.max_cells_in_memory
+            job.cache_bytes = self.memory_plan.cache_bytes // max(
+                1, self.memory_plan.subtasks_count
+            )
+        return job
+
+    def start_process_backend(self, backend: str):
+        """
+        Starts worker processes as soon as "processes" backend is selected, so they are ready
+        before the calculation starts.
+
+        Args:
+            backend (str): The selected execution backend.
+        """
+        if backend == "processes" and self.process_backend is not None:
+            self.process_backend.start()
+
     def postprocess(self):
         """
         This method is called after the zonal statistics calculation is complete. It saves the result
@@ -290,53 +952,78 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         output to the input vector layer if necessary.
         """
         try:
-            if not self.geospatial_output:
-                calculated_stats = self.merge_task.calculated_stats
-                message = f"Zonal ExactExtract task result shape: {str(calculated_stats.shape)}"
+            if self.intermediate_result_list.spilled_count:
+                self.widget_console.write_info(
+                    f"{self.intermediate_result_list.spilled_count} of {len(self.intermediate_result_list)} "
+                    "batch results were spilled to disk and read back while merging"
+                )
+            output_file_path = self.dialog_input.output_file_path
+            if self.sharded_output is not None:
+                output_file_path = self.sharded_output.union_path
+                self.widget_console.write_info(
+                    f"Output written as {len(self.sharded_output.shard_paths())} shards in "
+                    f"{self.sharded_output.shards_dir}, united by virtual layer {output_file_path}"
+                )
+            elif not self.geospatial_output:
+                message = f"Zonal ExactExtract task result shape: {str(self.merge_task.result_shape)}"
                 QgsMessageLog.logMessage(message)
                 self.widget_console.write_info(message)
 
-                # save result based on user decided extension
-                if self.dialog_input.output_file_path.suffix == ".csv":
-                    calculated_stats.to_csv(
-                        self.dialog_input.output_file_path, index=False
+                # CSV and Parquet output is written by the merge task, increments are patched into the output
+                if self.incremental_update_active:
+                    self.patch_output(self.merge_task.calculated_stats)
+                elif self.dialog_input.output_file_path.suffix == ".csv":
+                    output_file_path = compressed_path(
+                        output_file_path, self.dialog_input.csv_compression
                     )
+            elif self.incremental_update_active:
+                increment_layer = QgsVectorLayer(
+                    str(increment_path(self.dialog_input.output_file_path)),
+                    "increment",
+                    "ogr",
+                )
+                self.patch_output(increment_layer)
+                increment_layer = None  # release the file before it's removed
+                remove_increment(self.dialog_input.output_file_path)
 
-            # load output into QgsVectorLayer
-            output_attribute_layer = QgsVectorLayer(
-                str(self.dialog_input.output_file_path),
-                Path(self.dialog_input.output_file_path).stem,
-                "ogr",
-            )
+            # load output into QgsVectorLayer, GDAL can't read zstd compressed CSV
+            output_attribute_layer = None
+            if output_file_path.suffix != COMPRESSION_SUFFIXES["zstd"]:
+                layer_source = str(output_file_path)
+                if output_file_path.suffix == COMPRESSION_SUFFIXES["gzip"]:
+                    layer_source = f"/vsigzip/{output_file_path}"
+                output_attribute_layer = QgsVectorLayer(
+                    layer_source,
+                    Path(output_file_path).stem,
+                    "ogr",
+                )
 
-            total_fields = len(output_attribute_layer.fields())
+            # check if the layer was loaded successfully
             if (
-                output_attribute_layer.fields().at(total_fields - 1).name() == "path"
-                and output_attribute_layer.fields().at(total_fields - 2).name()
-                == "layer"
+                output_attribute_layer is not None
+                and not output_attribute_layer.isValid()
             ):
-                output_attribute_layer.startEditing()
-                # Delete the last two fields
-                output_attribute_layer.deleteAttribute(
-                    total_fields - 1
-                )  # delete path field
-                output_attribute_layer.deleteAttribute(
-                    total_fields - 2
-                )  # delete layer field
-                output_attribute_layer.commitChanges()
-
-            # check if the layer was loaded successfully
-            if not output_attribute_layer.isValid():
-                message = (
-                    f"Unable to load layer from {self.dialog_input.output_file_path}"
-                )
+                message = f"Unable to load layer from {output_file_path}"
                 QgsMessageLog.logMessage(message)
                 self.widget_console.write_error(message)
             else:
                 self.widget_console.write_info("Finished calculating statistics")
-                # Add the layer to the project
-                self.project.addMapLayer(output_attribute_layer)
+                if self.incremental is not None:
+                    self.incremental.save()
+                if output_attribute_layer is None:
+                    self.widget_console.write_info(
+                        f"Output written to {output_file_path}, zstd compressed CSV is not loaded into QGIS"
+                    )
+                # Add the layer to the project, patched output is already loaded
+                elif not (
+                    self.incremental_update_active and self.reload_output_layer()
+                ):
+                    self.project.addMapLayer(output_attribute_layer)
                 self.output_attribute_layer = output_attribute_layer
+                if self.checkpoint is not None:
+                    # release shards before the run directory is removed
+                    self.intermediate_result_list.clear()
+                    self.checkpoint.remove()
 
         except Exception as exc:
             QgsMessageLog.logMessage(f"ERROR: {exc}")
@@ -344,11 +1031,14 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         finally:
             self.clean()
 
-    def update_progress_bar(self):
+    def update_progress_bar(self, progress: float):
         """
-        Updates the progress bar using progress values from parent (MergeStatsTask) task
+        Updates the progress bar using progress values from planning task or parent (MergeStatsTask) task
+
+        Args:
+            progress (float): The progress of the task in percents.
         """
-        self.mProgressBar.setValue(self.merge_task.progress())
+        self.mProgressBar.setValue(int(progress))
 
     def clean(self):
         """
@@ -356,9 +1046,32 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         """
         self.dialog_input: DialogInputDTO = None
         self.tasks = []
-        self.intermediate_result_list = []
+        # removes files of spilled results
+        self.intermediate_result_list.clear()
+        self.intermediate_result_list = ResultBuffer()
         self.merge_task: MergeStatsTask = None
+        self.plan_task: PlanBatchesTask = None
+        self.checkpoint: RunCheckpoint = None
+        self.incremental: IncrementalUpdate = None
+        if self.coverage_store is not None:
+            self.coverage_store.clear()
+            self.coverage_store = None
+        if self.layer_writer is not None:
+            # partial output of a canceled or failed calculation
+            self.layer_writer.discard()
+            self.layer_writer = None
+        if self.sharded_output is not None:
+            # shards of a canceled or failed calculation
+            self.sharded_output.discard()
+            self.sharded_output = None
+        self.memory_plan = None
+        if self.previous_cache_max is not None:
+            gdal.SetCacheMax(self.previous_cache_max)
+            self.previous_cache_max = None
         self.calculated_stats_list = []
+        if self.worker_dir is not None:
+            shutil.rmtree(self.worker_dir, ignore_errors=True)
+            self.worker_dir = None
         self.mCalculateButton.setEnabled(True)
 
         self.mProgressBar.setValue(0)
@@ -367,9 +1080,14 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         """
         Gets input values from dialog and puts it into `DialogInputDTO` class object.
         """
-        raster_layers_path: List[QgsRasterLayer] = self.extract_layers_path(
-            self.mRasterLayersList.checked_layers()
-        )
+        raster_layers: List[QgsRasterLayer] = self.mRasterLayersList.checked_layers()
+        raster_layers_path: List[str] = self.extract_layers_path(raster_layers)
+        # only bands selected by user are read, they keep their numbers in names of columns
+        selected_bands: Dict[str, List[int]] = {
+            path: self.mRasterLayersList.layer_bands(layer)
+            for layer, path in zip(raster_layers, raster_layers_path)
+            if self.mRasterLayersList.layer_bands(layer)
+        }
         weights_layer_path: str = None
         if self.mWeightsLayerComboBox.currentLayer():
             weights_layer_path = (
@@ -392,6 +1110,12 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
                 output_file_path=output_file_path,
                 aggregates_stats_list=aggregates_stats_list,
                 arrays_stats_list=arrays_stats_list,
+                incremental=self.mIncrementalCheckBox.isChecked(),
+                dirty_window=self.mRasterBlocksCheckBox.isChecked()
+                or self.mChangedExtentGroupBox.isChecked(),
+                sharded_output=self.mShardedOutputCheckBox.isChecked(),
+                geoparquet=self.mGeoParquetCheckBox.isChecked(),
+                csv_compression=self.mCsvCompressionComboBox.currentText(),
             )
         except ValueError as exc:
             # there's been error during control of the input values
@@ -409,6 +1133,10 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
                     self.custom_functions_dict[selected_function_name]
                 )
 
+        changed_extent = None
+        if self.mChangedExtentGroupBox.isChecked():
+            changed_extent = self.mChangedExtentGroupBox.outputExtent()
+
         self.dialog_input = DialogInputDTO(
             raster_layers_path=raster_layers_path,
             weights_layer_path=weights_layer_path,
@@ -420,6 +1148,22 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
             prefix=prefix,
             custom_functions_str_list=custom_functions,
             strategy=self.mStrategyComboBox.currentText(),
+            backend=self.mBackendComboBox.currentText(),
+            keep_partial_results=self.mKeepPartialResultsCheckBox.isChecked(),
+            checkpoints=self.mCheckpointsCheckBox.isChecked(),
+            use_cache=self.mCacheCheckBox.isChecked(),
+            cache_size_mb=self.mCacheSizeSpinBox.value(),
+            incremental=self.mIncrementalCheckBox.isChecked(),
+            detect_raster_changes=self.mRasterBlocksCheckBox.isChecked(),
+            changed_extent=changed_extent,
+            coverage_index=self.mCoverageIndexComboBox.currentText(),
+            bands_per_subtask=self.mBandsPerSubtaskSpinBox.value(),
+            memory_budget_mb=self.mMemoryBudgetSpinBox.value(),
+            result_buffer_mb=self.mResultBufferSpinBox.value(),
+            sharded_output=self.mShardedOutputCheckBox.isChecked(),
+            geoparquet=self.mGeoParquetCheckBox.isChecked(),
+            csv_compression=self.mCsvCompressionComboBox.currentText(),
+            selected_bands=selected_bands,
         )
 
     def extract_layers_path(self, layers: List[QgsMapLayer]):
@@ -444,6 +1188,11 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         output_file_path: str,
         aggregates_stats_list: List[str],
         arrays_stats_list: List[str],
+        incremental: bool = False,
+        dirty_window: bool = False,
+        sharded_output: bool = False,
+        geoparquet: bool = False,
+        csv_compression: str = "none",
     ):
         """
         Processes the input data by checking the validity of the input parameters.
@@ -458,6 +1207,15 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
             output_file_path: Path - The path to the output file.
             aggregates_stats_list: List[str] - The list of aggregates statistics.
             arrays_stats_list: List[str] - The list of arrays statistics.
+            incremental: bool - Whether the output is updated incrementally, it needs the ID field.
+            dirty_window: bool - Whether polygons in changed raster regions are recalculated, it needs
+                incremental update.
+            sharded_output: bool - Whether the output is written as shards united by a virtual layer, it can't be
+                updated incrementally.
+            geoparquet: bool - Whether Parquet output is written with geometries by GDAL, otherwise it's tabular
+                output written by pyarrow.
+            csv_compression: str - Compression of CSV output, "none", "gzip" or "zstd". Compressed output can't be
+                updated incrementally or written as shards.
         """
         # check if both raster and vector layers are set
         if not raster_layers_path or not vector_layer:
@@ -466,9 +1224,29 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         if not output_file_path:
             err_msg = "You didn't select output file path"
             raise ValueError(err_msg)
-        # check if output file extension is CSV
+        if sharded_output and output_file_path.suffix == UNION_EXTENSION:
+            err_msg = f"Sharded output is united by a {UNION_EXTENSION} virtual layer, select format of shards as output file extension"
+            raise ValueError(err_msg)
+        parquet_output = output_file_path.suffix == PARQUET_EXTENSION
+        if parquet_output and not geoparquet and not parquet_available():
+            err_msg = "Parquet output requires pyarrow library, install it or write GeoParquet output with GDAL"
+            raise ValueError(err_msg)
+        if parquet_output and geoparquet and incremental:
+            err_msg = "GeoParquet output can't be edited, incremental update requires another format"
+            raise ValueError(err_msg)
+        if output_file_path.suffix == ".csv" and csv_compression != "none":
+            if csv_compression == "zstd" and not zstd_available():
+                err_msg = "zstd compression requires zstandard library, install it or use gzip compression"
+                raise ValueError(err_msg)
+            if incremental:
+                err_msg = "Compressed CSV output can't be updated incrementally"
+                raise ValueError(err_msg)
+            if sharded_output:
+                err_msg = "Sharded output can't be compressed"
+                raise ValueError(err_msg)
+        # check if output file extension is CSV or tabular Parquet
         output_file_path_suffix = output_file_path.suffix.strip(".")
-        if output_file_path_suffix != "csv":
+        if output_file_path_suffix != "csv" and not (parquet_output and not geoparquet):
             # check if extension is in OGR allowed extensions
             if (
                 output_file_path_suffix
@@ -489,17 +1267,23 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
             self.input_attributes_dict = {self.temp_index_field: 0}
         # check if ID field is set if output is not geospatial
         if (not self.temp_index_field or self.temp_index_field == "") and (
-            not self.geospatial_output
+            not self.geospatial_output or incremental
         ):
             err_msg = "You didn't select ID field"
             raise ValueError(err_msg)
-        if self.temp_index_field and not self.geospatial_output:
+        if self.temp_index_field and (not self.geospatial_output or incremental):
             # check if values in vector_layer temp_index_field are unique
             id_idx = vector_layer.fields().indexOf(self.temp_index_field)
             id_unique_values = vector_layer.uniqueValues(id_idx)
             if len(id_unique_values) < vector_layer.featureCount():
                 err_msg = f"{self.temp_index_field} field values are not unique. Please select unique field as ID field."
                 raise ValueError(err_msg)
+        if sharded_output and incremental:
+            err_msg = "Incremental update can't be used with sharded output"
+            raise ValueError(err_msg)
+        if dirty_window and not incremental:
+            err_msg = "Recalculating changed raster regions requires incremental update of existing output"
+            raise ValueError(err_msg)
         # check if both stats lists are empty
         if not aggregates_stats_list and not arrays_stats_list:
             err_msg = "You didn't select anything from either Aggregates and Arrays"
@@ -513,6 +1297,17 @@ class ZonalExactDialog(QtWidgets.QDialog, FORM_CLASS):
         if selectedLayer:
             self.mFieldComboBox.setLayer(selectedLayer)
 
+    def set_changed_extent_crs(self):
+        """
+        Sets CRS of the changed raster extent to CRS of the selected vector layer
+        """
+        selected_layer = self.mVectorLayerComboBox.currentLayer()
+        if selected_layer:
+            self.mChangedExtentGroupBox.setOutputCrs(selected_layer.crs())
+            self.mChangedExtentGroupBox.setOriginalExtent(
+                selected_layer.extent(), selected_layer.crs()
+            )
+
     def set_id_field(self):
         """
         Sets index method variable